@@ -2,12 +2,25 @@ import math
 import traceback
 import numpy as np
 
-from config import svc_configs
+from config import svc_configs, current_config
 from Logger import svc_log
 
 configs = svc_configs()
 default_settings  = configs["default"]["settings"]
-offsets_settings = configs["offsets"]["settings"]
+
+# landmark name => index, same order as mp_pose.PoseLandmark (see pose_landmarks in default.settings.yaml)
+pose_landmark_index = { name: idx for idx, name in enumerate(default_settings["pose_landmarks"]) }
+
+
+# Convert the pose landmarks once per frame... usa ra ka beses i-convert, tanan organ mo gamit ani
+# More details
+# This function turns the mediapipe NormalizedLandmarkList into a (33, 4) float32 array of (x, y, z, visibility).
+# An array that is already converted is returned as is, so it can be passed around and shared by every organ class.
+def landmarks_to_array(landmarks):
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks.landmark], dtype=np.float32)
 
 
 """
@@ -22,22 +35,27 @@ This class uses landmarks detected in images to perform various operations such
 
 Attributes:
     landmarks: An object containing landmark data from body pose detection.
+    points: The landmarks as a (33, 4) float32 array of (x, y, z, visibility), converted once per frame.
+    valid: Per landmark flag, True when x and y are inside the image (0..1).
     mp_pose: A module or object that provides access to pose landmarks.
-    cv2: The OpenCV library used for image processing tasks.
+    cv2: The OpenCV library used for image processing tasks, None when nothing is drawn (headless).
     image: The input image on which the landmarks are detected and processed.
+    frame_shape: (height, width) of the frame as the client sent it, when the image was decoded smaller (Decoder.decode_jpeg).
 
 Methods:
-    image_shape: Returns the dimensions of the image.
+    image_shape: Returns the dimensions of the frame (frame_shape), those of the image when not given.
     determine_aspect_ratio: Calculates and identifies the aspect ratio of the image.
     cv2_circle: Draws a circle on the image at a specified position.
-    landmark_list: Provides a list of landmark coordinates.
+    landmark_list: Provides a list of landmark coordinates (x, y, z).
     is_valid_landmark: Checks if a landmark's coordinates are valid.
     center: Calculates the midpoint between two landmarks.
     landmark_pair: Retrieves a pair of landmarks by their names.
     get_landmark: Retrieves a specific landmark by its name.
+    additional_offsets: Computes the distance based calibration offsets for each axis.
     calculate_organ_position: Computes the position of an organ using landmarks and offsets.
     calculate_unity_coordinates: Converts image coordinates to Unity coordinates.
     validate_landmarks_list: Validates the number of landmarks in the list.
+    unity_coordinates: Converts several landmarks to Unity coordinates in one array operation.
     all_unity_coordinates: Computes Unity coordinates for all landmarks.
     calculate_pixel_distance: Calculates the pixel distance between two points.
     calibrate_distance: Converts pixel distance to real-world distance using calibration data.
@@ -45,28 +63,67 @@ Methods:
 """
 class BodyLandmarkPosition:
 
-    def __init__(self, landmarks, mp_pose, cv2, image):
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
         self.landmarks = landmarks
         self.mp_pose = mp_pose
         self.cv2 = cv2
         self.image = image
+        # the pixel math (aspect ratio, distance, unity coordinates) uses the size of the frame the client sent,
+        # the image given to MediaPipe may be a reduced decode of it
+        self.frame_shape = frame_shape
+
+        # Offsets.CompiledOffsets to use, the ones of the current config snapshot unless another set is given (offline recompute)
+        self.compiled_offsets = offsets if offsets is not None else current_config().offsets
+
+        # per frame memo, every organ class created for the same frame (calculate_positions) gets the same dict
+        self.shared = shared if shared is not None else {}
+
+        # settings of the current config snapshot (err_distance, selected_marks), one snapshot for the whole frame
+        if 'settings' not in self.shared:
+            self.shared['settings'] = current_config().settings
+        self.settings = self.shared['settings']
+
+        # everything below is derived once from the landmark array, the getters only index into it
+        if 'points' not in self.shared:
+            points = points if points is not None else landmarks_to_array(landmarks)
+            xy = points[:, :2]
+            self.shared['points'] = points
+            self.shared['valid'] = ((xy >= 0) & (xy <= 1)).all(axis=1).tolist()
+            self.shared['coordinates'] = [tuple(lm) for lm in points[:, :3].tolist()]
+
+        self.points = self.shared['points']
+        self.valid = self.shared['valid']
+        self.coordinates = self.shared['coordinates']
 
     def image_shape(self):
+        if self.frame_shape is not None:
+            return self.frame_shape[0], self.frame_shape[1]
+
         image_height, image_width, _ = self.image.shape
         return image_height, image_width
     
     def cv2_circle(self, color=(0, 0, 255), organ_position=None):
+        # no cv2 => headless frame, nobody sees the image (Inference.process_frame)
+        if self.cv2 is None:
+            return
+
         if organ_position is not None:
             if len(organ_position) == 2:
                 x, y = organ_position
                 # Ensure x and y are integers
                 x = int(x)
                 y = int(y)
+
+                # positions are in frame pixels, draw them where they are on a reduced image
+                if self.frame_shape is not None:
+                    image_height, image_width = self.image.shape[:2]
+                    x = x * image_width // self.frame_shape[1]
+                    y = y * image_height // self.frame_shape[0]
                 
                 self.cv2.circle(self.image, (x, y), 10, color, -1)
 
     def landmark_list(self):
-        return [(lm.x, lm.y, lm.z) for lm in self.landmarks.landmark]
+        return self.coordinates
     
     def is_valid_landmark(self, landmark):
         if not (0 <= landmark[0] <= 1) or not (0 <= landmark[1] <= 1):
@@ -78,11 +135,15 @@ class BodyLandmarkPosition:
         return ((c1[0] + c2[0]) / 2, (c1[1] + c2[1]) / 2, (c1[2] + c2[2]) / 2)
     
     def get_landmark(self, landmark_name):
-        landmarks = self.landmark_list()
-        landmark = landmarks[self.mp_pose.PoseLandmark[landmark_name].value]
-        return landmark if 0 <= landmark[0] <= 1 and 0 <= landmark[1] <= 1 else None
+        idx = pose_landmark_index[landmark_name]
+        return self.coordinates[idx] if self.valid[idx] else None
+
+    def pixel_points(self, indices):
+        image_height, image_width = self.image_shape()
+        return self.points[indices, :2] * np.array([image_width, image_height], dtype=np.float32)
+
     def validate_landmarks_list(self, landmarks_list):
-        if len(landmarks_list) == 33:
+        if len(landmarks_list) == len(pose_landmark_index):
             # print("Validation passed: 33 landmarks found.")
             return True
         else:
@@ -90,16 +151,10 @@ class BodyLandmarkPosition:
             return False
     
     def all_unity_coordinates(self, x_offset=0, y_offset=0, z_offset=0, offset_calibration=None, estimate_distance=None):
-        adjusted_landmarks = []
-
         landmarks_list = self.landmark_list()
 
         if self.validate_landmarks_list(landmarks_list=landmarks_list):
-            for lm in landmarks_list:
-                adjusted_landmark = self.calculate_unity_coordinates(lm, x_offset, y_offset, z_offset, offset_calibration, estimate_distance)
-                adjusted_landmarks.append(adjusted_landmark)
-
-            return adjusted_landmarks
+            return self.unity_coordinates(None, x_offset, y_offset, z_offset, offset_calibration, estimate_distance)
         else:
             return None
     
@@ -117,30 +172,13 @@ class BodyLandmarkPosition:
     Calculates the aspect ratio of the image and compares it with predefined ratios
     to find the closest match. The algorithm involves computing the aspect ratio of 
     the image and checking it against a list of acceptable ratios within a given tolerance.
+    The ratios are parsed once (Offsets.CompiledOffsets) and the match is cached per frame resolution.
     """
     def determine_aspect_ratio(self):
-        image_height, image_width = self.image_shape()
-        # landscape_aspect_ratio = image_width / image_height
-        portrait_aspect_ratio = image_height / image_width
-        aspect_ratio = portrait_aspect_ratio
-
-        # Adjust if needed
-        tolerance = 0.1
-
-        aspect_ratio_list = offsets_settings["aspect_ratio_list"]
-        
-        for aspr in aspect_ratio_list:
-            w, h = aspr.split("_by_")
-            fw = float(w)
-            fh = float(h)
-            
-            if abs(aspect_ratio - (fw / fh)) < tolerance:
-                # remove print for production
-                # print(aspr, " => ", [image_height, image_width, aspect_ratio]) 
-                return aspr
-           
-        svc_log(f"Aspect Ratio Not Identified. [image_height, image_width, aspect_ratio] => [{image_height}, {image_width}, {aspect_ratio}]", "WARN", "BodyLandmarkPosition")
-        return None
+        if 'aspect_ratio' not in self.shared:
+            image_height, image_width = self.image_shape()
+            self.shared['aspect_ratio'] = self.compiled_offsets.aspect_ratio(image_height, image_width)
+        return self.shared['aspect_ratio']
     
 
     #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
@@ -149,16 +187,46 @@ class BodyLandmarkPosition:
     if the landmarks are valid and then returns the coordinates of the specified pair.
     """
     def landmark_pair(self, landmark_name1, landmark_name2):
-        landmark_list = self.landmark_list()
-        l1 = landmark_list[self.mp_pose.PoseLandmark[landmark_name1].value]
-        l2 = landmark_list[self.mp_pose.PoseLandmark[landmark_name2].value]
+        idx1 = pose_landmark_index[landmark_name1]
+        idx2 = pose_landmark_index[landmark_name2]
 
-        if not self.is_valid_landmark(l1) or not self.is_valid_landmark(l2):
+        if not self.valid[idx1] or not self.valid[idx2]:
             return None
   
-        return l1, l2
+        return self.coordinates[idx1], self.coordinates[idx2]
     
 
+    #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    """
+    Returns the (shoulder center, hip center) pair used by every torso organ (heart, lungs, kidney, liver, stomach,
+    intestine), or None when one of the four landmarks is outside of the image. Computed once per frame.
+    """
+    def torso_centers(self):
+        if 'torso_centers' not in self.shared:
+            pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
+            pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
+
+            if pair_shoulder is None or pair_hip is None:
+                self.shared['torso_centers'] = None
+            else:
+                self.shared['torso_centers'] = (self.center(pair_shoulder), self.center(pair_hip))
+
+        return self.shared['torso_centers']
+
+
+    #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    """
+    Computes the additional offset of every axis (x, y, z) from the estimated distance. The offset grows with
+    the distance above the calibration minimum, multiplied by the precompiled signed `target` ("common" or
+    "unity") coefficient of the Offsets.OrganOffsets record. Disabled axes contribute 0.
+    """
+    def additional_offsets(self, offset_calibration, estimate_distance, target):
+        coefficients = offset_calibration.common_coefficients if target == "common" else offset_calibration.unity_coefficients
+        scale = estimate_distance - offset_calibration.minimum
+
+        return [scale * coefficient if coefficient else 0 for coefficient in coefficients]
+
+
     #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
     """
     Computes the position of an organ based on two landmark centers and various offsets.
@@ -173,22 +241,7 @@ class BodyLandmarkPosition:
         z = 0
 
         if offset_calibration is not None and estimate_distance is not None:
-            offsets =  ["x_offset", "y_offset"]
-            offset_additional_stored = []
-
-            for offset in offsets:
-                if offset_calibration[offset]:
-                    if not offset_calibration[offset]["enable"]:
-                        offset_additional_stored.append(0)
-                        continue
-                    
-                    operator = offset_calibration[offset]["operator"]
-                    offset_additional = (estimate_distance - offset_calibration["minimum"]) * offset_calibration[offset]["common"]
-                    
-                    if operator == "subtraction":
-                        offset_additional_stored.append(-offset_additional)
-                    if operator == "addition":
-                        offset_additional_stored.append(offset_additional)
+            offset_additional_stored = self.additional_offsets(offset_calibration, estimate_distance, "common")
 
             x_offset = x_offset + offset_additional_stored[0]
             y_offset = y_offset + offset_additional_stored[1]
@@ -227,22 +280,7 @@ class BodyLandmarkPosition:
         y_unity = (normalized_y - 0.5) * 2
 
         if offset_calibration is not None and estimate_distance is not None:
-            offsets =  ["x_offset", "y_offset", "z_offset"]
-            offset_additional_stored = []
-
-            for offset in offsets:
-                if offset_calibration[offset]:
-                    if not offset_calibration[offset]["enable"]:
-                        offset_additional_stored.append(0)
-                        continue
-                    
-                    operator = offset_calibration[offset]["operator"]
-                    offset_additional = (estimate_distance - offset_calibration["minimum"]) * offset_calibration[offset]["unity"]
-                    
-                    if operator == "subtraction":
-                        offset_additional_stored.append(-offset_additional)
-                    if operator == "addition":
-                        offset_additional_stored.append(offset_additional)
+            offset_additional_stored = self.additional_offsets(offset_calibration, estimate_distance, "unity")
 
             x_offset = x_offset + offset_additional_stored[0]
             y_offset = y_offset + offset_additional_stored[1]
@@ -264,6 +302,35 @@ class BodyLandmarkPosition:
         return position_dict
     
 
+    #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+    """
+    Same conversion as calculate_unity_coordinates but for many landmarks at once (all 33 when `indices` is None).
+    The calibration offsets are computed once and the whole set is converted with a few NumPy expressions on the
+    landmark array, then returned as the usual list of {'x','y','z'} dicts.
+    """
+    def unity_coordinates(self, indices=None, x_offset=0, y_offset=0, z_offset=0, offset_calibration=None, estimate_distance=None):
+        image_height, image_width = self.image_shape()
+
+        if offset_calibration is not None and estimate_distance is not None:
+            offset_additional_stored = self.additional_offsets(offset_calibration, estimate_distance, "unity")
+
+            x_offset = x_offset + offset_additional_stored[0]
+            y_offset = y_offset + offset_additional_stored[1]
+            z_offset = z_offset + offset_additional_stored[2]
+
+        points = self.points if indices is None else self.points[indices]
+        points = points[:, :3].astype(np.float64)
+
+        x_unity = (points[:, 0] - 0.5) * 2
+        y_unity = ((1 - points[:, 1]) - 0.5) * 2  # Inverting y-coordinate
+
+        x_unity_adjusted = np.round((x_unity * image_width / 100) + x_offset, 4).tolist()
+        y_unity_adjusted = np.round((y_unity * image_height / 100) + y_offset, 4).tolist()
+        z_unity_adjusted = np.floor((((image_width * points[:, 2]) + 3) / 300) + z_offset).astype(np.int64).tolist()
+
+        return [{ 'x': x, 'y': y, 'z': z } for x, y, z in zip(x_unity_adjusted, y_unity_adjusted, z_unity_adjusted)]
+
+
     #-------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
     """
     Estimates the distance between landmarks based on pixel measurements and calibration data. 
@@ -271,19 +338,33 @@ class BodyLandmarkPosition:
     and returns the estimated distance if it falls within the specified range.
     """
     def estimate_distance(self, offset_calibration):
-        Nose = self.get_landmark('NOSE')
-        pair_foot = self.landmark_pair('LEFT_FOOT_INDEX', 'RIGHT_FOOT_INDEX') 
+        calibration = self.calibrated_distance()
 
-        if Nose and pair_foot:
-            center_foot = self.center(pair_foot)
+        # print(calibration)
+        if calibration is not None and calibration > offset_calibration.minimum and calibration < offset_calibration.maximum: 
+            return calibration
 
-            # normalized the coordinates to pixel coordinates
-            image_height, image_width = self.image.shape[:2]
-            nose_pixel = (int(Nose[0] * image_width), int(Nose[1] * image_height))
-            foot_pixel = (int(center_foot[0] * image_width), int(center_foot[1] * image_height))
+        return None
 
-            # Calc the pixel distance
-            height_pixels = self.calculate_pixel_distance(nose_pixel, foot_pixel)
+    # Nose to feet distance converted with the known height, the same for every organ so it is computed once
+    # per frame; only the range check of estimate_distance depends on the organ. None if the landmarks are missing.
+    def calibrated_distance(self):
+        if 'calibrated_distance' in self.shared:
+            return self.shared['calibrated_distance']
+
+        calibration = None
+        nose = pose_landmark_index['NOSE']
+        left_foot = pose_landmark_index['LEFT_FOOT_INDEX']
+        right_foot = pose_landmark_index['RIGHT_FOOT_INDEX']
+
+        if self.valid[nose] and self.valid[left_foot] and self.valid[right_foot]:
+            # normalized the coordinates to pixel coordinates, nose and center of the feet in one go (truncated like int())
+            pixels = self.pixel_points([nose, left_foot, right_foot])
+            nose_pixel = np.trunc(pixels[0])
+            foot_pixel = np.trunc((pixels[1] + pixels[2]) / 2)
+
+            # Calc the pixel distance, as a python float so nothing numpy leaks into the JSON results
+            height_pixels = float(self.calculate_pixel_distance(nose_pixel, foot_pixel))
             
             # Calibration estimates
             known_height_pixels = 100
@@ -291,11 +372,8 @@ class BodyLandmarkPosition:
 
             calibration = self.calibrate_distance(height_pixels, known_height_pixels, known_height_meters)
 
-            # print(calibration)
-            if calibration > offset_calibration["minimum"] and calibration < offset_calibration["maximum"]: 
-                return calibration
-    
-            return None
+        self.shared['calibrated_distance'] = calibration
+        return calibration
     
 
 # Classes for calculating positions of various body organs based on detected landmarks:
@@ -310,8 +388,8 @@ class BodyLandmarkPosition:
 # - BodyPositionV2: Alternative version of the BodyPosition class with potential enhancements.
 
 class BrainPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
@@ -325,231 +403,218 @@ class BrainPosition(BodyLandmarkPosition):
         
         center_ear = self.center(pair_ear)
         
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["brain"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "brain")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
 
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position = self.calculate_organ_position(center1=center_ear, center2=nose, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_ear, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position = self.calculate_organ_position(center1=center_ear, center2=nose, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_ear, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
     
 class HeartPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
+        centers = self.torso_centers()
+        if centers is None:
             return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
         
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["heart"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "heart")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
 
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
 
 class LungsPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
+        centers = self.torso_centers()
+        if centers is None:
             return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
         
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["lungs"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "lungs")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
 
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
     
 class KidneyPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
+        centers = self.torso_centers()
+        if centers is None:
             return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
         
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["kidney"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "kidney")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
 
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position =  self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
 class LiverPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
+        centers = self.torso_centers()
+        if centers is None:
             return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
 
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["liver"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "liver")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
 
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
     
 class StomachPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
-            return None 
+        centers = self.torso_centers()
+        if centers is None:
+            return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
 
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["stomach"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "stomach")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
         
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
 
 class IntestinePosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None
         
-        pair_shoulder = self.landmark_pair('LEFT_SHOULDER', 'RIGHT_SHOULDER')
-        pair_hip = self.landmark_pair('LEFT_HIP', 'RIGHT_HIP')
-        if pair_shoulder is None or pair_hip is None:
+        centers = self.torso_centers()
+        if centers is None:
             return None
 
-        center_shoulder = self.center(pair_shoulder)
-        center_hip = self.center(pair_hip)
+        center_shoulder, center_hip = centers
 
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["intestine"]
-        offset_common = offsets["common"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "intestine")
+        offset_common = offsets.common
+        offset_unity = offsets.unity
+        offset_calibration = offsets
         
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common["x_offset"], y_offset=offset_common["y_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        common_position = self.calculate_organ_position(center1=center_shoulder, center2=center_hip, x_offset=offset_common.x, y_offset=offset_common.y, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
+        unity_position = self.calculate_unity_coordinates(center=center_shoulder, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         return common_position, unity_position
 
 
 # Calculate all body landmark  
 class BodyPosition(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_aspect_ratio =  self.determine_aspect_ratio()
         if selected_aspect_ratio is None:
             return None        
 
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["body"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "body")
+        offset_unity = offsets.unity
+        offset_calibration = offsets
         
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        all_unity_position = self.all_unity_coordinates(x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-
-        if all_unity_position is None:
+        if not self.validate_landmarks_list(landmarks_list=self.landmark_list()):
             return None
-        
-        selected_indices  = default_settings["selected_marks"]["body"]
-        selected_landmarks  = [all_unity_position[i] for i in selected_indices]
+
+        # only the selected marks are converted, in one array operation
+        selected_indices  = self.settings["selected_marks"]["body"]
+        selected_landmarks  = self.unity_coordinates(selected_indices, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
 
         return None, selected_landmarks
 
 # Only Calculate the selected body landmark
 class BodyPositionV2(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, shared=None, offsets=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, shared, offsets, frame_shape)
 
     def get_position(self):
         selected_position = []
@@ -558,52 +623,77 @@ class BodyPositionV2(BodyLandmarkPosition):
         if selected_aspect_ratio is None:
             return None  
         
-        offsets = offsets_settings["aspect_ratio"][selected_aspect_ratio]["body"]
-        offset_unity = offsets["unity"]
-        offset_calibration = offsets["calibration"]
+        offsets = self.compiled_offsets.organ(selected_aspect_ratio, "body")
+        offset_unity = offsets.unity
+        offset_calibration = offsets
         
         estimate_distance = self.estimate_distance(offset_calibration)
         if estimate_distance is None:
-            return default_settings["err_distance"]
+            return self.settings["err_distance"]
         
-        selected_body_marks = default_settings["selected_marks"]["body_v2"]
+        selected_body_marks = self.settings["selected_marks"]["body_v2"]
 
         landmarks_list = self.landmark_list()
 
         if self.validate_landmarks_list(landmarks_list=landmarks_list):
-            for i in selected_body_marks:
-                landmark = self.get_landmark(i)
-                if landmark:
-                    position_dict = self.calculate_unity_coordinates(landmark, x_offset=offset_unity["x_offset"], y_offset=offset_unity["y_offset"], z_offset=offset_unity["z_offset"], offset_calibration=offset_calibration, estimate_distance=estimate_distance)
-                    selected_position.append(position_dict)
+            # landmarks outside of the image are skipped, the rest is converted in one array operation
+            selected_indices = [pose_landmark_index[i] for i in selected_body_marks if self.valid[pose_landmark_index[i]]]
+            if selected_indices:
+                selected_position = self.unity_coordinates(selected_indices, x_offset=offset_unity.x, y_offset=offset_unity.y, z_offset=offset_unity.z, offset_calibration=offset_calibration, estimate_distance=estimate_distance)
         
         return None, selected_position
 
-def calculate_position(oType, args):
+organ_classes = {
+    'brain': BrainPosition,
+    'heart': HeartPosition,
+    'lungs': LungsPosition,
+    'kidney': KidneyPosition,
+    'liver': LiverPosition,
+    'stomach': StomachPosition,
+    'intestine': IntestinePosition,
+    'body': BodyPosition,
+    # 'body_v2': BodyPositionV2
+}
+
+
+def calculate_position(oType, args, offsets=None):
         try:
-            brain = BrainPosition
-            heart = HeartPosition
-            lungs = LungsPosition
-            kidney = KidneyPosition
-            liver = LiverPosition
-            stomach =  StomachPosition
-            intestine = IntestinePosition
-            body = BodyPosition
-            # body_v2 = BodyPositionV2
-
-            organs = {
-                'brain': brain,
-                'heart': heart,
-                'lungs': lungs,
-                'kidney': kidney,
-                'liver': liver,
-                'stomach': stomach,
-                'intestine': intestine,
-                'body': body
-            }
-            
-            organ_cls = organs[oType]
-            return organ_cls(**args).get_position()
+            # convert the landmarks once, kept in args so other consumers of the same frame (quiz) reuse it
+            if args.get('points', None) is None:
+                args['points'] = landmarks_to_array(args['landmarks'])
+
+            organ_cls = organ_classes[oType]
+            return organ_cls(**args, offsets=offsets).get_position()
         except Exception as e:
             svc_log(f"Unable to calculate organ position => {e}", "ERROR", "BodyLandmarkPosition")
-            traceback.print_exc()
\ No newline at end of file
+            traceback.print_exc()
+
+
+# Calculate several organs from the same pose landmarks... usa ra ka inference, daghan organ ang ma track
+# More details
+# This function returns { organ: result } for every organ in `oTypes`, every result being exactly what
+# calculate_position would return for that organ (None, err_distance or (common_position, unity_position)).
+# All organ classes of the frame share one memo dict, so the landmark array, the aspect ratio, the shoulder/hip
+# centers and the calibrated distance are computed once; an additional organ only costs its own offsets.
+# An organ that fails is logged and reported as None without affecting the others.
+# `offsets` replaces the offsets of the current config snapshot (Offsets.CompiledOffsets), e.g. to try new offsets offline.
+def calculate_positions(oTypes, args, offsets=None):
+    if args.get('points', None) is None:
+        args['points'] = landmarks_to_array(args['landmarks'])
+
+    # one offsets snapshot for every organ of the frame, even when the config is reloaded meanwhile
+    if offsets is None:
+        offsets = current_config().offsets
+
+    shared = {}
+    results = {}
+
+    for oType in oTypes:
+        try:
+            results[oType] = organ_classes[oType](**args, shared=shared, offsets=offsets).get_position()
+        except Exception as e:
+            svc_log(f"Unable to calculate {oType} position => {e}", "ERROR", "BodyLandmarkPosition")
+            traceback.print_exc()
+            results[oType] = None
+
+    return results
@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import svc_configs
+from Logger import svc_log, worker_log_queue, use_log_queue
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+decode_settings = default_settings.get("decode", {})
+
+
+# JPEG scaled decode, the decoder skips the detail instead of decoding everything and resizing after
+reduced_flags = [(8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)]
+
+# SOF markers (baseline, progressive, ...), the ones holding the image size. C4, C8 and CC are not frames.
+sof_markers = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+# (height, width) from the JPEG's frame header, None when the data is not a JPEG the header can be read from.
+# Only the markers are walked, nothing is decoded.
+def jpeg_size(data):
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    idx = 2
+    while idx + 9 <= len(data):
+        if data[idx] != 0xFF:
+            return None
+
+        marker = data[idx + 1]
+        # fill bytes and markers without a length
+        if marker == 0xFF:
+            idx += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            idx += 2
+            continue
+
+        if marker in sof_markers:
+            height = int.from_bytes(data[idx + 5:idx + 7], byteorder='big')
+            width = int.from_bytes(data[idx + 7:idx + 9], byteorder='big')
+            return (height, width) if height and width else None
+
+        # start of scan comes after the frame header, nothing to find past it
+        if marker == 0xDA:
+            return None
+
+        idx += 2 + int.from_bytes(data[idx + 2:idx + 4], byteorder='big')
+
+    return None
+
+
+# Largest reduction (8, 4, 2) that keeps the long side of the decoded frame at `inference_size` or more.
+def reduction_for(size, inference_size):
+    if not inference_size or inference_size <= 0 or size is None:
+        return 1, cv2.IMREAD_COLOR
+
+    long_side = max(size)
+    for scale, flag in reduced_flags:
+        if -(-long_side // scale) >= inference_size:
+            return scale, flag
+
+    return 1, cv2.IMREAD_COLOR
+
+
+# Decode one JPEG (bytes) into a BGR frame. Returns (frame or None, duration in ms, (height, width) as sent).
+# Runs inside the decoder pool, cv2.imdecode releases the GIL so threads decode in parallel.
+# With an `inference_size` the frame is decoded at 1/2, 1/4 or 1/8 of its size when its long side stays at
+# `inference_size` or more (MediaPipe downsamples to a few hundred pixels anyway). The size returned is still the
+# one the client sent, it is what the organ math is calibrated on (BodyLandmarkPosition.image_shape).
+def decode_jpeg(data, inference_size=0):
+    started = time.perf_counter()
+
+    size = jpeg_size(data) if inference_size else None
+    scale, flag = reduction_for(size, inference_size)
+
+    try:
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    except cv2.error:
+        frame = None
+
+    frame_shape = None
+    if frame is not None:
+        frame_shape = frame.shape[:2]
+
+        if scale > 1:
+            height, width = size
+            reduced = (-(-height // scale), -(-width // scale))
+            # imdecode applies the EXIF orientation, the header size may be the rotated one
+            if frame_shape == reduced:
+                frame_shape = (height, width)
+            elif frame_shape == reduced[::-1]:
+                frame_shape = (width, height)
+            else:
+                frame_shape = (frame_shape[0] * scale, frame_shape[1] * scale)
+
+    return frame, (time.perf_counter() - started) * 1000, frame_shape
+
+
+# JPEG decoding off the event loop... dili na ma block ang tanan connections samtang nag decode
+# More details
+# A pool of `workers` decoders, decoding at `inference_size` (see decode_jpeg). In "thread" mode (default) they are threads of the server process: imdecode
+# releases the GIL, so the event loop keeps reading sockets, answering PINGs and broadcasting while frames
+# decode, and the decoded frame needs no copy. "process" mode decodes in separate processes, the frame then
+# travels back pickled, only worth it when threads are not enough.
+# The data handed to decode() must be owned by the caller (bytes), not a view of a buffer that is reused.
+class FrameDecoder:
+
+    def __init__(self, mode=None, workers=None, inference_size=None):
+        self.mode = mode if mode is not None else decode_settings.get("mode", "thread")
+        self.workers = workers if workers is not None else decode_settings.get("workers", 2)
+        self.inference_size = inference_size if inference_size is not None else decode_settings.get("inference_size", 0)
+
+        if not self.workers or self.workers <= 0:
+            self.workers = os.cpu_count() or 1
+
+        if self.mode == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=use_log_queue, initargs=(worker_log_queue(),))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="decode")
+
+        # frames submitted and not decoded yet, for the metrics
+        self.inflight = 0
+        svc_log(f"Frame decoder => mode: {self.mode}, workers: {self.workers}, inference_size: {self.inference_size or 'full'}")
+
+    async def decode(self, data):
+        loop = asyncio.get_running_loop()
+
+        self.inflight += 1
+        try:
+            return await loop.run_in_executor(self.executor, decode_jpeg, data, self.inference_size)
+        finally:
+            self.inflight -= 1
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'inference_size': self.inference_size,
+            'inflight': self.inflight,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
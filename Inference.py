@@ -0,0 +1,655 @@
+import cv2
+import numpy as np
+import asyncio
+import os
+import time
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
+
+from Recording import hands_to_array
+from Logger import svc_log, worker_log_queue, use_log_queue
+from config import svc_configs, current_config, install_snapshot, ConfigSnapshot
+
+# --------------------------------------------------------------------------------------------
+# # Configs and Setup
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+inference_settings = default_settings.get("inference", {})
+
+mp_settings_pose = default_settings["mp"]["pose"]
+mp_settings_hands = default_settings["mp"]["hands"]
+
+# mediapipe solutions, imported by load_mediapipe where inference actually runs (the workers), not at import
+mp_drawing = None
+mp_pose = None
+mp_hands = None
+
+is_hands_roi = default_settings.get("hands_roi", True)
+
+# the ROI crop moves with the wrists on every frame, the Hands tracker can not follow a crop that changes under it:
+# with hands_roi every crop is detected on its own (static_image_mode)
+mp_settings_hands_graph = dict(mp_settings_hands, static_image_mode=True) if is_hands_roi else mp_settings_hands
+
+# pose landmarks around the hands (wrists, pinky, index, thumb) used to crop the Hands ROI
+hands_roi_landmarks = [15, 16, 17, 18, 19, 20, 21, 22]
+# --------------------------------------------------------------------------------------------
+#  GLOBALS
+
+# Pose/Hands graphs owned by THIS process (or worker thread), keyed by session. Never shared between sessions.
+# The Hands graph only exists for sessions that needed it at least once (quiz mode).
+graphs = {}
+
+# Pose graphs created and run once on a blank frame by warm_graphs, handed to the next new session
+spare_pose_graphs = []
+# --------------------------------------------------------------------------------------------
+
+
+# Import mediapipe on first use... dugay ang import (~1 s), dili na kinahanglan sa server process
+# More details
+# Returns (mp_pose, mp_hands, mp_drawing) and keeps them in the module globals of the same names.
+# In "process" mode only the inference workers ever call it, the server process never loads mediapipe.
+def load_mediapipe():
+    global mp_pose, mp_hands, mp_drawing
+
+    if mp_pose is None:
+        import mediapipe as mp
+
+        mp_drawing = mp.solutions.drawing_utils
+        mp_hands = mp.solutions.hands
+        mp_pose = mp.solutions.pose
+
+    return mp_pose, mp_hands, mp_drawing
+
+
+# Create `count` Pose graphs ahead of time and run them once, the first frame of a new graph loads the model
+# (~150 ms) which would otherwise be paid by the first frame of the next session.
+def warm_graphs(count=1):
+    mp_pose, mp_hands, mp_drawing = load_mediapipe()
+    blank = np.zeros((256, 144, 3), dtype=np.uint8)
+
+    while len(spare_pose_graphs) < count:
+        pose = mp_pose.Pose(**mp_settings_pose)
+        pose.process(blank)
+        spare_pose_graphs.append(pose)
+
+
+# Get the mediapipe graphs of a session... himoon ra kung wala pa
+# More details
+# This function returns the Pose and Hands graphs that belong to `session_key`, creating them on first use.
+# Every connection gets its own graphs so the tracking/smoothing state of one phone never leaks into another.
+# The Hands graph is only created when `with_hands` is True, plain organ tracking never loads it.
+# `None` is the key used by the debug runners that only ever have one camera.
+def get_graphs(session_key=None, with_hands=True):
+    session_graphs = graphs.get(session_key, None)
+    mp_pose, mp_hands, mp_drawing = load_mediapipe()
+
+    if session_graphs is None:
+        session_graphs = {
+            'pose': spare_pose_graphs.pop() if spare_pose_graphs else mp_pose.Pose(**mp_settings_pose),
+            'hands': None,
+            'buffers': FrameBuffers()
+        }
+        graphs[session_key] = session_graphs
+
+    if with_hands and session_graphs['hands'] is None:
+        session_graphs['hands'] = mp_hands.Hands(**mp_settings_hands_graph)
+
+    return session_graphs
+
+
+# Preprocessing of a session's frames into buffers that are reused frame after frame... walay bag-o nga image matag step
+# More details
+# The frame goes BGR -> RGB into the `rgb` buffer, then (when needed) rotated and/or mirrored into the `oriented`
+# buffer, at most two passes and no allocation once the buffers exist. A rotation by 90 clockwise followed by a
+# horizontal mirror is exactly a transpose, so adjust_orientation + image_flip together is a single cv2.transpose.
+# A buffer is only reallocated when the frame size changes. The image returned is one of the buffers: it is
+# overwritten by the next frame of the session, copy it to keep it longer.
+class FrameBuffers:
+
+    def __init__(self):
+        self.buffers = {}
+
+    def buffer(self, name, shape):
+        buffer = self.buffers.get(name, None)
+        if buffer is None or buffer.shape != shape:
+            buffer = np.empty(shape, dtype=np.uint8)
+            self.buffers[name] = buffer
+
+        buffer.flags.writeable = True
+        return buffer
+
+    def preprocess(self, frame, rotate=False, mirror=False):
+        height, width = frame.shape[:2]
+
+        rgb = self.buffer('rgb', (height, width, 3))
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+
+        if not rotate and not mirror:
+            return rgb
+
+        oriented = self.buffer('oriented', (width, height, 3) if rotate else (height, width, 3))
+
+        if rotate and mirror:
+            cv2.transpose(rgb, dst=oriented)
+        elif rotate:
+            cv2.rotate(rgb, cv2.ROTATE_90_CLOCKWISE, dst=oriented)
+        else:
+            cv2.flip(rgb, 1, dst=oriented)
+
+        return oriented
+
+
+# This function closes and forgets the graphs (and the quiz state) of a session once its connection is gone.
+def release_graphs(session_key=None):
+    from Quizz import release_quiz
+
+    session_graphs = graphs.pop(session_key, None)
+    release_quiz(session_key)
+
+    if session_graphs is not None:
+        session_graphs['pose'].close()
+        if session_graphs['hands'] is not None:
+            session_graphs['hands'].close()
+
+    return session_graphs is not None
+
+
+# adjust frame/image from landscape to portrait mode
+# More details
+# This function adjusts the orientation of the provided frame.
+# If the frame is in landscape mode (width greater than height), it rotates the frame to portrait mode.
+# This ensures the frame is correctly oriented for further processing.
+# `frame_shape` is the (height, width) the client sent when the frame was decoded smaller, it decides the rotation.
+def adjust_orientation(frame, frame_shape=None):
+    frame_height, frame_width = frame_shape[:2] if frame_shape is not None else frame.shape[:2]
+    if frame_width > frame_height:
+        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+    return frame
+    # return cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+
+
+# Region of the image where the hands are... gamay ra nga bahin ang ipasa sa Hands model
+# More details
+# This function builds a square-ish box (normalized coordinates) around the visible wrist/finger pose landmarks,
+# grown by a margin so the whole hand fits. Returns None when no hand related pose landmark is visible.
+def hands_roi(landmarks):
+    points = [landmarks.landmark[idx] for idx in hands_roi_landmarks]
+    points = [lm for lm in points if 0 <= lm.x <= 1 and 0 <= lm.y <= 1]
+
+    if not points:
+        return None
+
+    x_min = min(lm.x for lm in points)
+    x_max = max(lm.x for lm in points)
+    y_min = min(lm.y for lm in points)
+    y_max = max(lm.y for lm in points)
+
+    margin = max(x_max - x_min, y_max - y_min) * 0.5 + 0.1
+
+    return max(0.0, x_min - margin), max(0.0, y_min - margin), min(1.0, x_max + margin), min(1.0, y_max + margin)
+
+
+# Run the Hands model, only on the ROI around the pose wrists when `hands_roi` is enabled.
+# More details
+# The crop is processed on its own and the resulting hand landmarks are mapped back to normalized coordinates
+# of the full image, so Quizz.HandLandmarkPostion works exactly as with a full frame.
+def process_hands(hands, image, landmarks):
+    if not is_hands_roi:
+        return hands.process(image)
+
+    roi = hands_roi(landmarks)
+    if roi is None:
+        return hands.process(image)
+
+    image_height, image_width = image.shape[:2]
+    x0, y0 = int(roi[0] * image_width), int(roi[1] * image_height)
+    x1, y1 = int(roi[2] * image_width), int(roi[3] * image_height)
+
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return hands.process(image)
+
+    crop = image[y0:y1, x0:x1].copy()
+    crop.flags.writeable = False
+    hands_results = hands.process(crop)
+
+    if hands_results.multi_hand_landmarks:
+        crop_width = x1 - x0
+        crop_height = y1 - y0
+        for hand_landmarks in hands_results.multi_hand_landmarks:
+            for lm in hand_landmarks.landmark:
+                lm.x = (x0 + lm.x * crop_width) / image_width
+                lm.y = (y0 + lm.y * crop_height) / image_height
+                lm.z = lm.z * crop_width / image_width
+
+    return hands_results
+
+
+# this will process the frame and calculate the position based on the organ selected.... ambot ug Strategy pattern ang geh follow sa pag calc.
+# More details
+# This function processes a video frame to calculate positions based on organ landmarks.
+# It converts the frame to RGB (rotated when `rotate` is set, mirrored with image_flip) into the session's FrameBuffers,
+# processes it with the pose graph of `session_key`, and calculates positions based on landmarks.
+# The Hands model only runs when `use_hands` is True (quiz mode), since organ tracking does not consume hand landmarks.
+# In quiz mode the quiz answer of the frame (Quizz.start_quiz_func) is returned too, None otherwise.
+# `trackType` is one organ name, or a list of organs which are then all calculated from the same landmarks
+# (results become { organ: result }, see BodyLandmarkPosition.calculate_positions).
+# With `annotate` the frame is converted back to BGR and the landmarks and organ positions are drawn on it, that image
+# is returned along with the calculated position results and the quiz answer. Without it (headless) nothing is
+# converted or drawn and the image returned is None.
+# The duration (ms) of preprocess, pose, hands, organ_calc and annotate is written into `timings` when a dict is given.
+# When a `landmarks_out` dict is given it receives the pose array, the hand arrays and the frame shape (recording).
+# `frame_shape` is the (height, width) of the frame as the client sent it when `frame` is a reduced decode, the
+# organ math uses it so positions do not depend on the decode size.
+def process_frame(frame, trackType, session_key=None, use_hands=False, timings=None, landmarks_out=None, frame_shape=None, rotate=False, annotate=True):
+    results = None
+    quiz = None
+    if timings is None:
+        timings = {}
+
+    mp_pose, mp_hands, mp_drawing = load_mediapipe()
+    # the organ and quiz code is imported where inference runs, like mediapipe, not by the server process
+    from BodyLandmarkPosition import calculate_position, calculate_positions
+    from Quizz import start_quiz_func
+
+    session_graphs = get_graphs(session_key, with_hands=use_hands)
+    pose = session_graphs['pose']
+    hands = session_graphs['hands']
+
+    started = time.perf_counter()
+    image = session_graphs['buffers'].preprocess(frame, rotate, current_config().settings["image_flip"])
+    image.flags.writeable = False
+    timings['preprocess'] = (time.perf_counter() - started) * 1000
+
+    # mp_pose
+    started = time.perf_counter()
+    pose_results = pose.process(image)
+    landmarks = pose_results.pose_landmarks
+    timings['pose'] = (time.perf_counter() - started) * 1000
+
+    # mp_hands, only quiz mode needs them and only when there is a body to relate them to
+    hands_marks = None
+    handness = None
+
+    if use_hands and landmarks:
+        started = time.perf_counter()
+        hands_results = process_hands(hands, image, landmarks)
+        hands_marks = hands_results.multi_hand_landmarks
+        handness = hands_results.multi_handedness
+        timings['hands'] = (time.perf_counter() - started) * 1000
+
+    # the preview image, the only BGR copy of the frame and only when somebody looks at it
+    annotated = None
+    if annotate:
+        started = time.perf_counter()
+        annotated = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+        if hands_marks:
+            for hand_landmarks in hands_marks:
+                mp_drawing.draw_landmarks(annotated, hand_landmarks, mp_hands.HAND_CONNECTIONS)
+
+        if landmarks:
+            mp_drawing.draw_landmarks(annotated, landmarks, mp_pose.POSE_CONNECTIONS)
+        timings['annotate'] = (time.perf_counter() - started) * 1000
+
+    # headless, the organ classes get no cv2 and draw nothing (BodyLandmarkPosition.cv2_circle)
+    draw_cv2 = cv2 if annotated is not None else None
+    draw_image = annotated if annotated is not None else image
+
+    if landmarks:
+        args = {
+            'landmarks': landmarks,
+            'mp_pose': mp_pose,
+            'cv2': draw_cv2,
+            'image': draw_image,
+            'frame_shape': frame_shape
+        }
+
+        args2 = {
+            'landmarks': hands_marks,
+            'handness': handness,
+            'mp_hands': mp_hands,
+            'cv2': draw_cv2,
+            'image': draw_image
+        }
+
+        started = time.perf_counter()
+
+        if isinstance(trackType, list):
+            # several organs from the same landmarks, the quiz follows the first one
+            results = calculate_positions(trackType, args)
+            quiz_type = trackType[0]
+            quiz_results = results[quiz_type]
+        else:
+            results = calculate_position(trackType, args)
+            quiz_type = trackType
+            quiz_results = results
+
+        timings['organ_calc'] = (time.perf_counter() - started) * 1000
+
+        if use_hands:
+            quiz = start_quiz_func(args, args2, quiz_type, quiz_results, session_key)
+
+        if landmarks_out is not None:
+            landmarks_out['pose'] = args['points']
+
+    if landmarks_out is not None:
+        landmarks_out['shape'] = frame_shape if frame_shape is not None else image.shape[:2]
+        if hands_marks:
+            landmarks_out['hands'], landmarks_out['handedness'] = hands_to_array(hands_marks, handness)
+
+    return results, annotated, quiz
+
+
+# Entry point of a host frame inside an inference worker.
+# It decides the rotation (adjust_orientation) and processes the frame with the session's own graphs and buffers.
+# Headless unless `annotate` is set: the server only asks for the annotated image on the sampled frames of a
+# session while a preview consumer is attached (cv2_show or /preview), it is None otherwise.
+# The duration (ms) of every step taken in the worker (preprocess, pose, hands, organ_calc, annotate) is returned as `timings`.
+# With `record` the landmark arrays of the frame come back too (see Recording.LandmarkRecorder), otherwise None.
+# The quiz answer of the frame comes last, None unless `use_hands` (quiz mode) and the hands answered something.
+# `config` is (version, configs) of a reloaded config the worker has not seen yet (see InferencePool.worker_config).
+# `frame_shape` is the (height, width) the client sent, `frame` may be decoded smaller (Decoder.decode_jpeg).
+def process_host_frame(frame, trackType, session_key=None, use_hands=False, record=False, config=None, frame_shape=None, annotate=False):
+    timings = {}
+    landmarks = {} if record else None
+
+    if config is not None:
+        use_config(config)
+
+    # same decision as adjust_orientation, the rotation itself is part of the preprocessing (FrameBuffers)
+    rotate = False
+    if current_config().settings["adjust_orientation"]:
+        frame_height, frame_width = frame_shape[:2] if frame_shape is not None else frame.shape[:2]
+        rotate = frame_width > frame_height
+
+        if rotate and frame_shape is not None:
+            frame_shape = (frame_width, frame_height)
+
+    results, image, quiz = process_frame(frame, trackType, session_key, use_hands, timings, landmarks, frame_shape, rotate, annotate)
+
+    return results, image, timings, landmarks, quiz
+
+
+# Install the config snapshot of the server in this worker, `config` being (version, configs).
+def use_config(config):
+    version, configs = config
+    if current_config().version != version:
+        install_snapshot(ConfigSnapshot(version, configs))
+        svc_log(f"Inference worker {os.getpid()} uses config version {version}")
+
+
+# Called once in every worker, the pool waits for it so the workers are ready before clients connect.
+# The worker starts with the config the server has now, not with whatever the YAML files hold when it imports.
+# It loads mediapipe and warms `warm` spare Pose graphs, and returns its pid and how long (s) that took.
+def worker_ready(config=None, warm=1):
+    if config is not None:
+        use_config(config)
+
+    started = time.perf_counter()
+    load_mediapipe()
+    loaded = time.perf_counter()
+    warm_graphs(warm)
+    warmed = time.perf_counter()
+
+    return {
+        'pid': os.getpid(),
+        'mediapipe_s': round(loaded - started, 3),
+        'warm_s': round(warmed - loaded, 3),
+    }
+
+
+# Pool of inference workers... tag-usa ka mediapipe graph ang matag worker, dili na mag-agawan
+# More details
+# The pool holds `workers` single-worker executors. In "process" mode every executor is its own process with
+# its own mediapipe runtime, so inference runs in parallel on several cores. In "thread" mode they are threads
+# of this process (useful for debugging). A connection is pinned to one worker for its whole life (the least
+# loaded one when it starts) so its graphs, and with them the tracking/smoothing state, stay in one place.
+# At most `max_inflight` frames are handed to a worker at once, the others wait in a queue per room and the
+# rooms take turns (round robin) when a worker frees up, so a room with several streaming sessions can not
+# crowd out the other rooms pinned to the same worker.
+# A worker whose executor breaks (the process died) is marked dead and restarted in the background, the sessions
+# pinned to it move to a live worker with their next frame (new graphs, the old ones died with the process).
+class InferencePool:
+
+    def __init__(self, mode=None, workers=None):
+        self.mode = mode if mode is not None else inference_settings.get("mode", "thread")
+        workers = workers if workers is not None else inference_settings.get("workers", 1)
+
+        if not workers or workers <= 0:
+            workers = os.cpu_count() or 1
+
+        self.executors = []
+        self.pinned = []
+        # frames currently submitted to every worker and the time (s) every worker spent on them, for the metrics
+        self.inflight = []
+        self.busy_s = []
+        self.pids = []
+        self.started_at = time.time()
+        # config version every worker has, a reloaded config is sent along with the next frame of the worker
+        self.config_versions = []
+        # frames handed to every worker's executor, and per worker room => waiting frames (futures) in turn order
+        self.max_inflight = max(1, inference_settings.get("max_inflight", 2))
+        self.running = []
+        self.waiting = []
+        # workers whose executor broke, the task restarting every one of them and how often every worker was restarted
+        self.dead = []
+        self.restarting = {}
+        self.restarts = []
+
+        for idx in range(workers):
+            self.executors.append(self.new_executor(idx))
+            self.pinned.append(0)
+            self.inflight.append(0)
+            self.busy_s.append(0.0)
+            self.config_versions.append(0)
+            self.running.append(0)
+            self.waiting.append(OrderedDict())
+            self.dead.append(False)
+            self.restarts.append(0)
+            self.pids.append(None)
+
+    def new_executor(self, idx):
+        if self.mode == "process":
+            # spawn so every worker starts a clean mediapipe runtime, same behaviour on Windows and Linux
+            return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=use_log_queue, initargs=(worker_log_queue(),))
+
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{idx}")
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        warm = inference_settings.get("warm_graphs", 1)
+        ready = await asyncio.gather(*[loop.run_in_executor(executor, worker_ready, self.worker_config(idx), warm) for idx, executor in enumerate(self.executors)])
+        self.pids = [worker['pid'] for worker in ready]
+        self.started_at = time.time()
+        svc_log(f"Inference pool ready => mode: {self.mode}, workers: {len(self.executors)}, pids: {self.pids}")
+        return ready
+
+    # True while every worker is alive, /healthz reports not ready while one is being restarted.
+    def healthy(self):
+        return not any(self.dead)
+
+    def assign(self, session):
+        # the graphs of the session died with its worker, it starts again on a live one
+        if session.worker is not None and self.dead[session.worker]:
+            self.unpin(session)
+
+        if session.worker is None:
+            live = [idx for idx, dead in enumerate(self.dead) if not dead] or list(range(len(self.executors)))
+            session.worker = min(live, key=lambda idx: self.pinned[idx])
+            self.pinned[session.worker] += 1
+            svc_log(f"Session {session.key} pinned to inference worker {session.worker}")
+
+        return session.worker
+
+    def unpin(self, session):
+        self.pinned[session.worker] -= 1
+        session.worker = None
+
+    # Mark `worker` dead and restart it in the background, once however many frames saw it break.
+    def worker_died(self, worker):
+        if worker not in self.restarting:
+            self.dead[worker] = True
+            svc_log(f"Inference worker {worker} (pid {self.pids[worker]}) died, restarting it", "ERROR", "Inference")
+            self.restarting[worker] = asyncio.create_task(self.restart(worker), name=f"restart-inference-{worker}")
+
+        return self.restarting[worker]
+
+    # Replace the broken executor of `worker` and wait for the new one to be ready (worker_ready), retried every
+    # second until it works. The new worker gets the current config with worker_ready.
+    async def restart(self, worker):
+        loop = asyncio.get_running_loop()
+        warm = inference_settings.get("warm_graphs", 1)
+
+        try:
+            while True:
+                self.executors[worker].shutdown(wait=False, cancel_futures=True)
+                self.executors[worker] = self.new_executor(worker)
+                self.config_versions[worker] = 0
+
+                try:
+                    ready = await loop.run_in_executor(self.executors[worker], worker_ready, self.worker_config(worker), warm)
+                    break
+                except Exception as e:
+                    svc_log(f"Unable to restart inference worker {worker} => {type(e).__name__}: {e}", "ERROR", "Inference")
+                    await asyncio.sleep(1)
+
+            self.pids[worker] = ready['pid']
+            self.restarts[worker] += 1
+            self.dead[worker] = False
+            svc_log(f"Inference worker {worker} restarted => pid: {ready['pid']}", "INFO", "Inference")
+        finally:
+            del self.restarting[worker]
+
+    # (version, configs) when `worker` has not got the current config snapshot yet, None otherwise.
+    # Threads share the snapshot of this process, only process workers need it sent.
+    def worker_config(self, worker):
+        snapshot = current_config()
+        if self.config_versions[worker] == snapshot.version:
+            return None
+
+        self.config_versions[worker] = snapshot.version
+        if self.mode != "process":
+            return None
+
+        return (snapshot.version, snapshot.configs)
+
+    # Wait until `room` gets one of the max_inflight places of `worker`. The place is taken when this returns.
+    async def take_turn(self, worker, room):
+        if self.running[worker] < self.max_inflight and not self.waiting[worker]:
+            self.running[worker] += 1
+            return
+
+        turn = asyncio.get_running_loop().create_future()
+        self.waiting[worker].setdefault(room, deque()).append(turn)
+
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # the place was given right before the cancel, hand it on
+                self.end_turn(worker)
+            else:
+                queue = self.waiting[worker].get(room, None)
+                if queue is not None and turn in queue:
+                    queue.remove(turn)
+                    if not queue:
+                        del self.waiting[worker][room]
+            raise
+
+    # Free a place of `worker` and give it to the first waiting frame of the next room in turn.
+    def end_turn(self, worker):
+        self.running[worker] -= 1
+        waiting = self.waiting[worker]
+
+        while waiting and self.running[worker] < self.max_inflight:
+            room, queue = next(iter(waiting.items()))
+            turn = queue.popleft()
+
+            # the room goes to the back of the line, with its remaining frames if it has any
+            if queue:
+                waiting.move_to_end(room)
+            else:
+                del waiting[room]
+
+            if turn.done():
+                continue
+
+            self.running[worker] += 1
+            turn.set_result(None)
+
+    async def run(self, session, frame, trackType, use_hands=False, record=False, room=None, frame_shape=None, annotate=False):
+        loop = asyncio.get_running_loop()
+        worker = self.assign(session)
+
+        # every worker is down, wait for the one of this session to be back
+        if worker in self.restarting:
+            await asyncio.shield(self.restarting[worker])
+
+        self.inflight[worker] += 1
+        started = None
+        try:
+            await self.take_turn(worker, room)
+            started = time.perf_counter()
+            config = self.worker_config(worker)
+
+            try:
+                return await loop.run_in_executor(self.executors[worker], process_host_frame, frame, trackType, session.key, use_hands, record, config, frame_shape, annotate)
+            except BrokenExecutor:
+                # the frame is lost, the session moves to a live worker with its next one (assign)
+                self.worker_died(worker)
+                raise
+            except Exception:
+                # the config may not have reached the worker, send it again with the next frame
+                if config is not None:
+                    self.config_versions[worker] = 0
+                raise
+        finally:
+            self.inflight[worker] -= 1
+            if started is not None:
+                self.end_turn(worker)
+                self.busy_s[worker] += time.perf_counter() - started
+
+    async def release(self, session):
+        if session.worker is None:
+            return
+
+        worker = session.worker
+        self.unpin(session)
+
+        # a dead worker took the graphs with it
+        if self.dead[worker]:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executors[worker], release_graphs, session.key)
+        except Exception as e:
+            svc_log(f"Unable to release graphs of session {session.key} => {e}", "WARN")
+
+    # Per worker view for the metrics endpoint. utilization is the share of time since start() the worker had a frame.
+    def stats(self):
+        uptime = max(time.time() - self.started_at, 1e-9)
+
+        return {
+            'mode': self.mode,
+            'workers': len(self.executors),
+            'pids': list(self.pids),
+            'pinned_sessions': list(self.pinned),
+            'inflight': list(self.inflight),
+            'waiting': [sum(len(queue) for queue in waiting.values()) for waiting in self.waiting],
+            'waiting_rooms': [len(waiting) for waiting in self.waiting],
+            'busy_s': [round(busy, 3) for busy in self.busy_s],
+            'utilization': [round(min(busy / uptime, 1.0), 4) for busy in self.busy_s],
+            'config_versions': list(self.config_versions),
+            'dead': list(self.dead),
+            'restarts': list(self.restarts),
+        }
+
+    def shutdown(self):
+        for task in self.restarting.values():
+            task.cancel()
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
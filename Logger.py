@@ -1,12 +1,15 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import json
 import os
+import queue
+import atexit
 from datetime import datetime
 import math
 from config import svc_configs
 import sys
 import shutil
+import multiprocessing
 
 base_filename = "svc.log"
 folder_path = "logs"
@@ -15,12 +18,19 @@ folder_path_calc_response_time = os.path.join(folder_path, "calc-response-time")
 folder_path_svc = os.path.join(folder_path, "svc")
 
 
-if os.path.exists(folder_path):
-   shutil.rmtree(folder_path)
 
-# Ensure log directories exist
-for path in [folder_path, folder_path_calc_response_time, folder_path_svc]:
-    os.makedirs(path, exist_ok=True)
+# Start the server with a clean logs folder... ang server ra ang mo tawag ani, dili ang workers ug tools
+# More details
+# Called by main before anything is logged. Importing this module no longer touches the logs folder, so the
+# inference workers, deps/ tools and debug runners keep whatever logs are there; the folders a logger writes to
+# are created when that logger is set up (setup_logger_rts/setup_logger_svc).
+def init_log_folders(clean=False):
+   if clean and multiprocessing.current_process().name == "MainProcess" and os.path.exists(folder_path):
+      shutil.rmtree(folder_path)
+
+   # Ensure log directories exist
+   for path in [folder_path, folder_path_calc_response_time, folder_path_svc]:
+      os.makedirs(path, exist_ok=True)
 
 # if not os.path.exists(folder_path):
 #    os.makedirs(folder_path)
@@ -103,15 +113,123 @@ class DateRotatingFileHandler(RotatingFileHandler):
       self.stream = self._open()
 
 
+# Never block the caller... kung puno na ang queue, i-drop ang log imbes mag hulat
+# More details
+# QueueHandler that uses put_nowait on a bounded queue. When the background writer can not keep up the record
+# is dropped and counted (see dropped_logs) instead of blocking the event loop thread.
+class DroppingQueueHandler(QueueHandler):
+   def __init__(self, log_queue):
+      super().__init__(log_queue)
+      self.dropped = 0
+
+   def enqueue(self, record):
+      try:
+         self.queue.put_nowait(record)
+      except queue.Full:
+         self.dropped += 1
+
+
+log_queue_size = default_settings.get("log_queue_size", 10000)
+
+# logger name => (logger, QueueListener), filled once by setup_logger_rts/setup_logger_svc
+loggers = {}
+
+# extra fields of the records of every logger, see calc_time_and_log and svc_log
+rts_extra_fields = ["start_time", "end_time", "time_difference_ms", "topic", "role"]
+svc_extra_fields = ["topic"]
+
+# In a worker process: the multiprocessing queue its records go to (use_log_queue). In the server process: the
+# queue and the QueueListener that take them in (worker_log_queue).
+worker_queue = None
+worker_listener = None
+
+
+# Configure a logger once... usa ra ka beses mag abli sa file, ang pagsulat naa sa laing thread
+# More details
+# This function gives `name` a single DroppingQueueHandler; the real handlers (rotating file, stdout) live in a
+# QueueListener thread that does the formatting and the file I/O. Later calls return the configured logger.
+def setup_queue_logger(name, handlers):
+   logger = logging.getLogger(name)
+   logger.setLevel(logging.DEBUG)
+   logger.propagate = False
+
+   for handler in logger.handlers[:]:
+      logger.removeHandler(handler)
+
+   queue_handler = DroppingQueueHandler(queue.Queue(maxsize=log_queue_size))
+   logger.addHandler(queue_handler)
+
+   listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+   listener.start()
+
+   loggers[name] = (logger, listener)
+   return logger
+
+
+# Logger of a worker process... ang server ra ang mo sulat sa file, ang worker mo pasa ra sa queue
+# More details
+# Inference/decoder workers in "process" mode do not open svc.log themselves, several processes rotating the same
+# file race on the rename/remove of the rollover. Their records go to the server's queue (see worker_log_queue)
+# and the server writes them with its own handlers.
+def setup_worker_logger(name):
+   logger = logging.getLogger(name)
+   logger.setLevel(logging.DEBUG)
+   logger.propagate = False
+
+   for handler in logger.handlers[:]:
+      logger.removeHandler(handler)
+
+   logger.addHandler(DroppingQueueHandler(worker_queue))
+
+   loggers[name] = (logger, None)
+   return logger
+
+
+# Handler of the server's worker listener, a worker's record goes to the server logger of the same name.
+class WorkerRecordHandler(logging.Handler):
+   def emit(self, record):
+      if record.name == "RtsJsonLogger":
+         logger = setup_logger_rts(extra_fields=rts_extra_fields)
+      else:
+         logger = setup_logger_svc(extra_fields=svc_extra_fields)
+
+      logger.handle(record)
+
+
+# Called by the server process, the queue is passed to the process pools (initializer=use_log_queue).
+# Created once, every pool shares it.
+def worker_log_queue():
+   global worker_queue, worker_listener
+
+   if worker_listener is None:
+      worker_queue = multiprocessing.get_context("spawn").Queue(maxsize=log_queue_size)
+      worker_listener = QueueListener(worker_queue, WorkerRecordHandler())
+      worker_listener.start()
+
+   return worker_queue
+
+
+# Initializer of a worker process, its loggers send to the server's queue from now on.
+def use_log_queue(log_queue):
+   global worker_queue
+   worker_queue = log_queue
+
+   for name, (logger, listener) in list(loggers.items()):
+      if listener is not None:
+         listener.stop()
+      setup_worker_logger(name)
+
+
 def setup_logger_rts(extra_fields=None):
+    if "RtsJsonLogger" in loggers:
+        return loggers["RtsJsonLogger"][0]
+
+    if worker_queue is not None and worker_listener is None:
+        return setup_worker_logger("RtsJsonLogger")
+
+    os.makedirs(folder_path_calc_response_time, exist_ok=True)
     log_path_rts = os.path.join(folder_path_calc_response_time, base_filename)
 
-    logger_rts = logging.getLogger("JsonLogger")
-    logger_rts.setLevel(logging.DEBUG)
-    
-    for handler in logger_rts.handlers[:]:
-        logger_rts.removeHandler(handler)
-    
     handler = DateRotatingFileHandler(
         log_path_rts, maxBytes=50 * 1024, backupCount=0
     )
@@ -119,9 +237,7 @@ def setup_logger_rts(extra_fields=None):
     json_formatter_rts = JsonFormatter(extra_fields=extra_fields)
     handler.setFormatter(json_formatter_rts)  # Formatter set here
 
-    logger_rts.addHandler(handler)
-
-    return logger_rts
+    return setup_queue_logger("RtsJsonLogger", [handler])
 
 # def setup_logger_quizz(user_uuid, extra_fields=None):
 #    log_path = os.path.join(folder_path_quizz, f"{user_uuid}.log")
@@ -144,13 +260,14 @@ def setup_logger_rts(extra_fields=None):
 
 
 def setup_logger_svc(extra_fields=None):
-   log_path_svc = os.path.join(folder_path_svc, base_filename)
+   if "SvcJsonLogger" in loggers:
+      return loggers["SvcJsonLogger"][0]
 
-   logger_svc = logging.getLogger("JsonLogger")
-   logger_svc.setLevel(logging.DEBUG)
+   if worker_queue is not None and worker_listener is None:
+      return setup_worker_logger("SvcJsonLogger")
 
-   for handler in logger_svc.handlers[:]:
-      logger_svc.removeHandler(handler)
+   os.makedirs(folder_path_svc, exist_ok=True)
+   log_path_svc = os.path.join(folder_path_svc, base_filename)
 
    handler = DateRotatingFileHandler(
       log_path_svc, maxBytes=50 * 1024, backupCount=0
@@ -160,7 +277,7 @@ def setup_logger_svc(extra_fields=None):
    # handler = logging.FileHandler(log_path_svc)
    # handler.setLevel(logging.DEBUG)
    handler.setFormatter(json_formatter_svc)
-   logger_svc.addHandler(handler)
+   handlers = [handler]
 
    print_svc_logger = default_settings.get("print_svc_logger", False)
 
@@ -168,9 +285,35 @@ def setup_logger_svc(extra_fields=None):
       stdout_handler = logging.StreamHandler(sys.stdout)
       stdout_handler.setLevel(logging.DEBUG)
       stdout_handler.setFormatter(json_formatter_svc)
-      logger_svc.addHandler(stdout_handler)
+      handlers.append(stdout_handler)
+
+   return setup_queue_logger("SvcJsonLogger", handlers)
+
+
+# Number of records dropped because a log queue was full, per logger name.
+def dropped_logs():
+   return { name: logger.handlers[0].dropped for name, (logger, listener) in loggers.items() }
+
+
+# Flush what is still queued and close the files, registered with atexit.
+# The workers' records are handed to the server loggers first, then those are flushed.
+def stop_loggers():
+   global worker_listener
 
-   return logger_svc
+   if worker_listener is not None:
+      worker_listener.stop()
+      worker_listener = None
+
+   for name, (logger, listener) in list(loggers.items()):
+      if listener is None:
+         continue
+      listener.stop()
+      for handler in listener.handlers:
+         handler.close()
+   loggers.clear()
+
+
+atexit.register(stop_loggers)
 
 def calc_time_and_log(topic=None, role=None, start_time=0, end_time=0):
    time_difference_ms = (end_time - start_time) * 1000
@@ -183,9 +326,7 @@ def calc_time_and_log(topic=None, role=None, start_time=0, end_time=0):
       "role": role
    }
 
-   extra_fields = ["start_time", "end_time", "time_difference_ms", "topic", "role"]
-
-   calc_time_logger = setup_logger_rts(extra_fields=extra_fields)
+   calc_time_logger = setup_logger_rts(extra_fields=rts_extra_fields)
 
    calc_time_logger.info("log time difference of calculating frame", extra=args)
 
@@ -197,12 +338,10 @@ def svc_log(message=None, type_logger="INFO", topic="SVC_LOG"):
       "topic": topic,
    }
 
-   extra_fields = ["topic"]
-
-   svc_logger = setup_logger_svc(extra_fields=extra_fields)
+   svc_logger = setup_logger_svc(extra_fields=svc_extra_fields)
    select_type = {
       'INFO': svc_logger.info,
-      'WARN': svc_logger.warn,
+      'WARN': svc_logger.warning,
       'ERROR': svc_logger.error
    }  
 
@@ -0,0 +1,131 @@
+import math
+import time
+
+# Bucket layout shared by every histogram: bucket i covers (lowest * growth^(i-1), lowest * growth^i] ms.
+# 1.1 growth keeps every percentile within ~10% of the real value, 0.01 ms .. ~2 min fits in ~175 buckets.
+histogram_lowest_ms = 0.01
+histogram_growth = 1.1
+histogram_buckets = int(math.ceil(math.log(120000 / histogram_lowest_ms) / math.log(histogram_growth))) + 1
+histogram_log_growth = math.log(histogram_growth)
+
+# stage names in pipeline order, used to order the summaries (unknown stages are listed after them)
+stages = [
+    "recv_json",
+    "recv_frame",
+    "imdecode",
+    "inference",
+    "preprocess",
+    "pose",
+    "hands",
+    "organ_calc",
+    "annotate",
+    "serialize",
+    "drain",
+    "send_unity_position",
+    "send_json_message",
+]
+
+percentiles = [50, 95, 99]
+
+
+# Fixed bucket latency histogram... dili na i-store ang matag sample, ihap ra matag bucket
+# More details
+# Recording a value is one log() and one list increment, memory is constant whatever the frame rate.
+# Percentiles are answered with the upper bound of the bucket holding the rank (so never below the real value).
+class Histogram:
+
+    def __init__(self):
+        self.counts = [0] * histogram_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value_ms):
+        if value_ms <= histogram_lowest_ms:
+            idx = 0
+        else:
+            idx = min(int(math.ceil(math.log(value_ms / histogram_lowest_ms) / histogram_log_growth)), histogram_buckets - 1)
+
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += value_ms
+
+        if self.min is None or value_ms < self.min:
+            self.min = value_ms
+        if self.max is None or value_ms > self.max:
+            self.max = value_ms
+
+    # add the values of another histogram (same bucket layout) to this one
+    def merge(self, other):
+        for idx, bucket_count in enumerate(other.counts):
+            self.counts[idx] += bucket_count
+        self.count += other.count
+        self.total += other.total
+
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+
+        rank = max(1, int(math.ceil(self.count * p / 100)))
+        seen = 0
+
+        for idx, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                # the exact max is known, never report a bucket bound above it
+                return min(histogram_lowest_ms * histogram_growth ** idx, self.max)
+
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return { 'count': 0 }
+
+        summary = {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2),
+            'min': round(self.min, 2),
+            'max': round(self.max, 2),
+        }
+
+        for p in percentiles:
+            summary[f"p{p}"] = round(self.percentile(p), 2)
+
+        return summary
+
+
+# One histogram per stage, created on the first value of that stage.
+class StageMetrics:
+
+    def __init__(self):
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def record(self, stage, value_ms):
+        histogram = self.histograms.get(stage, None)
+
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[stage] = histogram
+
+        histogram.record(value_ms)
+
+    def summary(self):
+        ordered = [stage for stage in stages if stage in self.histograms]
+        ordered += sorted(stage for stage in self.histograms if stage not in stages)
+
+        return { stage: self.histograms[stage].summary() for stage in ordered }
+
+    def reset(self):
+        self.histograms = {}
+        self.started_at = time.time()
+
+
+# every session also records into this one, the server wide view used by the periodic report
+server_metrics = StageMetrics()
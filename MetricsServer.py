@@ -0,0 +1,111 @@
+import os
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+from Logger import svc_log
+
+# request line + headers are never bigger than this, anything else is not one of our probes
+max_request_bytes = 8 * 1024
+
+http_reasons = {
+    200: "OK",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+
+# CPU seconds (user + system) used so far by process `pid`, read from /proc. None where /proc is not available.
+def process_cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat", "r") as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+
+    # the command name may contain spaces, the fields we need come after its closing parenthesis
+    fields = stat[stat.rindex(")") + 2:].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+
+    return (int(fields[11]) + int(fields[12])) / ticks
+
+
+# Health and metrics over plain HTTP... para sa docker healthcheck ug sa load test dashboard
+# More details
+# A tiny HTTP/1.0 server on its own port, next to the unity TCP protocol, local only unless metrics_server.host
+# says otherwise (nothing here is authenticated). It only answers GET:
+#   /healthz  200 {"status": "ok"} once `ready()` is True, 503 before (docker-compose readiness probe)
+#   /metrics  200 with the JSON returned by `snapshot()` (counters, queue depth, workers, latency percentiles)
+#   /preview  200 image/jpeg returned by `preview(query)` (latest annotated frame), 404 while there is none yet or
+#             when no `preview` is given (preview.enable off)
+# Every request is answered and the connection closed, so it never holds anything of the streaming server.
+class MetricsServer:
+
+    def __init__(self, snapshot, ready, host="127.0.0.1", port=10001, preview=None):
+        self.snapshot = snapshot
+        self.ready = ready
+        self.preview = preview
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        svc_log(f"Metrics server {self.host}:{self.port} (/healthz, /metrics{', /preview' if self.preview else ''})", "INFO", "Metrics")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def respond(self, writer, status, body):
+        await self.respond_bytes(writer, status, json.dumps(body).encode('utf-8'), "application/json")
+
+    async def respond_bytes(self, writer, status, data, content_type):
+        head = (
+            f"HTTP/1.0 {status} {http_reasons.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            if len(request) > max_request_bytes:
+                return
+
+            request_line = request.split(b"\r\n", 1)[0].decode('latin-1').split()
+            if len(request_line) < 2:
+                return
+
+            method = request_line[0]
+            path, _, query = request_line[1].partition("?")
+
+            if method != "GET":
+                await self.respond(writer, 405, { 'error': "only GET is supported" })
+            elif path == "/healthz":
+                if self.ready():
+                    await self.respond(writer, 200, { 'status': "ok" })
+                else:
+                    await self.respond(writer, 503, { 'status': "starting" })
+            elif path == "/metrics":
+                await self.respond(writer, 200, self.snapshot())
+            elif path == "/preview" and self.preview is not None:
+                image = self.preview({ key: values[-1] for key, values in parse_qs(query).items() })
+                if image is None:
+                    await self.respond(writer, 404, { 'error': "no annotated frame yet, it comes with the next sampled host frame" })
+                else:
+                    await self.respond_bytes(writer, 200, image, "image/jpeg")
+            else:
+                await self.respond(writer, 404, { 'error': f"unknown path {path}" })
+
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        except Exception as e:
+            svc_log(f"Metrics request failed => {e}", "ERROR", "Metrics")
+        finally:
+            writer.close()
@@ -0,0 +1,116 @@
+from collections import namedtuple
+from types import MappingProxyType
+
+from config import svc_configs, current_config
+from Logger import svc_log
+
+configs = svc_configs()
+offsets_settings = configs["offsets"]["settings"]
+
+# Adjust if needed
+aspect_ratio_tolerance = 0.1
+
+offset_axes = ["x_offset", "y_offset", "z_offset"]
+
+# (x, y, z) triple, used for the base offsets and for the calibration coefficients
+Axes = namedtuple("Axes", ["x", "y", "z"])
+
+# Everything get_position needs for one (aspect ratio, organ) pair.
+#   common / unity:  base offsets of the image position and of the unity position
+#   minimum/maximum: estimated distance range in which the calibration applies
+#   common_coefficients / unity_coefficients: signed calibration coefficient per axis, the additional offset of an
+#       axis is (estimate_distance - minimum) * coefficient. "subtraction" is already folded in as a negative sign
+#       and disabled axes are 0.
+OrganOffsets = namedtuple("OrganOffsets", [
+    "aspect_ratio", "organ", "common", "unity", "minimum", "maximum", "common_coefficients", "unity_coefficients"
+])
+
+AspectRatio = namedtuple("AspectRatio", ["name", "ratio"])
+
+
+# This function turns one axis of the YAML calibration block into its signed coefficient for `target`.
+def signed_coefficient(axis_calibration, target):
+    if not axis_calibration or not axis_calibration["enable"]:
+        return 0
+
+    operator = axis_calibration["operator"]
+    coefficient = axis_calibration[target]
+
+    if operator == "subtraction":
+        return -coefficient
+    if operator == "addition":
+        return coefficient
+
+    raise ValueError(f"unknown calibration operator '{operator}', expected subtraction or addition")
+
+
+def compile_organ(aspect_ratio, organ, offsets):
+    common = offsets.get("common", None) or {}
+    unity = offsets.get("unity", None) or {}
+    calibration = offsets["calibration"]
+
+    return OrganOffsets(
+        aspect_ratio=aspect_ratio,
+        organ=organ,
+        common=Axes(*[common.get(axis, 0) for axis in offset_axes]),
+        unity=Axes(*[unity.get(axis, 0) for axis in offset_axes]),
+        minimum=calibration["minimum"],
+        maximum=calibration["maximum"],
+        common_coefficients=Axes(*[signed_coefficient(calibration.get(axis, None), "common") for axis in offset_axes]),
+        unity_coefficients=Axes(*[signed_coefficient(calibration.get(axis, None), "unity") for axis in offset_axes])
+    )
+
+
+# Offsets compiled once... dili na mag basa sa YAML dict ug mag parse ug "16_by_9" matag frame
+# More details
+# CompiledOffsets reads offset.settings.yaml content once: every "W_by_H" entry of aspect_ratio_list becomes a
+# ratio number and every organ block of the enabled aspect ratios becomes an immutable OrganOffsets record.
+# The aspect ratio of a frame resolution is resolved once and cached, frames of the same phone then only cost a
+# dict lookup. Invalid content raises (KeyError/ValueError) while compiling, never in the middle of a frame.
+class CompiledOffsets:
+
+    def __init__(self, settings, tolerance=aspect_ratio_tolerance):
+        self.tolerance = tolerance
+
+        aspect_ratios = []
+        for aspr in settings["aspect_ratio_list"]:
+            w, h = aspr.split("_by_")
+            aspect_ratios.append(AspectRatio(aspr, float(w) / float(h)))
+        self.aspect_ratios = tuple(aspect_ratios)
+
+        records = {}
+        for aspect_ratio in self.aspect_ratios:
+            for organ, offsets in settings["aspect_ratio"][aspect_ratio.name].items():
+                records[(aspect_ratio.name, organ)] = compile_organ(aspect_ratio.name, organ, offsets)
+        self.records = MappingProxyType(records)
+
+        # (image_height, image_width) => aspect ratio name or None
+        self.resolutions = {}
+
+    def aspect_ratio(self, image_height, image_width):
+        resolution = (image_height, image_width)
+
+        if resolution in self.resolutions:
+            return self.resolutions[resolution]
+
+        # landscape_aspect_ratio = image_width / image_height
+        portrait_aspect_ratio = image_height / image_width
+        selected = None
+
+        for aspect_ratio in self.aspect_ratios:
+            if abs(portrait_aspect_ratio - aspect_ratio.ratio) < self.tolerance:
+                selected = aspect_ratio.name
+                break
+
+        if selected is None:
+            svc_log(f"Aspect Ratio Not Identified. [image_height, image_width, aspect_ratio] => [{image_height}, {image_width}, {portrait_aspect_ratio}]", "WARN", "Offsets")
+
+        self.resolutions[resolution] = selected
+        return selected
+
+    def organ(self, aspect_ratio, organ):
+        return self.records[(aspect_ratio, organ)]
+
+
+# the offsets of the config loaded at start, reloads get their own (config.current_config().offsets)
+compiled_offsets = current_config().offsets
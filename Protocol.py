@@ -0,0 +1,173 @@
+import json
+import time
+import struct
+
+from config import svc_configs
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+protocol_settings = default_settings.get("protocol", {})
+
+max_json_bytes = protocol_settings.get("max_json_bytes", 64 * 1024)
+max_frame_bytes = protocol_settings.get("max_frame_bytes", 8 * 1024 * 1024)
+
+track_supported = default_settings["track_supported"]
+
+# organ id used by the binary encoding is the organ's index in track_supported, 255 if unknown
+organ_ids = { organ: idx for idx, organ in enumerate(track_supported) }
+unknown_organ_id = 255
+
+ENCODING_JSON = "json"
+ENCODING_BINARY = "binary"
+encodings = [ENCODING_JSON, ENCODING_BINARY]
+
+# first byte of a binary message, never '{' (0x7B) so a binary client can still recognise JSON messages
+KIND_UNITY_POSITION = 1
+KIND_UNITY_POSITIONS = 2
+
+# header of a KIND_UNITY_POSITIONS message and of every organ record inside it
+positions_header = struct.Struct("<BBHI")
+organ_record_header = struct.Struct("<BBH")
+
+# packers per number of points, body sends 11 points and every organ sends 1 so this stays tiny
+position_structs = {}
+
+
+# Raised when the peer sends something we can not (or refuse to) read, the stream is out of sync after it.
+class ProtocolError(Exception):
+    pass
+
+
+# Length prefixed messages... i-check ang gidak-on sa dili pa basahon
+# More details
+# Every message on the wire is a 4-byte little-endian length followed by that many bytes (JSON or a JPEG frame).
+# One MessageReader exists per connection. A message is read with StreamReader.readexactly, which hands out the
+# bytes it already buffered in one copy, and the bytes returned belong to the caller (the frame can wait for the
+# decoder while the next message is read).
+# A length prefix above the maximum raises ProtocolError instead of trying to read (and allocate) it.
+# `header_time` / `header_at` (time.time / perf_counter) stamp when the length prefix of the message being read
+# arrived, the time a client sat idle before sending it is not part of any latency measured from them. Both are
+# None when the last read got no length prefix (EOF), so nothing is measured from an older message.
+class MessageReader:
+
+    def __init__(self, reader, max_json=None, max_frame=None):
+        self.reader = reader
+        self.max_json = max_json if max_json is not None else max_json_bytes
+        self.max_frame = max_frame if max_frame is not None else max_frame_bytes
+
+        self.header_time = None
+        self.header_at = None
+
+    async def read_message(self, max_length):
+        self.header_time = None
+        self.header_at = None
+
+        header = await self.reader.readexactly(4)
+        self.header_time = time.time()
+        self.header_at = time.perf_counter()
+        length = int.from_bytes(header, byteorder='little')
+
+        if length > max_length:
+            raise ProtocolError(f"message of {length} bytes exceeds the maximum of {max_length} bytes")
+
+        return await self.reader.readexactly(length)
+
+    async def read_json(self):
+        message = await self.read_message(self.max_json)
+        if len(message) == 0:
+            return None
+
+        return json.loads(message)
+
+    async def read_frame(self):
+        return await self.read_message(self.max_frame)
+
+
+# Organ selection of a host... "heart", "heart,lungs", "all" or a JSON list
+# More details
+# This function turns what the host sent (the `message` text or an `organs` list) into the list of organs to track.
+# "all" selects every organ of track_supported. Returns None when anything in the selection is not supported,
+# the same as an unknown single organ before, so nothing is tracked for it.
+def parse_organs(selection):
+    if selection is None:
+        return None
+
+    if isinstance(selection, str):
+        if selection.strip().lower() == "all":
+            return list(track_supported)
+        selection = selection.split(",")
+
+    organs = []
+    for organ in selection:
+        organ = str(organ).strip().lower()
+        if organ not in organ_ids:
+            return None
+        if organ not in organs:
+            organs.append(organ)
+
+    return organs or None
+
+
+# Binary unity position... gamay ug paspas i-pack kaysa json.dumps sa mga dict
+# More details
+# Layout (little-endian), sent with the usual 4-byte length prefix:
+#   uint8   kind        KIND_UNITY_POSITION (1)
+#   uint8   organ id    index of the organ in track_supported (255 if unknown)
+#   uint16  count       number of xyz triples that follow
+#   uint32  seq         sequence number of the frame (JSON + frame pair) on the host connection
+#   float32 x, y, z     repeated `count` times
+# `unity_position` is a single {'x','y','z'} dict for an organ or a list of them for the body.
+def position_struct(count):
+    packer = position_structs.get(count, None)
+
+    if packer is None:
+        packer = struct.Struct(f"<BBHI{count * 3}f")
+        position_structs[count] = packer
+
+    return packer
+
+
+def encode_unity_position(unity_position, organ=None, seq=0):
+    points = unity_position if isinstance(unity_position, list) else [unity_position]
+
+    values = []
+    for point in points:
+        values.append(point['x'])
+        values.append(point['y'])
+        values.append(point['z'])
+
+    packer = position_struct(len(points))
+    organ_id = organ_ids.get(organ, unknown_organ_id)
+
+    return packer.pack(KIND_UNITY_POSITION, organ_id, len(points), seq & 0xFFFFFFFF, *values)
+
+
+# Binary unity positions of several organs computed from the same frame.
+# More details
+# Layout (little-endian), sent with the usual 4-byte length prefix:
+#   uint8   kind        KIND_UNITY_POSITIONS (2)
+#   uint8   reserved    0
+#   uint16  organs      number of organ records that follow
+#   uint32  seq         sequence number of the frame
+# then per organ:
+#   uint8   organ id    index of the organ in track_supported
+#   uint8   reserved    0
+#   uint16  count       number of xyz triples that follow
+#   float32 x, y, z     repeated `count` times
+# `positions` is { organ: unity_position }, only organs that have a position are included.
+def encode_unity_positions(positions, seq=0):
+    chunks = [positions_header.pack(KIND_UNITY_POSITIONS, 0, len(positions), seq & 0xFFFFFFFF)]
+
+    for organ, unity_position in positions.items():
+        points = unity_position if isinstance(unity_position, list) else [unity_position]
+
+        values = []
+        for point in points:
+            values.append(point['x'])
+            values.append(point['y'])
+            values.append(point['z'])
+
+        chunks.append(organ_record_header.pack(organ_ids.get(organ, unknown_organ_id), 0, len(points)))
+        chunks.append(struct.pack(f"<{len(values)}f", *values))
+
+    return b"".join(chunks)
@@ -1,17 +1,31 @@
 import math
 from BodyLandmarkPosition import BodyLandmarkPosition
-from config import svc_configs
+from config import svc_configs, current_config
+from Logger import svc_log
 
 configs = svc_configs()
 default_settings  = configs["default"]["settings"]
 offsets_settings = configs["offsets"]["settings"]
 
-quizz_started = False
-end_user_quiz = False
+# quiz state of every session, keyed like the inference graphs (Inference.get_graphs): one worker serves several sessions
+quiz_sessions = {}
+
+
+def quiz_state(currentUser):
+    state = quiz_sessions.get(currentUser, None)
+    if state is None:
+        state = { 'started': False }
+        quiz_sessions[currentUser] = state
+    return state
+
+
+# This function forgets the quiz state of a session once its connection is gone.
+def release_quiz(currentUser):
+    quiz_sessions.pop(currentUser, None)
 
 class GestureCommon(BodyLandmarkPosition):
-    def __init__(self, landmarks, mp_pose, cv2, image):
-        super().__init__(landmarks, mp_pose, cv2, image)
+    def __init__(self, landmarks, mp_pose, cv2, image, points=None, frame_shape=None):
+        super().__init__(landmarks, mp_pose, cv2, image, points, frame_shape=frame_shape)
 
     def slope(self, point1, point2):
         if point1 and point2 and (point2[0] - point1[0]) != 0:
@@ -63,7 +77,7 @@ class GestureCommon(BodyLandmarkPosition):
             return False
 
     def calculate_wrist_position(self):
-        image_height, image_width, _ = self.image.shape
+        image_height, image_width = self.image_shape()
 
         left_wrist = self.get_landmark('LEFT_WRIST')
         right_wrist = self.get_landmark('RIGHT_WRIST')
@@ -141,38 +155,46 @@ class HandLandmarkPostion:
         return (x, y, z)
     
 
-def start_quiz_func(args, args2, trackType, results, currentUser, send_user_message, writter):
+# Quiz gestures of one frame of `currentUser`... hands up sugod, crossed arms human
+# More details
+# Returns the middle finger MCP of the hands that answer the quiz for `trackType` along with their difference to
+# the organ position, None when nothing is answered on this frame. The started/ended state is kept per session.
+def start_quiz_func(args, args2, trackType=None, results=None, currentUser=None, send_user_message=None, writter=None):
+    answer = None
     try:
-        global quizz_started
+        state = quiz_state(currentUser)
         common = GestureCommon(**args)
 
         hands_up = common.check_hands_up()
         crossed_arm = common.check_crossed_arms()
 
-        if not quizz_started:
+        if not state['started']:
             if hands_up is not None:
                 if hands_up:
-                    quizz_started = hands_up
+                    state['started'] = hands_up
 
-        if quizz_started:
+        if state['started']:
             end_quizz = False
 
             if crossed_arm is not None:
                 if crossed_arm: 
                     end_quizz = False
-                    quizz_started = False
+                    state['started'] = False
 
             if not end_quizz:
                 hand_landmark = HandLandmarkPostion(**args2)
                 hands_info = hand_landmark.get_hand_info()
 
-                organ_quizz = default_settings["organs_quizz"]
+                organ_quizz = current_config().settings["organs_quizz"]
                 organ_selected = organ_quizz[trackType]
 
                 if hands_info is not None:
                     calc_middle_finger_mcp = []
                     for hand_info in hands_info:
                         middle_finger_mcp = hand_landmark.get_landmark("MIDDLE_FINGER_MCP", hand_info["idx"])
+                        # outside of the image, this hand does not answer
+                        if middle_finger_mcp is None:
+                            continue
                         # print(hand_info["label"], " => ", hand_landmark.calculate_position(middle_finger_mcp))
                         mcp_dict = { "hand": hand_info["label"], "calc": middle_finger_mcp }
                         calc_middle_finger_mcp.append(mcp_dict)
@@ -194,21 +216,24 @@ def start_quiz_func(args, args2, trackType, results, currentUser, send_user_mess
                             
                             if organ_selected["with_both_hand"]:
                                 if len(calc_data) == 2:
-                                    print(calc_data)
+                                    answer = calc_data
                             elif not organ_selected["with_both_hand"]:
                                 for data in calc_data:
                                     if data["hand"] == organ_selected["which_hand"]:
-                                        print(calc_data)
+                                        answer = calc_data
                                     elif organ_selected["which_hand"] == "NONE":
-                                        print(calc_data)
+                                        answer = calc_data
 
 
     except Exception as e:
-        print(e)
+        svc_log(f"Unable to check quiz gestures => {e}", "ERROR", "Quizz")
+
+    return answer
 
 
 def do_calc_diff(calc_mcp, common_position): 
     x = abs(calc_mcp[0]) - abs(common_position[0])
     y = abs(calc_mcp[1]) - abs(common_position[1])
 
-    return (x, y)
+    # plain floats, the answer is sent to the client as JSON
+    return (float(x), float(y))
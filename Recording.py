@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import numpy as np
+
+from config import svc_configs, current_config
+from Logger import svc_log
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+recording_settings = default_settings.get("recording", {})
+
+# One fixed size record per processed frame, the file is just these records back to back so it can be opened
+# with np.memmap and indexed like an array without parsing anything.
+#   seq         frame sequence number on the host connection
+#   time        unix time the frame was read
+#   height/width  shape of the image the landmarks belong to (after adjust_orientation), the organ math needs it
+#   pose        33 x (x, y, z, visibility), all NaN when no body was detected
+#   hands       up to 2 hands x 21 x (x, y, z), NaN when missing
+#   handedness  per hand 0 = Left, 1 = Right, -1 = no hand
+frame_dtype = np.dtype([
+    ('seq', '<u4'),
+    ('time', '<f8'),
+    ('height', '<u2'),
+    ('width', '<u2'),
+    ('pose', '<f4', (33, 4)),
+    ('hands', '<f4', (2, 21, 3)),
+    ('handedness', 'i1', (2,)),
+])
+
+handedness_ids = { 'Left': 0, 'Right': 1 }
+handedness_names = { value: name for name, value in handedness_ids.items() }
+
+recording_extension = ".lmk"
+index_extension = ".json"
+
+
+# Hand landmarks of one frame as a (2, 21, 3) array plus handedness ids, in the layout of frame_dtype.
+def hands_to_array(hands_marks, handness):
+    hands = np.full((2, 21, 3), np.nan, dtype=np.float32)
+    handedness = np.full((2,), -1, dtype=np.int8)
+
+    if hands_marks:
+        for idx, hand_landmarks in enumerate(hands_marks[:2]):
+            hands[idx] = [(lm.x, lm.y, lm.z) for lm in hand_landmarks.landmark]
+            if handness and idx < len(handness):
+                label = handness[idx].classification[0].label
+                handedness[idx] = handedness_ids.get(label, -1)
+
+    return hands, handedness
+
+
+# Append only landmark recording... i-record ang landmarks para ma calibrate ang offsets bisan walay tawo nga nagtindog
+# More details
+# Every processed frame of a session becomes one frame_dtype record appended to `<name>.lmk`; the sidecar
+# `<name>.json` holds the record layout and what is needed to interpret it (session, organs, settings).
+# The sidecar is rewritten with the frame count when the recording is closed, a recording that was not closed
+# is still readable since the count can always be derived from the file size (see open_recording).
+class LandmarkRecorder:
+
+    def __init__(self, path, meta=None):
+        self.path = path if path.endswith(recording_extension) else path + recording_extension
+        self.index_path = self.path[:-len(recording_extension)] + index_extension
+        self.meta = dict(meta or {})
+        self.frames = 0
+        self.record = np.zeros((), dtype=frame_dtype)
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.file = open(self.path, "wb")
+        self.write_index()
+
+    def write_index(self):
+        index = {
+            'format': "landmark-recording",
+            'version': 1,
+            'dtype': frame_dtype.descr,
+            'record_bytes': frame_dtype.itemsize,
+            'frames': self.frames,
+            'handedness': handedness_names,
+            'meta': self.meta,
+        }
+
+        with open(self.index_path, "w") as index_file:
+            index_file.write(json.dumps(index, indent=2, default=str))
+
+    def append(self, seq, frame_time, image_shape, pose=None, hands=None, handedness=None):
+        record = self.record
+        record['seq'] = seq & 0xFFFFFFFF
+        record['time'] = frame_time
+        record['height'] = image_shape[0]
+        record['width'] = image_shape[1]
+        record['pose'] = pose if pose is not None else np.nan
+        record['hands'] = hands if hands is not None else np.nan
+        record['handedness'] = handedness if handedness is not None else -1
+
+        self.file.write(record.tobytes())
+        self.frames += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self.file.close()
+        self.meta['closed_at'] = time.time()
+        self.write_index()
+        svc_log(f"Landmark recording closed => {self.path} ({self.frames} frames)", "INFO", "Recording")
+
+
+# Open a recording read-only. Returns (index, records) where records is a np.memmap of frame_dtype.
+def open_recording(path):
+    if path.endswith(index_extension):
+        path = path[:-len(index_extension)] + recording_extension
+    if not path.endswith(recording_extension):
+        path = path + recording_extension
+
+    index_path = path[:-len(recording_extension)] + index_extension
+    index = {}
+    if os.path.isfile(index_path):
+        with open(index_path, "r") as index_file:
+            index = json.load(index_file)
+
+    # a recording that was not closed properly has a partial last record at worst
+    frames = os.path.getsize(path) // frame_dtype.itemsize
+    if frames == 0:
+        return index, np.zeros((0,), dtype=frame_dtype)
+
+    return index, np.memmap(path, dtype=frame_dtype, mode="r", shape=(frames,))
+
+
+# This function starts a recording for a session when recording.enable is set, None otherwise.
+def start_session_recording(session):
+    if not recording_settings.get("enable", False):
+        return None
+
+    folder = recording_settings.get("folder", "recordings")
+    started = time.strftime("%Y-%m-%d_%H-%M-%S")
+    name = f"{started}-{session.key}-{session.uuid or 'unknown'}"
+
+    settings = current_config().settings
+    meta = {
+        'session_key': session.key,
+        'uuid': session.uuid,
+        'role': session.role,
+        'organs': session.organs,
+        'started_at': time.time(),
+        'image_flip': settings.get("image_flip", False),
+        'adjust_orientation': settings.get("adjust_orientation", False),
+    }
+
+    recorder = LandmarkRecorder(os.path.join(folder, name), meta)
+    svc_log(f"Recording landmarks of session {session.key} => {recorder.path}", "INFO", "Recording")
+    return recorder
@@ -0,0 +1,213 @@
+import heapq
+import time
+import asyncio
+
+roles = ["Host", "Guest"]
+
+# room of the clients whose PING has no `room`, all of them share it like before rooms existed
+default_room = "default"
+
+
+# One anatomy session... usa ka host, daghan guests, kaugalingon nga organ
+# More details
+# The uuids of the host(s) and guests that announced this room id on PING, and the organs its host tracks.
+# Rooms are created by the first client that joins them and dropped when the last one leaves.
+# The host's position/rotation broadcast is kept as the room's latest message with a version number: publish()
+# only replaces it and completes the `changed` future, whatever the number of guests. Every guest's writer task
+# sends the latest version when it gets to it, a guest that is slower than the host just skips versions.
+class Room:
+
+    def __init__(self, room_id):
+        self.id = room_id
+        self.by_role = { role: set() for role in roles }
+        self.type_selected = None
+        self.organs = None
+        self.created_at = time.time()
+
+        self.latest = None
+        self.version = 0
+        self.changed = None
+
+    def __len__(self):
+        return sum(len(members) for members in self.by_role.values())
+
+    def members(self, role=None):
+        if role is None:
+            return set().union(*self.by_role.values())
+        return self.by_role.get(role, set())
+
+    def select_organs(self, type_selected, organs):
+        self.type_selected = type_selected
+        self.organs = organs
+
+    def publish(self, message):
+        self.latest = message
+        self.version += 1
+
+        changed = self.changed
+        self.changed = None
+        if changed is not None and not changed.done():
+            changed.set_result(self.version)
+
+    # Future completed by the next publish()
+    def next_change(self):
+        if self.changed is None:
+            self.changed = asyncio.get_running_loop().create_future()
+        return self.changed
+
+    def summary(self):
+        return {
+            'hosts': len(self.by_role["Host"]),
+            'guests': len(self.by_role["Guest"]),
+            'organs': self.organs,
+            'broadcast_version': self.version,
+            'age_s': round(time.time() - self.created_at, 1),
+        }
+
+
+# Registered users by uuid, by role and by last activity... dili na i-scan tanan matag frame
+# More details
+# `clients` keeps the same entries main always had (role, address, port, writer, session, time, room) so lookups
+# by uuid stay a dict access. Next to it every role has a set of uuids, server wide and per Room, so finding THE
+# host of a room or its guests does not walk all connections, and a heap orders the users by last activity for
+# the TTL expiry.
+# The heap holds one live entry per user: touch() only updates the entry's time, expired() re-queues an entry
+# whose user was active since it was queued and drops entries of users that are gone, so the heap does not grow
+# with the number of PINGs. Change entries only through the methods, the indexes follow them.
+class ClientRegistry:
+
+    def __init__(self):
+        self.clients = {}
+        self.by_role = { role: set() for role in roles }
+        self.rooms = {}
+        self.expiry = []
+        # uuid => time of its live heap entry, an entry with another time is a leftover and is skipped
+        self.queued = {}
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __contains__(self, userUUID):
+        return userUUID in self.clients
+
+    def get(self, userUUID):
+        return self.clients.get(userUUID, None)
+
+    def add(self, userUUID, role, addr, writer, session=None, room=default_room):
+        entry = {
+            'role': role,
+            'address': addr[0],
+            'port': addr[1],
+            'writer': writer,
+            'session': session,
+            'time': time.time(),
+            'room': room
+        }
+
+        self.clients[userUUID] = entry
+        self.by_role.setdefault(role, set()).add(userUUID)
+        self.join(userUUID, role, room)
+        self.queue(userUUID, entry['time'])
+        return entry
+
+    def join(self, userUUID, role, room):
+        if room not in self.rooms:
+            self.rooms[room] = Room(room)
+        self.rooms[room].by_role.setdefault(role, set()).add(userUUID)
+
+    def leave(self, userUUID, role, room):
+        room_entry = self.rooms.get(room, None)
+        if room_entry is None:
+            return
+
+        room_entry.by_role.get(role, set()).discard(userUUID)
+        if len(room_entry) == 0:
+            del self.rooms[room]
+
+    def touch(self, userUUID):
+        entry = self.clients.get(userUUID, None)
+        if entry is not None:
+            entry['time'] = time.time()
+
+    def set_role(self, userUUID, role):
+        entry = self.clients[userUUID]
+        if entry['role'] == role:
+            return
+
+        self.by_role.get(entry['role'], set()).discard(userUUID)
+        self.by_role.setdefault(role, set()).add(userUUID)
+        self.leave(userUUID, entry['role'], entry['room'])
+        self.join(userUUID, role, entry['room'])
+        entry['role'] = role
+
+    def set_room(self, userUUID, room):
+        entry = self.clients[userUUID]
+        if entry['room'] == room:
+            return
+
+        self.leave(userUUID, entry['role'], entry['room'])
+        self.join(userUUID, entry['role'], room)
+        entry['room'] = room
+
+    def remove(self, userUUID):
+        entry = self.clients.pop(userUUID, None)
+        if entry is None:
+            return None
+
+        self.by_role.get(entry['role'], set()).discard(userUUID)
+        self.leave(userUUID, entry['role'], entry['room'])
+        self.queued.pop(userUUID, None)
+        return entry
+
+    def room(self, room):
+        return self.rooms.get(room, None)
+
+    # uuids with `role` in `room`, server wide when `room` is None
+    def members(self, role, room=None):
+        if room is None:
+            return self.by_role.get(role, set())
+
+        room_entry = self.rooms.get(room, None)
+        return room_entry.members(role) if room_entry is not None else set()
+
+    def count(self, role, room=None):
+        return len(self.members(role, room))
+
+    # uuid of the host of `room` when it has exactly one, None otherwise
+    def host(self, room=default_room):
+        hosts = self.members("Host", room)
+        if len(hosts) != 1:
+            return None
+        return next(iter(hosts))
+
+    def role_counts(self):
+        return { role: len(members) for role, members in self.by_role.items() if members }
+
+    def rooms_summary(self):
+        return { room_id: room.summary() for room_id, room in self.rooms.items() }
+
+    def queue(self, userUUID, queued_time):
+        self.queued[userUUID] = queued_time
+        heapq.heappush(self.expiry, (queued_time, userUUID))
+
+    # This function returns the uuids of the users inactive for more than `ttl` seconds at `now`, oldest first.
+    # It only looks at the heap entries that are due, they stay registered until remove() is called.
+    def expired(self, ttl, now=None):
+        now = now if now is not None else time.time()
+        expired = []
+
+        while self.expiry and self.expiry[0][0] + ttl < now:
+            queued_time, userUUID = heapq.heappop(self.expiry)
+
+            if self.queued.get(userUUID, None) != queued_time:
+                continue
+
+            entry = self.clients[userUUID]
+            if entry['time'] != queued_time:
+                self.queue(userUUID, entry['time'])
+                continue
+
+            del self.queued[userUUID]
+            expired.append(userUUID)
+
+        return expired
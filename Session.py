@@ -0,0 +1,233 @@
+import time
+import asyncio
+import itertools
+from collections import OrderedDict
+
+from config import svc_configs
+from Protocol import parse_organs
+from Metrics import StageMetrics, server_metrics
+from Registry import default_room
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+
+
+# Latest value wins... kung naay bag-o, ilisan ang daan imbes nga i-queue
+# More details
+# A single-item handoff between two pipeline stages. `put` never blocks: if the previous item was not
+# taken yet it is replaced and `put` returns True so the caller can count the drop. `get` waits until an
+# item is available and empties the slot. This keeps at most one stale item between stages at any time.
+class LatestSlot:
+
+    def __init__(self):
+        self.item = None
+        self.has_item = asyncio.Event()
+
+    def put(self, item):
+        replaced = self.item is not None
+        self.item = item
+        self.has_item.set()
+        return replaced
+
+    async def get(self):
+        await self.has_item.wait()
+        item = self.item
+        self.item = None
+        self.has_item.clear()
+        return item
+
+
+# Messages waiting for one connection's writer... ang pinaka bag-o ra sa matag klase ang ipadala
+# More details
+# `put` never blocks the caller. A message with a `key` replaces the unsent message with the same key (a newer
+# result makes the older one pointless) and keeps its place in line; messages without a key are kept in order.
+# When more than `limit` messages wait the oldest is dropped. `put` returns "coalesced", "dropped" or None so the
+# caller can count it. Only the connection's own writer task (main.outbox_stage) takes messages out.
+class Outbox:
+
+    def __init__(self, limit=16):
+        self.limit = limit
+        self.pending = OrderedDict()
+        self.ids = itertools.count()
+        self.wakeup = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def put(self, item, key=None):
+        outcome = None
+
+        if key is None:
+            key = next(self.ids)
+        elif key in self.pending:
+            outcome = "coalesced"
+
+        self.pending[key] = item
+
+        if len(self.pending) > self.limit:
+            self.pending.popitem(last=False)
+            outcome = "dropped"
+
+        self.wake()
+        return outcome
+
+    def take(self):
+        return self.pending.popitem(last=False)[1]
+
+    def wake(self):
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    # Wait for a message, or for `change` (a future, e.g. Registry.Room.next_change) to complete.
+    async def wait(self, change=None):
+        self.wakeup = asyncio.get_running_loop().create_future()
+        try:
+            waits = [self.wakeup] if change is None else [self.wakeup, change]
+            await asyncio.wait(waits, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.wakeup = None
+
+
+session_ids = itertools.count(1)
+
+# totals of every counter over all sessions (open and closed), served by the metrics endpoint
+server_counters = {}
+
+
+# Per connection state... para dili na mag agawan ang mga phone sa global start_time ug typeSelected
+# More details
+# One ClientSession is created for every accepted TCP connection and lives until the connection closes.
+# It owns the reader/writer pair, the identity announced on PING (uuid and role), the organ selected by
+# that connection (and whether it is in quiz mode, which is what decides if the Hands model runs), the start time of the frame currently in flight, a set of counters
+# and the latency histograms of every pipeline stage.
+# Nothing here is shared between connections, so latency numbers and organ selection stay separate.
+# The LatestSlots connect the reader -> decode -> inference -> sender stages of the connection pipeline.
+# `key` identifies the session inside the inference worker it is pinned to (`worker`).
+class ClientSession:
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Protocol.MessageReader of this connection (length prefixed JSON and frames)
+        self.messages = None
+        self.addr = writer.get_extra_info('peername')
+        self.key = next(session_ids)
+        self.worker = None
+
+        self.uuid = None
+        self.role = None
+        # room announced on PING (Registry.Room), the host and guests of a room only see each other
+        self.room = default_room
+        self.type_selected = None
+        # organs parsed from type_selected (Protocol.parse_organs), None when nothing supported is selected
+        self.organs = None
+        self.quiz_mode = default_settings.get("quizz_mode", False)
+        # result encoding negotiated on PING ("json" or "binary"), see Protocol.encode_unity_position
+        self.encoding = "json"
+        # number of JSON + frame pairs read so far, sent back in binary results so the client can match them
+        self.frame_seq = 0
+
+        self.connected_at = time.time()
+        # when the current frame's JSON started to arrive (begin_frame), None until then and after an EOF read
+        self.start_time = None
+
+        self.frame_slot = LatestSlot()
+        self.decoded_slot = LatestSlot()
+        self.result_slot = LatestSlot()
+        # everything written to this connection goes through its outbox and its own writer task
+        self.outbox = Outbox(default_settings.get("outbox_limit", 16))
+        # version of the room broadcast (Registry.Room.publish) this connection got last, and how far it fell behind
+        self.broadcast_version = 0
+        self.broadcast_lag_max = 0
+
+        self.counters = {
+            'json_in': 0,
+            'frames_in': 0,
+            'frames_dropped': 0,
+            'frames_processed': 0,
+            'results_dropped': 0,
+            'results_sent': 0,
+            'messages_sent': 0,
+            'err_distance': 0,
+            'quiz_answers': 0,
+            'send_errors': 0,
+            'decode_errors': 0,
+            'stage_errors': 0,
+            'outbox_coalesced': 0,
+            'outbox_dropped': 0,
+            'broadcasts_sent': 0,
+            'broadcasts_skipped': 0,
+        }
+
+        # last measured duration (ms) of every stage, handy when debugging one connection
+        self.stage_ms = {}
+        # latency histograms of every stage of this connection (Metrics.StageMetrics)
+        self.metrics = StageMetrics()
+        # Recording.LandmarkRecorder of this connection when landmark recording is enabled
+        self.recorder = None
+        # latest annotated frame (BGR) and when it came, only while a preview consumer is attached (main.preview_attached)
+        self.preview = None
+        self.preview_at = 0
+
+    def identify(self, userUUID, userRole, room=default_room):
+        changed = userRole != self.role or room != self.room
+        self.uuid = userUUID
+        self.role = userRole
+
+        if room != self.room:
+            self.room = room
+            self.broadcast_version = 0
+
+        # the writer may be waiting without a room (before the first PING) or on the broadcast of the previous one
+        if changed:
+            self.outbox.wake()
+
+    def select_organs(self, selection):
+        if selection != self.type_selected:
+            self.type_selected = selection
+            self.organs = parse_organs(selection)
+
+    # what the inference worker gets: the organ name for one organ, the list when several are tracked at once
+    def track_type(self):
+        if not self.organs:
+            return None
+        return self.organs[0] if len(self.organs) == 1 else list(self.organs)
+
+    # `started` is when the frame's first byte arrived (Protocol.MessageReader.header_time), None => nothing to time
+    def begin_frame(self, started):
+        self.start_time = started
+        return self.start_time
+
+    def incr(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+        server_counters[counter] = server_counters.get(counter, 0) + amount
+
+    def record_stage(self, stage, started, ended=None):
+        if ended is None:
+            ended = time.time()
+        self.record_ms(stage, (ended - started) * 1000)
+
+    # a stage duration measured elsewhere (e.g. inside the inference worker), goes to the session and server histograms
+    def record_ms(self, stage, value_ms):
+        self.stage_ms[stage] = round(value_ms, 2)
+        self.metrics.record(stage, value_ms)
+        server_metrics.record(stage, value_ms)
+
+    def summary(self):
+        return {
+            'key': self.key,
+            'uuid': self.uuid,
+            'role': self.role,
+            'room': self.room,
+            'addr': self.addr,
+            'type_selected': self.type_selected,
+            'organs': self.organs,
+            'worker': self.worker,
+            'quiz_mode': self.quiz_mode,
+            'encoding': self.encoding,
+            'broadcast_lag_max': self.broadcast_lag_max,
+            'uptime_s': round(time.time() - self.connected_at, 2),
+            'counters': dict(self.counters),
+            'stage_ms': dict(self.stage_ms),
+            'latency_ms': self.metrics.summary(),
+        }
@@ -1,48 +1,156 @@
 import yaml
 import os
+import time
 
 # Cache the config to avoid unnecessary file reads
 cached_config = None
 
+# The snapshot the hot paths read, swapped as a whole on reload (see reload_configs)
+current_snapshot = None
+
+# mtimes of the files of the last rejected reload, so a bad file is reported once and not on every poll
+rejected_mtimes = None
+
 default_settings_file = "./settings/default.settings.yaml"
 adjustment_settings_file = "./settings/adjustment.settings.yaml"
 offset_settings_file = "./settings/offset.settings.yaml"
 
+settings_files = [default_settings_file, adjustment_settings_file, offset_settings_file]
+
+# A reload is rejected when one of these is missing from default.settings.yaml
+required_settings = ["users_ttl", "err_distance", "track_supported", "pose_landmarks", "selected_marks", "mp"]
+
 def do_update_adjustment(configs, adjustment_settings):
    defaults = configs["default"]["settings"]
    adjustments = adjustment_settings["settings"]
 
    if adjustments is not None:
       for key, value in defaults.items():
-         if isinstance(value, dict) and isinstance(adjustments[key], dict):
+         if isinstance(value, dict) and isinstance(adjustments.get(key, None), dict):
             if adjustments[key] is not None:
                configs["default"]["settings"][key] = adjustments[key]
- 
+
    return configs
-      
-def svc_configs():
-   global cached_config
+
+def load_configs():
    configs = {}
 
-   # Grab config once to avoid O(N), and cache it
-   if cached_config is None:
-      if os.path.isfile(default_settings_file):
-         with open(default_settings_file, 'r') as file:
-            default_settings = yaml.safe_load(file)
-            configs["default"] = default_settings
-            
-            if default_settings["settings"]["enable_adjustments_settings"]:
-               with open(adjustment_settings_file, 'r') as file:
-                  adjustment_settings = yaml.safe_load(file)
-                  configs = do_update_adjustment(configs, adjustment_settings)
-                  
-      if os.path.isfile(offset_settings_file):
-         with open(offset_settings_file, 'r') as file:
-            offset_settings = yaml.safe_load(file)
-            configs["offsets"] = offset_settings
-
-
-      cached_config = configs
+   if os.path.isfile(default_settings_file):
+      with open(default_settings_file, 'r') as file:
+         default_settings = yaml.safe_load(file)
+         configs["default"] = default_settings
+
+         if default_settings["settings"]["enable_adjustments_settings"]:
+            with open(adjustment_settings_file, 'r') as file:
+               adjustment_settings = yaml.safe_load(file)
+               configs = do_update_adjustment(configs, adjustment_settings)
+
+   if os.path.isfile(offset_settings_file):
+      with open(offset_settings_file, 'r') as file:
+         offset_settings = yaml.safe_load(file)
+         configs["offsets"] = offset_settings
+
+   return configs
+
+def settings_mtimes():
+   mtimes = {}
+   for path in settings_files:
+      try:
+         mtimes[path] = os.stat(path).st_mtime_ns
+      except OSError:
+         mtimes[path] = None
+   return mtimes
+
+# One loaded version of the settings... ayaw usba, himoa ug bag-o (reload_configs)
+# More details
+# `configs` is what svc_configs always returned, `offsets` the CompiledOffsets of configs["offsets"] compiled on
+# first use (Offsets imports this module, so it can not be compiled while Offsets itself is being imported).
+# Nothing mutates a snapshot after it is installed: a reload builds a new one and swaps the module global, so a
+# frame that already grabbed a snapshot finishes with consistent settings and offsets.
+class ConfigSnapshot:
+
+   def __init__(self, version, configs, mtimes=None):
+      self.version = version
+      self.configs = configs
+      self.settings = configs["default"]["settings"]
+      self.mtimes = mtimes or {}
+      self.loaded_at = time.time()
+      self.compiled_offsets = None
+
+   @property
+   def offsets(self):
+      if self.compiled_offsets is None:
+         from Offsets import CompiledOffsets
+         # importing Offsets may already have compiled them (Offsets.compiled_offsets)
+         if self.compiled_offsets is None:
+            self.compiled_offsets = CompiledOffsets(self.configs["offsets"]["settings"])
+      return self.compiled_offsets
+
+# This function raises ValueError when `configs` can not be served, before anything is swapped.
+def validate_configs(configs):
+   if "default" not in configs or "offsets" not in configs:
+      raise ValueError("default.settings.yaml or offset.settings.yaml is missing")
+
+   settings = (configs["default"] or {}).get("settings", None)
+   if not isinstance(settings, dict):
+      raise ValueError("default.settings.yaml has no settings mapping")
+
+   missing = [key for key in required_settings if key not in settings]
+   if missing:
+      raise ValueError(f"default.settings.yaml is missing {missing}")
+
+   users_ttl = settings["users_ttl"]
+   if not isinstance(users_ttl, (int, float)) or users_ttl <= 0:
+      raise ValueError(f"users_ttl must be a positive number, got {users_ttl!r}")
+
+   if len(settings["pose_landmarks"]) != 33:
+      raise ValueError(f"pose_landmarks must name 33 landmarks, got {len(settings['pose_landmarks'])}")
+
+   if not isinstance((configs["offsets"] or {}).get("settings", None), dict):
+      raise ValueError("offset.settings.yaml has no settings mapping")
+
+def install_snapshot(snapshot):
+   global cached_config, current_snapshot
+
+   cached_config = snapshot.configs
+   current_snapshot = snapshot
+   return snapshot
+
+# The snapshot of the settings in use, loaded on first call. Cheap, read it per frame.
+def current_config():
+   if current_snapshot is None:
+      mtimes = settings_mtimes()
+      install_snapshot(ConfigSnapshot(1, load_configs(), mtimes))
       print("configs has been cached")
-      
-   return cached_config
\ No newline at end of file
+   return current_snapshot
+
+def svc_configs():
+   # Grab config once to avoid O(N), and cache it
+   return current_config().configs
+
+# Reload the YAML files when they changed since the current snapshot... walay restart
+# More details
+# Returns the new snapshot once it is validated (offsets included) and installed, None when nothing changed.
+# Bad YAML raises (yaml.YAMLError, ValueError, KeyError, ...) and the current snapshot stays in use.
+# Settings read at import (mp graphs, inference workers, ports, logging) still need a restart; users_ttl,
+# override_type_selected/debug_organ, image_flip, adjust_orientation and the offsets are read per frame.
+def reload_configs(force=False):
+   global rejected_mtimes
+
+   snapshot = current_config()
+   mtimes = settings_mtimes()
+
+   if not force and (mtimes == snapshot.mtimes or mtimes == rejected_mtimes):
+      return None
+
+   try:
+      configs = load_configs()
+      validate_configs(configs)
+      new_snapshot = ConfigSnapshot(snapshot.version + 1, configs, mtimes)
+      new_snapshot.offsets
+   except Exception:
+      rejected_mtimes = mtimes
+      raise
+
+   rejected_mtimes = None
+   return install_snapshot(new_snapshot)
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from BodyLandmarkPosition import (
+    organ_classes, BodyPositionV2, BodyLandmarkPosition, calculate_position, calculate_positions, landmarks_to_array
+)
+from Offsets import compiled_offsets
+
+# Micro benchmark of the organ math... walay mediapipe, landmarks gikan sa fixture
+# More details
+# Every organ calculator is a pure function of the 33 pose landmarks, the image shape and the offsets, so it
+# can be timed without a camera or a model. A fixture is a JSON file with the landmarks of one detection:
+#   { "source": ..., "image_shape": [h, w], "landmarks": [[x, y, z, visibility], ... 33 rows] }
+# For every fixture and image shape this times each organ class, calculate_position, calculate_positions for
+# all organs at once, estimate_distance and the unity conversion (one landmark and all 33), then reports
+# ops/sec, µs per call and the memory allocated per call (tracemalloc).
+#
+#   python deps/benchOrgans.py
+#   python deps/benchOrgans.py --shapes 1280x720,1920x1080 --json organs.json
+#   python deps/benchOrgans.py --record deps/pose.jpg --resize 563x1000 --fixture deps/pose_landmarks.json
+
+default_fixture = os.path.join(os.path.dirname(__file__), "pose_landmarks.json")
+
+
+# Run mediapipe Pose once on an image and write its landmarks as a fixture (the only place mediapipe is needed).
+def record_fixture(image_path, fixture_path, resize=None):
+    import mediapipe as mp
+
+    image = cv2.imread(image_path)
+    if resize is not None:
+        image = cv2.resize(image, resize)
+
+    with mp.solutions.pose.Pose(static_image_mode=True, model_complexity=1) as pose:
+        results = pose.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+
+    if not results.pose_landmarks:
+        raise ValueError(f"no pose found in {image_path}")
+
+    fixture = {
+        'source': image_path,
+        'image_shape': list(image.shape[:2]),
+        'landmarks': [[round(float(value), 6) for value in row] for row in landmarks_to_array(results.pose_landmarks).tolist()],
+    }
+
+    # one landmark per line, easy to read and to diff
+    rows = ",\n".join(f"    {json.dumps(row)}" for row in fixture['landmarks'])
+    with open(fixture_path, "w") as fixture_file:
+        fixture_file.write(f'{{\n  "source": {json.dumps(fixture["source"])},\n  "image_shape": {json.dumps(fixture["image_shape"])},\n  "landmarks": [\n{rows}\n  ]\n}}\n')
+
+    print(f"Recorded {len(fixture['landmarks'])} landmarks from {image_path} {fixture['image_shape']} => {fixture_path}")
+
+
+def load_fixture(fixture_path):
+    with open(fixture_path, "r") as fixture_file:
+        fixture = json.load(fixture_file)
+
+    points = np.array(fixture['landmarks'], dtype=np.float32)
+    if points.shape != (33, 4):
+        raise ValueError(f"{fixture_path}: expected 33 landmarks of (x, y, z, visibility), got {points.shape}")
+
+    return fixture, points
+
+
+# (name, callable) of everything timed for one landmark set and image shape
+def cases(points, image):
+    args = { 'landmarks': points, 'mp_pose': None, 'cv2': cv2, 'image': image, 'points': points }
+    organs = list(organ_classes)
+
+    offsets = compiled_offsets.organ(compiled_offsets.aspect_ratio(*image.shape[:2]) or "16_by_9", "body")
+    calculator = BodyLandmarkPosition(points, None, cv2, image, points)
+    shoulder = calculator.get_landmark('LEFT_SHOULDER')
+
+    benchmarks = [(f"organ.{organ}", (lambda cls: lambda: cls(points, None, cv2, image, points).get_position())(organ_classes[organ])) for organ in organs]
+    benchmarks += [
+        ("organ.body_v2", lambda: BodyPositionV2(points, None, cv2, image, points).get_position()),
+        ("calculate_position(heart)", lambda: calculate_position("heart", dict(args))),
+        (f"calculate_positions({len(organs)} organs)", lambda: calculate_positions(organs, dict(args))),
+        ("landmark setup (valid/coordinates)", lambda: BodyLandmarkPosition(points, None, cv2, image, points)),
+        ("estimate_distance", lambda: BodyLandmarkPosition(points, None, cv2, image, points).estimate_distance(offsets)),
+        ("calculate_unity_coordinates (1)", lambda: calculator.calculate_unity_coordinates(shoulder, 0, 0, 0, offsets, 2.0)),
+        ("all_unity_coordinates (33)", lambda: calculator.all_unity_coordinates(0, 0, 0, offsets, 2.0)),
+    ]
+
+    return benchmarks
+
+
+def time_case(func, min_time):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+
+    best = min(timer.repeat(repeat=3, number=number)) / number
+    return best, number
+
+
+# bytes allocated per call: peak traced memory of one call, and what is still allocated after many calls (leaks)
+def allocations(func, calls=200):
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+
+        for _ in range(calls):
+            func()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak - before, max(after - before, 0) / (calls + 1)
+
+
+def run(args):
+    results = []
+
+    for fixture_path in args.fixture:
+        fixture, points = load_fixture(fixture_path)
+        shapes = args.shapes or [tuple(fixture['image_shape'])]
+
+        for image_height, image_width in shapes:
+            image = np.zeros((image_height, image_width, 3), dtype=np.uint8)
+            aspect_ratio = compiled_offsets.aspect_ratio(image_height, image_width)
+            print(f"\n{os.path.basename(fixture_path)} @ {image_height}x{image_width} (aspect ratio {aspect_ratio})")
+            print(f"  {'case':<38} {'ops/s':>12} {'µs/call':>10} {'peak B':>9} {'kept B/call':>12}")
+
+            for name, func in cases(points, image):
+                if args.filter and args.filter not in name:
+                    continue
+
+                per_call, number = time_case(func, args.min_time)
+                peak, kept = allocations(func)
+
+                row = {
+                    'fixture': fixture_path,
+                    'shape': [image_height, image_width],
+                    'case': name,
+                    'ops_per_s': round(1 / per_call, 1),
+                    'us_per_call': round(per_call * 1e6, 2),
+                    'calls': number,
+                    'peak_bytes': peak,
+                    'kept_bytes_per_call': round(kept, 1),
+                }
+                results.append(row)
+
+                print(f"  {name:<38} {row['ops_per_s']:>12,.0f} {row['us_per_call']:>10.2f} {peak:>9} {row['kept_bytes_per_call']:>12}")
+
+    return results
+
+
+def parse_shapes(value):
+    shapes = []
+    for shape in value.split(","):
+        height, width = shape.lower().split("x")
+        shapes.append((int(height), int(width)))
+    return shapes
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the organ calculators of BodyLandmarkPosition on recorded landmarks, no model needed.")
+    parser.add_argument("--fixture", action="append", default=None, help=f"landmark fixture JSON (repeatable), default {default_fixture}")
+    parser.add_argument("--shapes", type=parse_shapes, default=None, help="image shapes HxW, e.g. 1280x720,1920x1080 (default: the fixture's own)")
+    parser.add_argument("--filter", default=None, help="only cases whose name contains this text")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--json", default=None, help="also write the results to this file")
+    parser.add_argument("--record", default=None, help="record a fixture from this image with mediapipe Pose, then exit")
+    parser.add_argument("--resize", type=parse_size, default=None, help="resize the --record image to WxH first")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_fixture(args.record, (args.fixture or [default_fixture])[0], args.resize)
+        return
+
+    args.fixture = args.fixture or [default_fixture]
+
+    started = time.perf_counter()
+    results = run(args)
+    print(f"\n{len(results)} cases in {time.perf_counter() - started:.1f} s")
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json_file.write(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import urllib.request
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from Metrics import Histogram
+
+# Replay benchmark for unity_stream... walay webcam, same frames matag run
+# More details
+# Replays recorded frames against a running server (python main.py) over the real TCP protocol:
+# 4-byte little-endian length + JSON, then 4-byte length + JPEG, exactly what the unity client sends.
+# Hosts ask for binary results, whose header carries the sequence number of the frame they belong to, so
+# the end-to-end latency of every result is matched to the moment its frame was sent. Guests only PING
+# and count the position/rotation broadcasts they receive from the host.
+# CPU per frame comes from the /metrics side port (server + inference worker processes), when it is enabled.
+# With --rooms the hosts and guests are spread over that many rooms (room id on PING), each host in its own
+# room when --hosts equals --rooms, and the results are also reported per room (scheduling fairness).
+#
+#   python deps/benchStream.py --source deps/pose.jpg --resize 563x1000 --hosts 1 --guests 2 --fps 30 --duration 20
+#   python deps/benchStream.py --source recorded/ --organ heart,lungs --json bench.json
+#   python deps/benchStream.py --source session.mp4 --max-frames 300 --fps 0
+#   python deps/benchStream.py --hosts 8 --rooms 8 --guests 16 --duration 30
+
+image_extensions = (".jpg", ".jpeg", ".png", ".bmp")
+
+# first bytes of a binary result (see Protocol.encode_unity_position / encode_unity_positions)
+binary_header = struct.Struct("<BBHI")
+KIND_UNITY_POSITION = 1
+KIND_UNITY_POSITIONS = 2
+
+
+def pack(data):
+    return len(data).to_bytes(4, byteorder='little') + data
+
+
+def encode_jpeg(image, resize=None, quality=90):
+    if resize is not None:
+        image = cv2.resize(image, resize)
+    ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("unable to encode frame as JPEG")
+    return jpeg.tobytes()
+
+
+# Load the frames to replay as JPEG bytes: a single image, a directory of images (sorted by name) or a video file.
+def load_frames(source, resize=None, max_frames=0, quality=90):
+    frames = []
+
+    if os.path.isdir(source):
+        names = sorted(name for name in os.listdir(source) if name.lower().endswith(image_extensions))
+        for name in names:
+            path = os.path.join(source, name)
+            if resize is None and name.lower().endswith((".jpg", ".jpeg")):
+                with open(path, "rb") as jpeg_file:
+                    frames.append(jpeg_file.read())
+            else:
+                frames.append(encode_jpeg(cv2.imread(path), resize, quality))
+
+            if max_frames and len(frames) >= max_frames:
+                break
+
+    elif source.lower().endswith(image_extensions):
+        frames.append(encode_jpeg(cv2.imread(source), resize, quality))
+
+    else:
+        capture = cv2.VideoCapture(source)
+        while True:
+            ok, image = capture.read()
+            if not ok:
+                break
+            frames.append(encode_jpeg(image, resize, quality))
+            if max_frames and len(frames) >= max_frames:
+                break
+        capture.release()
+
+    if not frames:
+        raise ValueError(f"no frames found in {source}")
+
+    return frames
+
+
+def fetch_metrics(host, port):
+    if not port:
+        return None
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=3) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+
+def total_cpu_seconds(metrics):
+    if metrics is None:
+        return None
+
+    cpu = metrics.get('process_cpu_s', {})
+    values = [cpu.get('server', None)] + list(cpu.get('workers', []) or [])
+    values = [value for value in values if value is not None]
+
+    return sum(values) if values else None
+
+
+# One simulated phone. Results are read on their own task while frames keep going out at the target fps.
+class Client:
+
+    def __init__(self, args, role, idx, frames):
+        self.args = args
+        self.role = role
+        self.uuid = f"bench-{role.lower()}-{idx}"
+        self.room = f"bench-room-{idx % args.rooms}" if args.rooms > 0 else None
+        self.frames = frames
+
+        self.sent = 0
+        self.received = 0
+        self.results = 0
+        self.err_distance = 0
+        self.other_messages = 0
+        self.send_times = {}
+        self.latency = Histogram()
+        self.first_sent = None
+        self.last_received = None
+
+    def message(self, idx):
+        msg = { 'uuid': self.uuid, 'role': self.role }
+
+        # PING registers/refreshes the client, the organs field keeps PING frames tracked as well
+        if idx % self.args.ping_every == 0:
+            msg['message'] = "PING"
+            msg['encoding'] = self.args.encoding
+            if self.room is not None:
+                msg['room'] = self.room
+        elif self.role == "Host":
+            msg['message'] = self.args.organ
+
+        if self.role == "Host":
+            msg['organs'] = self.args.organ
+            msg['position'] = { 'x': 0.0, 'y': 1.0, 'z': 2.0 }
+            msg['rotation'] = { 'x': 0.0, 'y': 90.0, 'z': 0.0 }
+
+        return json.dumps(msg).encode('utf-8')
+
+    async def read_results(self, reader):
+        try:
+            while True:
+                length = int.from_bytes(await reader.readexactly(4), byteorder='little')
+                data = await reader.readexactly(length)
+                now = time.perf_counter()
+
+                self.received += 1
+                self.last_received = now
+
+                if data[:1] == b"{":
+                    message = json.loads(data)
+                    if message.get('message', None) == "Adjust your distance from the camera.":
+                        self.err_distance += 1
+                    elif 'x' in message or 'organs' in message:
+                        self.results += 1
+                    else:
+                        self.other_messages += 1
+                    continue
+
+                kind, _, _, seq = binary_header.unpack_from(data)
+                if kind in (KIND_UNITY_POSITION, KIND_UNITY_POSITIONS):
+                    self.results += 1
+                    sent_at = self.send_times.pop(seq, None)
+                    if sent_at is not None:
+                        self.latency.record((now - sent_at) * 1000)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def run(self, stop_at):
+        reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        results_task = asyncio.create_task(self.read_results(reader))
+
+        interval = 1 / self.args.fps if self.args.fps > 0 else 0
+        guest_interval = 1 / self.args.guest_fps if self.args.guest_fps > 0 else 1
+        next_send = time.perf_counter()
+        idx = 0
+
+        try:
+            while time.perf_counter() < stop_at:
+                if self.role == "Host":
+                    frame = self.frames[idx % len(self.frames)]
+                    if self.args.max_frames and idx >= self.args.max_frames and not self.args.loop:
+                        break
+                else:
+                    frame = b""
+
+                now = time.perf_counter()
+                if self.first_sent is None:
+                    self.first_sent = now
+
+                # the server numbers JSON + frame pairs from 1, binary results carry that number back
+                self.send_times[(idx + 1) & 0xFFFFFFFF] = now
+                writer.write(pack(self.message(idx)) + pack(frame))
+                await writer.drain()
+
+                self.sent += 1
+                idx += 1
+
+                next_send += interval if self.role == "Host" else guest_interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    # running behind (or --fps 0), still let the reader task run
+                    next_send = time.perf_counter()
+                    await asyncio.sleep(0)
+
+            # wait a little for the results still in flight
+            await asyncio.sleep(self.args.drain_s)
+        finally:
+            writer.close()
+            results_task.cancel()
+            await asyncio.gather(results_task, return_exceptions=True)
+
+    def report(self):
+        elapsed = None
+        if self.first_sent is not None and self.last_received is not None:
+            elapsed = max(self.last_received - self.first_sent, 1e-9)
+
+        return {
+            'uuid': self.uuid,
+            'role': self.role,
+            'room': self.room,
+            'sent': self.sent,
+            'received': self.received,
+            'results': self.results,
+            'err_distance': self.err_distance,
+            'other_messages': self.other_messages,
+            'results_per_s': round(self.results / elapsed, 2) if elapsed else 0,
+            'received_per_s': round(self.received / elapsed, 2) if elapsed else 0,
+            'latency_ms': self.latency.summary(),
+        }
+
+
+async def bench(args):
+    frames = load_frames(args.source, args.resize, args.max_frames, args.quality)
+    print(f"Replaying {len(frames)} frame(s) from {args.source}, avg {sum(map(len, frames)) // len(frames)} bytes per JPEG")
+
+    if args.hosts > max(args.rooms, 1):
+        print("WARN: more hosts than rooms, the server will report duplicate hosts")
+
+    metrics_before = fetch_metrics(args.host, args.metrics_port)
+
+    clients = [Client(args, "Host", idx, frames) for idx in range(args.hosts)]
+    clients += [Client(args, "Guest", idx, frames) for idx in range(args.guests)]
+
+    started = time.perf_counter()
+    stop_at = started + args.duration
+
+    # hosts first so the guests always have somebody to follow
+    host_tasks = [asyncio.create_task(client.run(stop_at)) for client in clients if client.role == "Host"]
+    await asyncio.sleep(0.2)
+    guest_tasks = [asyncio.create_task(client.run(stop_at)) for client in clients if client.role == "Guest"]
+    await asyncio.gather(*host_tasks, *guest_tasks)
+
+    wall_s = time.perf_counter() - started
+    metrics_after = fetch_metrics(args.host, args.metrics_port)
+
+    hosts = [client for client in clients if client.role == "Host"]
+
+    host_latency = Histogram()
+    for client in hosts:
+        host_latency.merge(client.latency)
+    results = sum(client.results for client in hosts)
+
+    summary = {
+        'source': args.source,
+        'frames_loaded': len(frames),
+        'hosts': args.hosts,
+        'guests': args.guests,
+        'organ': args.organ,
+        'encoding': args.encoding,
+        'target_fps': args.fps,
+        'wall_s': round(wall_s, 2),
+        'frames_sent': sum(client.sent for client in hosts),
+        'results': results,
+        'results_per_s': round(results / wall_s, 2),
+        'host_latency_ms': host_latency.summary(),
+        'clients': [client.report() for client in clients],
+    }
+
+    if args.rooms > 0:
+        rooms = {}
+        for client in clients:
+            room = rooms.setdefault(client.room, { 'hosts': 0, 'guests': 0, 'results': 0, 'guest_messages': 0, 'latency': Histogram() })
+            if client.role == "Host":
+                room['hosts'] += 1
+                room['results'] += client.results
+                room['latency'].merge(client.latency)
+            else:
+                room['guests'] += 1
+                room['guest_messages'] += client.received
+
+        for room in rooms.values():
+            room['results_per_s'] = round(room['results'] / wall_s, 2)
+            room['latency_ms'] = room.pop('latency').summary()
+
+        summary['rooms'] = rooms
+
+    if metrics_before is not None and metrics_after is not None:
+        counters_before = metrics_before.get('counters', {})
+        counters_after = metrics_after.get('counters', {})
+        server = { key: counters_after.get(key, 0) - counters_before.get(key, 0) for key in counters_after }
+        summary['server_counters'] = server
+
+        cpu_before = total_cpu_seconds(metrics_before)
+        cpu_after = total_cpu_seconds(metrics_after)
+        processed = server.get('frames_processed', 0)
+
+        if cpu_before is not None and cpu_after is not None:
+            summary['cpu_s'] = round(cpu_after - cpu_before, 3)
+            summary['cpu_ms_per_processed_frame'] = round((cpu_after - cpu_before) * 1000 / processed, 2) if processed else None
+            summary['cpu_ms_per_received_frame'] = round((cpu_after - cpu_before) * 1000 / server.get('frames_in', 0), 2) if server.get('frames_in', 0) else None
+
+        summary['server_latency_ms'] = metrics_after.get('latency_ms', {})
+
+    return summary
+
+
+def print_summary(summary):
+    print(f"\nwall {summary['wall_s']} s, {summary['hosts']} host(s), {summary['guests']} guest(s), organ {summary['organ']}, {summary['encoding']}")
+    print(f"frames sent {summary['frames_sent']}, results {summary['results']} ({summary['results_per_s']} /s)")
+
+    latency = summary['host_latency_ms']
+    if latency.get('count', 0):
+        print(f"end-to-end latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}  (n={latency['count']})")
+    else:
+        print("end-to-end latency: no binary results matched (use --encoding binary)")
+
+    if 'server_counters' in summary:
+        server = summary['server_counters']
+        print(f"server: frames_in {server.get('frames_in', 0)}, processed {server.get('frames_processed', 0)}, dropped {server.get('frames_dropped', 0)}")
+    if summary.get('cpu_ms_per_processed_frame', None) is not None:
+        print(f"cpu: {summary['cpu_s']} s total, {summary['cpu_ms_per_processed_frame']} ms per processed frame, {summary['cpu_ms_per_received_frame']} ms per received frame")
+
+    for room_id, room in summary.get('rooms', {}).items():
+        latency = room['latency_ms']
+        p95 = latency['p95'] if latency.get('count', 0) else "-"
+        print(f"  {room_id:<18} hosts {room['hosts']:<3} guests {room['guests']:<3} results {room['results']:<6} {room['results_per_s']:>7} /s  p95 {p95} ms  guest messages {room['guest_messages']}")
+
+    for client in summary['clients']:
+        print(f"  {client['uuid']:<18} sent {client['sent']:<6} received {client['received']:<6} results {client['results']:<6} err_distance {client['err_distance']:<4} {client['received_per_s']} msg/s")
+
+
+def parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded frames against unity_stream and report throughput, latency and CPU per frame.")
+    parser.add_argument("--source", default=os.path.join(os.path.dirname(__file__), "pose.jpg"), help="image, directory of images or video file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=10000)
+    parser.add_argument("--metrics-port", type=int, default=10001, help="metrics side port of the server, 0 => do not query")
+    parser.add_argument("--hosts", type=int, default=1)
+    parser.add_argument("--guests", type=int, default=0)
+    parser.add_argument("--rooms", type=int, default=0, help="spread hosts and guests over this many rooms, 0 => no room (the default room)")
+    parser.add_argument("--organ", default="heart", help='organ (or "heart,lungs", "all") the hosts track')
+    parser.add_argument("--encoding", default="binary", choices=["binary", "json"], help="result encoding asked on PING, latency needs binary")
+    parser.add_argument("--fps", type=float, default=30, help="frames per second per host, 0 => as fast as possible")
+    parser.add_argument("--guest-fps", type=float, default=1, help="PING rate of the guests")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send frames")
+    parser.add_argument("--max-frames", type=int, default=0, help="frames to load (and, without --loop, to send) per host")
+    parser.add_argument("--loop", action="store_true", help="loop over the frames until --duration")
+    parser.add_argument("--resize", type=parse_size, default=None, help="re-encode frames at WxH, e.g. 720x1280")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality when frames are (re-)encoded")
+    parser.add_argument("--ping-every", type=int, default=30, help="send PING every N messages")
+    parser.add_argument("--drain-s", type=float, default=1.0, help="seconds to wait for results after the last frame")
+    parser.add_argument("--json", default=None, help="also write the full report to this file")
+    args = parser.parse_args(argv)
+
+    if not args.max_frames:
+        args.loop = True
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary = asyncio.run(bench(args))
+    print_summary(summary)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json_file.write(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
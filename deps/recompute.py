@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+import cv2
+import yaml
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from BodyLandmarkPosition import calculate_positions, organ_classes
+from Offsets import CompiledOffsets, compiled_offsets
+from Recording import open_recording
+from config import svc_configs, offset_settings_file
+
+configs = svc_configs()
+default_settings  = configs["default"]["settings"]
+
+# Offline re-computation of a landmark recording... usab ang offsets, tan-awa dayon ang resulta, walay model
+# More details
+# Reads a recording written by the server (recording.enable, Recording.LandmarkRecorder) and runs every organ
+# calculator over every frame that has a body, with the offsets of a given offset.settings.yaml (default: the
+# current one). With --compare the same frames are also calculated with the current offsets and the per organ
+# difference of the unity positions is reported, which is what a calibration tweak actually changes.
+#
+#   python deps/recompute.py recordings/2024-08-01_10-00-00-1-abc.lmk
+#   python deps/recompute.py recordings/x.lmk --offsets my.offset.settings.yaml --compare --out recomputed.jsonl
+
+
+def load_offsets(path):
+    with open(path, "r") as offsets_file:
+        return CompiledOffsets(yaml.safe_load(offsets_file)["settings"])
+
+
+def unity_points(result):
+    if not result or isinstance(result, str):
+        return None
+
+    unity_position = result[1]
+    points = unity_position if isinstance(unity_position, list) else [unity_position]
+    if not points:
+        return None
+
+    return np.array([(point['x'], point['y'], point['z']) for point in points], dtype=np.float64)
+
+
+# Every organ of every frame with a body, with the given offsets. Yields (record, args, { organ: result }),
+# `args` being what calculate_positions got so the same frame can be calculated again (--compare).
+def recompute(records, organs, offsets):
+    images = {}
+
+    for record in records:
+        pose = np.array(record['pose'], dtype=np.float32)
+        if np.isnan(pose).all():
+            continue
+
+        # only the shape of the image matters to the organ math, one blank image per resolution is enough
+        shape = (int(record['height']), int(record['width']), 3)
+        image = images.get(shape, None)
+        if image is None:
+            image = np.zeros(shape, dtype=np.uint8)
+            images[shape] = image
+
+        args = { 'landmarks': pose, 'mp_pose': None, 'cv2': cv2, 'image': image, 'points': pose }
+        yield record, args, calculate_positions(organs, args, offsets)
+
+
+def outcome(result, err_distance):
+    if result is None:
+        return "none"
+    if isinstance(result, str) and result == err_distance:
+        return "err_distance"
+    return "ok"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run the organ calculators over a landmark recording with (new) offsets, no model needed.")
+    parser.add_argument("recording", help="recording written by the server (.lmk or its .json index)")
+    parser.add_argument("--offsets", default=offset_settings_file, help="offset.settings.yaml to use")
+    parser.add_argument("--organs", default="all", help='organs to calculate, "all" or e.g. "heart,lungs"')
+    parser.add_argument("--compare", action="store_true", help="also calculate with the current offsets and report the difference")
+    parser.add_argument("--out", default=None, help="write one JSON line per frame with the recomputed positions")
+    args = parser.parse_args(argv)
+
+    index, records = open_recording(args.recording)
+    organs = list(organ_classes) if args.organs == "all" else [organ.strip() for organ in args.organs.split(",")]
+    offsets = load_offsets(args.offsets)
+    err_distance = default_settings["err_distance"]
+
+    print(f"{args.recording}: {len(records)} frames, organs {organs}, offsets {args.offsets}")
+
+    counts = { organ: { 'ok': 0, 'err_distance': 0, 'none': 0 } for organ in organs }
+    deltas = { organ: [] for organ in organs }
+    out_file = open(args.out, "w") if args.out else None
+
+    started = time.perf_counter()
+    frames = 0
+
+    try:
+        for record, frame_args, results in recompute(records, organs, offsets):
+            frames += 1
+
+            if args.compare:
+                current = calculate_positions(organs, frame_args, compiled_offsets)
+
+            for organ in organs:
+                counts[organ][outcome(results[organ], err_distance)] += 1
+
+                if args.compare:
+                    new_points = unity_points(results[organ])
+                    current_points = unity_points(current[organ])
+                    if new_points is not None and current_points is not None and new_points.shape == current_points.shape:
+                        deltas[organ].append((new_points - current_points).mean(axis=0))
+
+            if out_file is not None:
+                line = {
+                    'seq': int(record['seq']),
+                    'time': float(record['time']),
+                    'positions': { organ: (result[1] if result and not isinstance(result, str) else result) for organ, result in results.items() },
+                }
+                out_file.write(json.dumps(line) + "\n")
+    finally:
+        if out_file is not None:
+            out_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{frames} frames with a body recomputed in {elapsed:.2f} s ({frames / elapsed if elapsed else 0:,.0f} frames/s)\n")
+
+    print(f"  {'organ':<10} {'ok':>6} {'err_dist':>9} {'none':>6}" + ("   mean unity delta (x, y, z)" if args.compare else ""))
+    for organ in organs:
+        row = f"  {organ:<10} {counts[organ]['ok']:>6} {counts[organ]['err_distance']:>9} {counts[organ]['none']:>6}"
+        if args.compare and deltas[organ]:
+            delta = np.mean(deltas[organ], axis=0)
+            row += f"   ({delta[0]:+.4f}, {delta[1]:+.4f}, {delta[2]:+.4f})"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
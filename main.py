@@ -1,16 +1,23 @@
-import cv2
-import numpy as np
-import mediapipe as mp
+import time
+# first thing, so the startup report (unity_stream) includes the imports below
+imports_started = time.perf_counter()
+
 import json
 import asyncio
-import time
-import math
+import os
 import traceback
-
-from BodyLandmarkPosition import calculate_position
-from Quizz import start_quiz_func
-from Logger import svc_log, calc_time_and_log
-from config import svc_configs
+from concurrent.futures import BrokenExecutor
+
+from Logger import svc_log, calc_time_and_log, dropped_logs, init_log_folders
+from config import svc_configs, current_config, reload_configs
+from Session import ClientSession, server_counters
+from Registry import ClientRegistry, default_room
+from Recording import start_session_recording
+from Metrics import server_metrics
+from MetricsServer import MetricsServer, process_cpu_seconds
+from Protocol import MessageReader, ProtocolError, encode_unity_position, encode_unity_positions, encodings, ENCODING_BINARY
+from Decoder import FrameDecoder
+from Inference import InferencePool, get_graphs, adjust_orientation, load_mediapipe
 from datetime import datetime, timezone
 
 # --------------------------------------------------------------------------------------------
@@ -21,41 +28,59 @@ default_settings  = configs["default"]["settings"]
 main_runner = default_settings["main_runner"]
 track_supported = default_settings["track_supported"]
 
-mp_settings_pose = default_settings["mp"]["pose"]
-mp_settings_hands = default_settings["mp"]["hands"]
-mp_drawing = mp.solutions.drawing_utils
-mp_drawing_styles = mp.solutions.drawing_styles
-
-mp_pose = mp.solutions.pose
-pose = mp_pose.Pose(**mp_settings_pose)
-
-mp_hands = mp.solutions.hands
-hands = mp_hands.Hands(**mp_settings_hands)
-
 is_cv2_show = default_settings.get("cv2_show", False)
+metrics_settings = default_settings.get("metrics", {})
+metrics_server_settings = default_settings.get("metrics_server", {})
+is_recording = default_settings.get("recording", {}).get("enable", False)
+config_reload_settings = default_settings.get("config_reload", {})
+preview_settings = default_settings.get("preview", {})
+# longest room id kept from a PING, longer ones are cut
+max_room_id = 64
 # --------------------------------------------------------------------------------------------
 #  GLOBALS
 
-clients = {}
-typeSelected = None
-start_time = 0
+# registered users, `clients` is its uuid => entry dict for lookups, change it only through `registry`
+registry = ClientRegistry()
+clients = registry.clients
+inference_pool = None
+frame_decoder = None
+
+# every open connection (ClientSession.key => session), registered or not, and whether unity_stream is accepting them
+sessions = {}
+server_ready = False
+server_started_at = time.time()
+imports_s = time.perf_counter() - imports_started
+
+# seconds every startup phase took, see unity_stream, also served by /metrics
+startup_report = {}
+
+# last time /preview was requested, it keeps the annotation on for preview.idle_s (preview_attached)
+preview_requested_at = 0
 # --------------------------------------------------------------------------------------------
 
 # all staled user must be remove. para gamay nalang ang ehh Loop kahayahay sa nag pa bilin
 # More details
 # This function removes users who have been inactive for longer than the allowed TTL (time-to-live).
-# It checks each user's last active time and disconnects them if the elapsed time exceeds the TTL.
+# The registry hands out only the users whose TTL ran out (ClientRegistry.expired), nobody else is looked at.
 # The `handle_disconnection` function is called to handle the cleanup for inactive users.
 async def remove_staled_user():
-    p_time = time.time()
-    users_ttl = default_settings.get('users_ttl', None)
+    users_ttl = current_config().settings.get('users_ttl', None)
 
     if users_ttl:
-        if len(clients) > 0:
-            for client in clients:
-                elapsed_time = p_time - clients[client]['time']
-                if elapsed_time > users_ttl:
-                    await handle_disconnection(client, clients[client]['role'], clients[client]['writer'])
+        for client in registry.expired(users_ttl):
+            entry = clients[client]
+            await handle_disconnection(client, entry['role'], entry['writer'])
+
+
+# Staled users are removed here every `interval` seconds, not by every connection on every frame.
+async def staled_user_reaper(interval):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            await remove_staled_user()
+        except Exception as e:
+            svc_log(f"Unable to remove staled users => {e}", "ERROR")
 
 
 # For registering and updated changed about the user... igo ragud geh save ug update sa dictionary rag JSON sa javascript
@@ -63,124 +88,60 @@ async def remove_staled_user():
 # This function registers a new user or updates existing user details in the `clients` dictionary.
 # It updates the user’s last active time, role, address, port, and writer if they have changed.
 # New users are added to the dictionary with their initial details. Logging is used to track changes.
-async def register_user(userUUID, userRole, addr, writer):
+# The connection's ClientSession is kept next to the writer so timing and counters stay per connection.
+# `room` is the room id of the PING, a user moves to another room by announcing it.
+async def register_user(userUUID, userRole, addr, writer, session=None, room=default_room):
     checkUser = clients.get(userUUID, None)
     try:
-        
+        if session is not None:
+            session.identify(userUUID, userRole, room)
+
         if checkUser:
-            clients[userUUID]['time'] = time.time()
+            registry.touch(userUUID)
+
+            if clients[userUUID]['room'] != room:
+                svc_log(f"user [{userUUID}, {clients[userUUID]['role']}] moves from room {clients[userUUID]['room']} to {room}")
+                registry.set_room(userUUID, room)
 
             if clients[userUUID]['role'] != userRole:
                 svc_log(f"user [{userUUID}, {clients[userUUID]['role']}] change role from {clients[userUUID]['role']} to {userRole}")
-                clients[userUUID]['role'] = userRole
+                registry.set_role(userUUID, userRole)
 
             if clients[userUUID]['port'] != addr[1]:
                 svc_log(f"user [{userUUID}, {clients[userUUID]['role']}] reconnect from prev port {clients[userUUID]['port']} to {addr}")
-                clients[userUUID]['role'] = userRole
+                registry.set_role(userUUID, userRole)
                 clients[userUUID]['writer'] = writer
                 clients[userUUID]['port'] = addr[1]
+                clients[userUUID]['session'] = session
 
         if checkUser is None:
-            clients[userUUID] = {
-                'role': userRole,
-                'address': addr[0],
-                'port': addr[1],
-                'writer': writer,
-                'time': time.time()
-            }
+            registry.add(userUUID, userRole, addr, writer, session, room)
 
-            svc_log("register user: " + str([userUUID, userRole]))
+            svc_log("register user: " + str([userUUID, userRole, room]))
 
     except Exception as e:
         svc_log("Error in registering user")
         traceback.print_exc()
 
 
-# adjust frame/image from landscape to portrait mode
-# More details
-# This function adjusts the orientation of the provided frame.
-# If the frame is in landscape mode (width greater than height), it rotates the frame to portrait mode.
-# This ensures the frame is correctly oriented for further processing.
-def adjust_orientation(frame):
-    if frame.shape[1] > frame.shape[0]:
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
-    # return cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-
-
-# this will process the frame and calculate the position based on the organ selected.... ambot ug Strategy pattern ang geh follow sa pag calc.
-# More details
-# This function processes a video frame to calculate positions based on organ landmarks.
-# It converts the frame to RGB, processes it with pose and hand models, and calculates positions based on landmarks.
-# The processed frame is returned along with the calculated position results.
-def process_frame(frame, trackType):
-    results = None
-    image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    image.flags.writeable = False
-
-    if default_settings["image_flip"]:
-        image = cv2.flip(image, 1);
-    
-    # mp_pose
-    pose_results = pose.process(image)
-    landmarks = pose_results.pose_landmarks
-
-    # mp_hands
-    hands_results = hands.process(image)
-    hands_marks = hands_results.multi_hand_landmarks
-    handness = hands_results.multi_handedness
-
-    if landmarks or hands_marks:
-        image.flags.writeable = True
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        if hands_marks:
-            for hand_landmarks in hands_marks:
-                mp_drawing.draw_landmarks(image, hand_landmarks, mp_hands.HAND_CONNECTIONS)
-
-        if landmarks:
-            args = {
-                'landmarks': landmarks,
-                'mp_pose': mp_pose,
-                'cv2': cv2,
-                'image': image
-            }
-
-            args2 = {
-                'landmarks': hands_marks,
-                'handness': handness,
-                'mp_hands': mp_hands,
-                'cv2': cv2,
-                'image': image
-            }
-
-            mp_drawing.draw_landmarks(image, landmarks, mp_pose.POSE_CONNECTIONS)
-            results =  calculate_position(trackType, args)
-
-            # if startQuiz:
-            #     start_quiz_func(args, args2, trackType, results, currentUser, send_user_message, writer)
-        
-    return results, image
-
 # Recieve JSON from clients
 # More details
-# This function receives and decodes a JSON message from the client.
-# It reads the length prefix to determine the size of the JSON data, then reads and decodes the JSON message.
-# It handles incomplete reads and other exceptions gracefully, returning `None` if an error occurs.
-async def receive_json(reader):
+# This function receives and decodes a JSON message from the client through the connection's MessageReader.
+# The message bytes are decoded as they come from the reader (json.loads takes bytes).
+# recv_json is measured from the length prefix, not from when the reader started waiting for the client.
+# It handles incomplete reads and decoding errors gracefully, returning `None` if an error occurs.
+# A ProtocolError (e.g. a length above protocol.max_json_bytes) is not swallowed: the stream can not be trusted anymore.
+async def receive_json(messages, session=None):
     try:
-        length_prefix = await reader.readexactly(4)
-        if not length_prefix:
-            return None
+        jsonMsg = await messages.read_json()
 
-        json_length = int.from_bytes(length_prefix, byteorder='little')
-        json_data = await reader.readexactly(json_length)
-        json_str = json_data.decode('utf-8')
-       
-        json_msg = json.loads(json_str)
+        if session is not None:
+            session.record_ms('recv_json', (time.perf_counter() - messages.header_at) * 1000)
 
-        return json_msg  
-    
+        return jsonMsg
+
+    except ProtocolError:
+        raise
     except asyncio.IncompleteReadError as e:
         return None
     except UnicodeDecodeError as e:
@@ -193,28 +154,27 @@ async def receive_json(reader):
 
 # Recieve Video FRAME from clients
 # More details
-# This function receives and decodes a video frame from the client.
-# It reads the length prefix to determine the size of the frame data, then reads and decodes the frame.
-# It handles incomplete reads and other exceptions gracefully, returning `None` if an error occurs.
-async def receive_frame(reader):
+# This function receives a video frame (JPEG) from the client through the connection's MessageReader.
+# The JPEG bytes are returned as read, decoding happens in the decoder pool (decode_stage).
+# It handles incomplete reads gracefully, returning `None` if an error occurs or the frame is empty (guests).
+# A ProtocolError (e.g. a length above protocol.max_frame_bytes) is not swallowed: the stream can not be trusted anymore.
+async def receive_frame(messages, session=None):
     try:
-        length_prefix = await reader.readexactly(4)
+        started = time.perf_counter()
+        frame_data = await messages.read_frame()
 
-        if not length_prefix:
+        if len(frame_data) == 0:
             return None
-        
-        frame_length = int.from_bytes(length_prefix, byteorder='little')
-        frame_data = await reader.readexactly(frame_length)
 
-        frame_array = np.frombuffer(frame_data, dtype=np.uint8)
-        frame = cv2.imdecode(frame_array, cv2.IMREAD_COLOR)
+        if session is not None:
+            session.record_ms('recv_frame', (time.perf_counter() - started) * 1000)
 
-        return frame
+        return frame_data
     
+    except ProtocolError:
+        raise
     except asyncio.IncompleteReadError as e:
         return None
-    except cv2.error as e:
-        return None
     except Exception as e:
         return None
 
@@ -222,65 +182,152 @@ async def receive_frame(reader):
 # send UNITY POSITION to HOST
 # More details
 # This function sends the calculated unity position to a specified user.
-# It encodes the position data in JSON format and sends it to the user using their writer.
-# It handles connection errors and ensures the writer is closed properly if there are issues.
-async def send_unity_position(userUUID, unity_position):
-    global start_time
+# It encodes the position data in JSON format (default) or, if that user negotiated "binary" on PING, as the packed
+# struct of Protocol.encode_unity_position tagged with the organ and the frame's sequence number.
+# With a list of organs as `track_type`, `unity_position` is {'organs': {...}} and goes out as encode_unity_positions.
+# The message goes to the recipient's outbox as its latest result (see outbox_stage), nothing waits for the socket.
+# The latency is measured from `start_time` (the frame's own start time) or else from the originating session.
+async def send_unity_position(userUUID, unity_position, session, start_time=None, track_type=None, seq=0):
+    if start_time is None:
+        start_time = session.start_time
     checkUser = clients.get(userUUID, None)
 
     try:
         if checkUser:
-            writer = clients[userUUID]['writer']
-            user_role = clients[userUUID]['role']
+            recipient = checkUser.get('session', None)
+            if recipient is None:
+                return
 
-            data = json.dumps(unity_position).encode('utf-8')
-            length_prefix = len(data).to_bytes(4, byteorder='little')
-            writer.write(length_prefix + data)
-            
-            await writer.drain()
+            serialize_started = time.perf_counter()
 
-            end_time = time.time()
-            calc_time_and_log(topic='send_unity_position', role=user_role, start_time=start_time, end_time=end_time)
+            if recipient.encoding == ENCODING_BINARY:
+                if isinstance(track_type, list):
+                    data = encode_unity_positions(unity_position['organs'], seq)
+                else:
+                    data = encode_unity_position(unity_position, track_type, seq)
+            else:
+                data = json.dumps(unity_position).encode('utf-8')
 
-    except (ConnectionResetError, BrokenPipeError, OSError) as e:
-        svc_log(f"Error sending json message: {e}. The client might have disconnected.", "ERROR")
-        await handle_disconnection(userUUID, user_role, writer)
+            length_prefix = len(data).to_bytes(4, byteorder='little')
+            message = outbox_message(length_prefix + data, session, start_time, 'send_unity_position', 'results_sent')
+            session.record_ms('serialize', (time.perf_counter() - serialize_started) * 1000)
+
+            deliver(recipient, message, "result")
 
     except Exception as e:
         svc_log(f"Error sending json message: {e}", "ERROR")
 
 
+# send the positions of several organs (one frame) to HOST
+# More details
+# `results` is what BodyLandmarkPosition.calculate_positions returned for the frame. Organs that have a position
+# go out in one message, {"organs": {organ: unity_position}} in JSON or a KIND_UNITY_POSITIONS struct in binary.
+# When every organ failed the distance check the usual "Adjust your distance" message is sent instead.
+async def send_organ_positions(userUUID, results, session, start_time=None, seq=0):
+    positions = {}
+    err_distance = False
+
+    for organ, result in results.items():
+        if isinstance(result, str) and result == current_config().settings["err_distance"]:
+            err_distance = True
+        elif result:
+            positions[organ] = result[1]
+
+    if not positions:
+        if err_distance:
+            session.incr('err_distance')
+            error_message = { 'uuid': userUUID, 'message': "Adjust your distance from the camera." }
+            await send_json_message(userUUID, error_message, session, start_time, "result")
+        return
+
+    await send_unity_position(userUUID, { 'organs': positions }, session, start_time, list(positions), seq)
+
+
 # This function sends a JSON message to a specified user.
-# It encodes the message in JSON format and sends it using the user's writer.
-# It handles connection errors and ensures the writer is closed properly if there are issues.
-async def send_json_message(userUUID, json_msg):
-    global start_time
+# It encodes the message in JSON format and puts it in the user's outbox, the user's own writer task sends it.
+# `session` is the connection that produced the message (e.g. the host relaying to a guest); its counters are
+# updated and `start_time` (default: the session's start time) is used for the latency histogram. Without it nothing is timed.
+# A message with a `key` replaces an unsent message with the same key (Session.Outbox), e.g. the latest result.
+async def send_json_message(userUUID, json_msg, session=None, start_time=None, key=None):
+    if session is not None and start_time is None:
+        start_time = session.start_time
     checkUser = clients.get(userUUID, None)
 
     try:
         if checkUser:
-            writer = clients[userUUID]['writer']
-            user_role = clients[userUUID]['role']
-
-            if writer.is_closing():
+            recipient = checkUser.get('session', None)
+            if recipient is None or recipient.writer.is_closing():
                 return
-            
+
             data = json.dumps(json_msg).encode('utf-8')
             length_prefix = len(data).to_bytes(4, byteorder='little')
 
-            writer.write(length_prefix + data)
-            await writer.drain()
+            deliver(recipient, outbox_message(length_prefix + data, session, start_time, 'send_json_message', 'messages_sent'), key)
 
-            end_time = time.time()
-            calc_time_and_log(topic='send_json_message', role=user_role, start_time=start_time, end_time=end_time)
-
-    except (ConnectionResetError, BrokenPipeError, OSError) as e:
-        svc_log(f"Error sending json message: {e}. The client might have disconnected.", "ERROR")
-        await handle_disconnection(userUUID, user_role, writer)
     except Exception as e:
         svc_log(f"Error sending json message: {e}", "ERROR")
 
 
+# What an outbox (or a room broadcast) holds: the bytes to write and who to credit once they are written.
+def outbox_message(data, session=None, start_time=None, stage=None, counter=None):
+    return { 'data': data, 'session': session, 'start_time': start_time, 'stage': stage, 'counter': counter }
+
+
+# Put a message in the recipient's outbox and count it when it replaced or pushed out another one.
+def deliver(recipient, message, key=None):
+    outcome = recipient.outbox.put(message, key)
+    if outcome is not None:
+        recipient.incr(f"outbox_{outcome}")
+
+
+# Writer of one connection... ang hinay nga phone dili na makapugong sa uban
+# More details
+# Every connection has this task as the only writer of its socket. It sends what is in the session's outbox and,
+# for a guest, the latest position/rotation broadcast of its room (Registry.Room.publish). A guest that can not keep
+# up only gets the newest broadcast when it is ready again, the versions it skipped are counted
+# (broadcasts_skipped, broadcast_lag_max). Waiting on drain here never holds up the host or any other connection.
+async def outbox_stage(session):
+    writer = session.writer
+    outbox = session.outbox
+
+    while not writer.is_closing():
+        room = registry.room(session.room) if session.role == "Guest" else None
+
+        if room is not None and room.latest is not None and room.version != session.broadcast_version:
+            if session.broadcast_version:
+                skipped = max(room.version - session.broadcast_version - 1, 0)
+                if skipped:
+                    session.incr('broadcasts_skipped', skipped)
+                    session.broadcast_lag_max = max(session.broadcast_lag_max, skipped)
+
+            session.broadcast_version = room.version
+            message = room.latest
+            session.incr('broadcasts_sent')
+        elif outbox:
+            message = outbox.take()
+        else:
+            await outbox.wait(room.next_change() if room is not None else None)
+            continue
+
+        try:
+            drain_started = time.perf_counter()
+            writer.write(message['data'])
+            await writer.drain()
+            session.record_ms('drain', (time.perf_counter() - drain_started) * 1000)
+
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            session.incr('send_errors')
+            svc_log(f"Error sending json message: {e}. The client might have disconnected.", "ERROR")
+            await handle_disconnection(session.uuid, session.role, writer)
+            return
+
+        origin = message['session']
+        if origin is not None:
+            origin.incr(message['counter'])
+            if message['start_time'] is not None:
+                origin.record_stage(message['stage'], message['start_time'])
+
+
 # This function handles user disconnections.
 # It closes the writer for the specified user and removes the user from the `clients` dictionary.
 # Logging is used to track the closure and removal of users.
@@ -291,138 +338,444 @@ async def handle_disconnection(userUUID, role, writer):
             await writer.wait_closed()
             svc_log(f"Writer for [{userUUID}, {role}] closed.")
 
-        if userUUID in clients:
-            del clients[userUUID]
+        if registry.remove(userUUID) is not None:
             svc_log(f"Removing [{userUUID}, {role}] from clients. Current number of clients connected ({len(clients)})")
 
     except Exception as e:
         svc_log(f"Error closing writer for {userUUID}: {e}", "ERROR")
     finally:
         # Ensure it removes
-        if userUUID in clients:
-            del clients[userUUID]
+        if registry.remove(userUUID) is not None:
             svc_log(f"Ensure to remove [{userUUID}, {role}] from clients. Current number of clients connected ({len(clients)})", "WARN")
 
 
-# maintain client connection and process them... wanakoy masulti kay naana dinhia tanang publema
+# Read side of the connection pipeline... basaha dayon ang socket bisan nag infer pa, ang pinaka bag-o ra nga frame ang ipasa
 # More details
-# This function maintains client connections and processes incoming data.
-# It handles JSON and frame data, manages user roles, and ensures only one host is active.
-# It processes frames to calculate positions, updates clients with new information, and manages client disconnections.
-async def handle_client(reader, writer):
-    global start_time
-    global typeSelected
-
-    addr = writer.get_extra_info('peername')
-    loop = asyncio.get_running_loop()
+# This function keeps reading JSON + frame pairs from the socket for as long as the connection lives.
+# It handles PINGs, host bookkeeping and the position/rotation broadcast to guests right away, and hands
+# frames that need inference to the inference stage through a latest-frame-wins slot. If the previous
+# frame has not been picked up yet it is replaced (and counted as dropped) instead of being queued.
+# Host bookkeeping and the broadcast only involve the clients of the session's room (`room` on PING), so every
+# room is its own host/guests group; clients that never name a room share the default one.
+async def reader_stage(session):
+    reader = session.reader
+    writer = session.writer
+    addr = session.addr
     position_rotation = None
-    cachedFrame = None
     not_empty_mult_host = False
 
-    try:
-        while True:
-            start_time = time.time()
-            
-            if reader.at_eof():
-                svc_log("Reader reached EOF. Possible Host disconnect or quit")
-                break
-
-            jsonMsg = await receive_json(reader)
-            frame = await receive_frame(reader)
-
-            if jsonMsg:
-                userUUID = jsonMsg.get('uuid', None)
-                userRole = jsonMsg.get('role', None)
-                msg_text = jsonMsg.get('message', None)
-                position = jsonMsg.get('position', None)
-                rotation = jsonMsg.get('rotation', None)
-               
-                if msg_text == "PING":
-                    # if userUUID and userRole and msg_text:
-                    await register_user(userUUID, userRole, addr, writer)
-                    # # No Need to send back PONG
-                    # pong_msg = { 'message' : "PONG"}
-                    # await send_json_message(userUUID, pong_msg)
-
-            # remove user that no longer active... kung sa DULA pah AFK nah. inang dayug easy farm.
-            await remove_staled_user()       
+    while True:
+        if reader.at_eof() or reader.exception() is not None:
+            svc_log("Reader reached EOF. Possible Host disconnect or quit")
+            break
+
+        jsonMsg = await receive_json(session.messages, session)
+        # the frame starts when its JSON's length prefix arrived, the idle time before it is not latency.
+        # Without one (EOF) nothing of this iteration is timed.
+        session.begin_frame(session.messages.header_time)
+        frame = await receive_frame(session.messages, session)
+        session.frame_seq += 1
+
+        msg_text = None
+        organs_selected = None
+        position = None
+        rotation = None
+
+        if jsonMsg:
+            session.incr('json_in')
+            userUUID = jsonMsg.get('uuid', None)
+            userRole = jsonMsg.get('role', None)
+            msg_text = jsonMsg.get('message', None)
+            organs_selected = jsonMsg.get('organs', None)
+            position = jsonMsg.get('position', None)
+            rotation = jsonMsg.get('rotation', None)
+
+            # quiz mode is the only mode that consumes hand landmarks, the client turns it on/off explicitly
+            if 'quiz' in jsonMsg:
+                session.quiz_mode = bool(jsonMsg['quiz'])
+           
+            if msg_text == "PING":
+                # result encoding is negotiated on PING, JSON unless the client asks for binary
+                encoding = jsonMsg.get('encoding', None)
+                if encoding in encodings and encoding != session.encoding:
+                    session.encoding = encoding
+                    svc_log(f"user [{userUUID}, {userRole}] uses {encoding} result encoding")
+
+                room = str(jsonMsg.get('room', None) or default_room)[:max_room_id]
+
+                # if userUUID and userRole and msg_text:
+                await register_user(userUUID, userRole, addr, writer, session, room)
+                # # No Need to send back PONG
+                # pong_msg = { 'message' : "PONG"}
+                # await send_json_message(userUUID, pong_msg)
+
+        # remove user that no longer active... kung sa DULA pah AFK nah. inang dayug easy farm.
+        # (staled_user_reaper does it in the background)
+
+        room = session.room
+
+        # count if how many host in the room... kay mabuang ang ning server kung duha
+        count_host = registry.count("Host", room)
+        if count_host > 1:
+            not_empty_mult_host = True
+        
+        # Notify all hosts of the room about the issue of multiple hosts connection.... para nice feature kunuhay
+        if not_empty_mult_host: 
+            for client in list(registry.members("Host", room)):
+                duplicate_host_msg = { 'uuid': client, 'message': "There are multiple hosts. Only one is allowed." }
+                await send_json_message(client, duplicate_host_msg, session, key="host_notice")
             
-            # count if how many host in the clients list... kay mabuang ang ning server kung duha
-            count_host = sum(1 for client in clients if clients[client]['role'] == "Host")
-            if count_host > 1:
-                not_empty_mult_host = True
+
+        if count_host == 1:
+            room_entry = registry.room(room)
+
+            if not_empty_mult_host:
+                for client in list(room_entry.members()):
+                    duplicate_host_msg = { 'uuid': client, 'message': "" }
+                    await send_json_message(client, duplicate_host_msg, session, key="host_notice")
+
+                not_empty_mult_host = False
+
+            if frame is not None:
+                session.incr('frames_in')
+                host_client = registry.host(room)
             
-            # Notify all hosts about the issue of multiple hosts connection.... para nice feature kunuhay
-            if not_empty_mult_host: 
-                for client in clients:
-                    if clients[client]['role'] == "Host":
-                        duplicate_host_msg = { 'uuid': client, 'message': "There are multiple hosts. Only one is allowed." }
-                        await send_json_message(client, duplicate_host_msg)
-                
-
-            if count_host == 1:
-                if not_empty_mult_host:
-                    for client in clients:
-                        duplicate_host_msg = { 'uuid': client, 'message': "" }
-                        await send_json_message(client, duplicate_host_msg)
-
-                    not_empty_mult_host = False
-
-                if frame is not None:
-                    cachedFrame = frame
-                    host_client = next(client for client in clients if clients[client]['role'] == "Host")
-                
-                    adjustedFrame = frame
-                    if msg_text is not None:
-                        typeSelected = msg_text
-
-                    if default_settings["adjust_orientation"]:
-                        adjustedFrame = adjust_orientation(frame=cachedFrame)
-                    if default_settings["override_type_selected"]:
-                        typeSelected = default_settings["debug_organ"]
-
-                    if typeSelected and isinstance(track_supported, list) and typeSelected in track_supported:
-                        results, image = await loop.run_in_executor(None, process_frame, adjustedFrame, typeSelected.lower())
-                        
-                        if results:
-                            if isinstance(results, str) and results == default_settings["err_distance"]:
-                                error_message = { 'uuid': host_client, 'message': "Adjust your distance from the camera." }
-                                await send_json_message(host_client, error_message)
-                            else:
-                                common_position, unity_position = results
-                                await send_unity_position(host_client, unity_position)
-
-                        if is_cv2_show:
-                            if image is not None:
-                                cv2.imshow(addr[0], image)
-                                cv2.waitKey(1)
-
-                    if position and rotation:
-                        position_rotation = {
-                            "positionX": position['x'],
-                            "positionY": position['y'],
-                            "positionZ": position['z'],
-                            "rotationX": rotation['x'],
-                            "rotationY": rotation['y'],
-                            "rotationZ": rotation['z']
-                        }
-
-                    if position_rotation:
-                        for client in clients:
-                            if clients[client]['role'] == "Guest" and position_rotation:
-                                await send_json_message(client, position_rotation)
-
-            await asyncio.sleep(0.03)
-    except Exception as e:
-        svc_log(f"Exception in client thread: {e}", "ERROR")
+                # an `organs` list wins over the message text, both may hold several organs ("heart,lungs", "all")
+                if organs_selected is not None:
+                    session.select_organs(organs_selected)
+                elif msg_text is not None:
+                    session.select_organs(msg_text)
+
+                settings = current_config().settings
+                if settings["override_type_selected"]:
+                    session.select_organs(settings["debug_organ"])
+
+                if host_client == session.uuid:
+                    room_entry.select_organs(session.type_selected, session.organs)
+
+                if session.organs:
+                    frame_job = {
+                        'jpeg': frame,
+                        'track_type': session.track_type(),
+                        'use_hands': session.quiz_mode,
+                        'host_client': host_client,
+                        'seq': session.frame_seq,
+                        'start_time': session.start_time,
+                        'room': room
+                    }
+
+                    if session.frame_slot.put(frame_job):
+                        session.incr('frames_dropped')
+
+                if position and rotation:
+                    position_rotation = {
+                        "positionX": position['x'],
+                        "positionY": position['y'],
+                        "positionZ": position['z'],
+                        "rotationX": rotation['x'],
+                        "rotationY": rotation['y'],
+                        "rotationZ": rotation['z']
+                    }
+
+                # one encode for the whole room, every guest's writer picks up the latest (outbox_stage)
+                if position_rotation:
+                    data = json.dumps(position_rotation).encode('utf-8')
+                    room_entry.publish(outbox_message(len(data).to_bytes(4, byteorder='little') + data, session, session.start_time, 'send_json_message', 'messages_sent'))
+
+
+# A frame that fails in one of the stages below is logged and counted (stage_errors), the stage goes on with the
+# next frame. A broken executor (an inference worker or decoder process that died) is not recoverable: it is raised,
+# the stage ends and handle_client closes the connection instead of leaving a client that never gets results.
+def stage_failed(session, stage, error):
+    session.incr('stage_errors')
+    svc_log(f"{stage} stage failed for session {session.key} => {error}", "ERROR")
+    traceback.print_exc()
+
+
+# Decode stage... i-decode ang sunod nga frame samtang nag infer pa ang karon
+# More details
+# This function waits for the newest JPEG from the reader stage, decodes it in the decoder pool (Decoder.FrameDecoder)
+# and hands the frame to the inference stage through another latest-wins slot. A JPEG that was replaced in the
+# frame slot before its turn is never decoded, and the next frame decodes while the current one is in inference.
+async def decode_stage(session):
+    while True:
+        frame_job = await session.frame_slot.get()
+
+        try:
+            frame, decode_ms, frame_shape = await frame_decoder.decode(frame_job['jpeg'])
+            session.record_ms('imdecode', decode_ms)
+            frame_job['jpeg'] = None
+
+            if frame is None:
+                session.incr('decode_errors')
+                continue
+
+            frame_job['frame'] = frame
+            frame_job['frame_shape'] = frame_shape
+            if session.decoded_slot.put(frame_job):
+                session.incr('frames_dropped')
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            stage_failed(session, 'decode', e)
+
+
+# Inference stage... usa ra ka frame ang ginaproseso, ang uban naa ra sa slot nag hulat (o na drop na)
+# More details
+# This function waits for the newest decoded frame from the decode stage, runs it on the inference worker the session
+# is pinned to (see Inference.InferencePool) and passes the outcome to the sender stage through another latest-wins slot. While inference runs the
+# reader keeps draining the socket, so the frame picked up next is always the most recent one.
+# A frame whose worker died is counted as a stage error, the next one runs on a live worker.
+async def inference_stage(session):
+    while True:
+        frame_job = await session.decoded_slot.get()
+
+        try:
+            # the landmarks of a host session go to its recording when recording.enable is set
+            if is_recording and session.recorder is None:
+                session.recorder = start_session_recording(session)
+
+            # headless unless somebody looks, and then only every preview.sample_every frames of the session
+            annotate = preview_attached() and session.counters['frames_processed'] % max(1, preview_settings.get("sample_every", 5)) == 0
+
+            started = time.perf_counter()
+            results, image, timings, landmarks, quiz = await inference_pool.run(session, frame_job['frame'], frame_job['track_type'], frame_job['use_hands'], session.recorder is not None, frame_job['room'], frame_job['frame_shape'], annotate)
+            session.incr('frames_processed')
+
+            if landmarks is not None:
+                session.recorder.append(frame_job['seq'], frame_job['start_time'], landmarks['shape'], landmarks.get('pose', None), landmarks.get('hands', None), landmarks.get('handedness', None))
+
+            # round trip to the worker (queueing + transfer + work) and the steps measured inside the worker
+            session.record_ms('inference', (time.perf_counter() - started) * 1000)
+            for stage, value_ms in timings.items():
+                session.record_ms(stage, value_ms)
+
+            frame_job['results'] = results
+            frame_job['image'] = image
+            frame_job['quiz'] = quiz
+            frame_job['frame'] = None
+
+            if session.result_slot.put(frame_job):
+                session.incr('results_dropped')
+        except Exception as e:
+            # a dead worker (BrokenExecutor) only costs this frame, the pool restarts it and the session moves on
+            stage_failed(session, 'inference', e)
+
+
+# Sender stage... i-send ang resulta sa host, ug ipakita ang preview kung naka enable
+# More details
+# This function waits for inference results and sends them to the host, either as a unity position or
+# as the distance error message (through the host's outbox). Latency is measured from the moment the frame's JSON
+# started being read until the host's writer has written it. In quiz mode the quiz answer of the frame follows as
+# {"uuid": ..., "quiz": [{"hand", "calc", "result"}, ...]}.
+# An annotated image (sampled frames while a preview consumer is attached) is kept for /preview and shown with cv2_show.
+async def sender_stage(session):
+    addr = session.addr
+
+    while True:
+        frame_job = await session.result_slot.get()
+
+        try:
+            results = frame_job['results']
+            image = frame_job['image']
+            host_client = frame_job['host_client']
+            start_time = frame_job['start_time']
+
+            if results:
+                if isinstance(results, str) and results == current_config().settings["err_distance"]:
+                    session.incr('err_distance')
+                    error_message = { 'uuid': host_client, 'message': "Adjust your distance from the camera." }
+                    await send_json_message(host_client, error_message, session, start_time, "result")
+                elif isinstance(results, dict):
+                    await send_organ_positions(host_client, results, session, start_time, frame_job['seq'])
+                else:
+                    common_position, unity_position = results
+                    await send_unity_position(host_client, unity_position, session, start_time, frame_job['track_type'], frame_job['seq'])
+
+            # quiz mode: what the hands answered on this frame (Quizz.start_quiz_func), only the newest waits in the outbox
+            if frame_job['quiz'] is not None:
+                session.incr('quiz_answers')
+                quiz_message = { 'uuid': host_client, 'quiz': frame_job['quiz'] }
+                await send_json_message(host_client, quiz_message, session, start_time, "quiz")
+
+            if image is not None:
+                session.preview = image
+                session.preview_at = time.time()
+
+                if is_cv2_show:
+                    import cv2
+                    cv2.imshow(addr[0], image)
+                    cv2.waitKey(1)
+        except BrokenExecutor:
+            raise
+        except Exception as e:
+            stage_failed(session, 'sender', e)
+
+
+# maintain client connection and process them... wanakoy masulti kay naana dinhia tanang publema
+# More details
+# This function maintains client connections and processes incoming data.
+# It runs the connection as stages: reading (JSON + frame), inference, sending the results and writing the
+# socket (outbox_stage). The reader never waits for inference or for any client's socket, and stale frames are
+# dropped instead of piling up in the kernel buffer.
+# A stage that ends closes the connection, so a client is never left connected with a dead stage.
+# Everything that belongs to this connection (selected organ, frame start time, counters) lives on its ClientSession.
+async def handle_client(reader, writer):
+    session = ClientSession(reader, writer)
+    session.messages = MessageReader(reader)
+    addr = session.addr
+    sessions[session.key] = session
+
+    stages = [
+        asyncio.create_task(reader_stage(session), name="reader"),
+        asyncio.create_task(decode_stage(session), name="decode"),
+        asyncio.create_task(inference_stage(session), name="inference"),
+        asyncio.create_task(sender_stage(session), name="sender"),
+        asyncio.create_task(outbox_stage(session), name="outbox")
+    ]
+
+    try:
+        # the connection lives as long as all of its stages do, the first one to end (EOF, a fatal error, the
+        # writer closed) closes it
+        done, pending = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+        for stage in done:
+            if not stage.cancelled() and stage.exception() is not None:
+                svc_log(f"Exception in client thread ({stage.get_name()} stage): {stage.exception()}", "ERROR")
     finally:
-        if writer:
+        sessions.pop(session.key, None)
+        for stage in stages:
+            stage.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+        await inference_pool.release(session)
+        if session.recorder is not None:
+            session.recorder.close()
+
+        if writer and not writer.is_closing():
             writer.close()
             await writer.wait_closed()
         if addr and addr[0]:
             if is_cv2_show:
+                import cv2
                 cv2.destroyWindow(addr[0])
         svc_log(f"Connection to {addr} closed. Current number of clients connected {len(clients)}")
+        svc_log(f"Session summary => {json.dumps(session.summary())}")
+
+# Latency summary every metrics.report_interval_s... usa ra ka log line imbes 30 matag segundo matag client
+# More details
+# This function logs the p50/p95/p99 of every stage, server wide and for every connected client.
+# The histograms keep counting from the start, the summaries are not reset after a report.
+async def metrics_reporter(interval):
+    while True:
+        await asyncio.sleep(interval)
+
+        summary = server_metrics.summary()
+        if summary:
+            svc_log(f"Latency summary => {json.dumps(summary)}", "INFO", "Metrics")
+
+        for userUUID, client in list(clients.items()):
+            session = client.get('session', None)
+            if session is not None and session.metrics.histograms:
+                svc_log(f"Latency summary [{userUUID}, {session.role}] => {json.dumps(session.metrics.summary())}", "INFO", "Metrics")
+
+
+# Watch the settings files... usba ang YAML, dili na kinahanglan i-restart ang server
+# More details
+# Every `interval` seconds the mtimes of the settings files are compared with the current config snapshot, a
+# changed file is loaded, validated (offsets compiled) and swapped in (config.reload_configs). A file that does
+# not validate is logged once and the server keeps the snapshot it has. Inference workers get the new snapshot
+# with their next frame (InferencePool.worker_config).
+async def config_watcher(interval):
+    while True:
+        await asyncio.sleep(interval)
+
+        try:
+            snapshot = reload_configs()
+        except Exception as e:
+            svc_log(f"Config reload rejected, keeping version {current_config().version} => {type(e).__name__}: {e}", "WARN", "Config")
+            continue
+
+        if snapshot is not None:
+            svc_log(f"Config reloaded => version {snapshot.version}", "INFO", "Config")
+
+
+# Ready for /healthz: listening and every inference worker alive (not while a dead one is being restarted).
+def server_healthy():
+    return server_ready and (inference_pool is None or inference_pool.healthy())
+
+
+# Live view of the server for the /metrics endpoint (MetricsServer).
+# More details
+# Counters are totals since start over every session, queue depth is what waits right now between the pipeline
+# stages and inside the inference workers, latency_ms holds the server wide stage percentiles (Metrics).
+# CPU is read from /proc for the server process and every inference worker process (None where unavailable).
+def server_snapshot():
+    clients_by_role = registry.role_counts()
+
+    open_sessions = list(sessions.values())
+    workers = inference_pool.stats() if inference_pool is not None else None
+
+    server_pid = os.getpid()
+    process_cpu = { 'server': process_cpu_seconds(server_pid) }
+    if workers is not None and workers['mode'] == "process":
+        process_cpu['workers'] = [process_cpu_seconds(pid) for pid in workers['pids']]
+
+    return {
+        'ready': server_healthy(),
+        'uptime_s': round(time.time() - server_started_at, 2),
+        'connections': len(open_sessions),
+        'clients_by_role': clients_by_role,
+        'rooms': registry.rooms_summary(),
+        'counters': dict(server_counters),
+        'queue_depth': {
+            'frame_slots': sum(1 for session in open_sessions if session.frame_slot.item is not None),
+            'decoding': frame_decoder.inflight if frame_decoder is not None else 0,
+            'decoded_slots': sum(1 for session in open_sessions if session.decoded_slot.item is not None),
+            'result_slots': sum(1 for session in open_sessions if session.result_slot.item is not None),
+            'inference_inflight': sum(workers['inflight']) if workers is not None else 0,
+        },
+        'workers': workers,
+        'decoder': frame_decoder.stats() if frame_decoder is not None else None,
+        'latency_ms': server_metrics.summary(),
+        'process_cpu_s': process_cpu,
+        'logs_dropped': dropped_logs(),
+        'config_version': current_config().version,
+        'startup_s': startup_report,
+        'preview': {
+            'attached': preview_attached(),
+            'sample_every': preview_settings.get("sample_every", 5),
+        },
+    }
+
+
+# Preview of the annotated frames... makita gihapon ang landmarks bisan walay cv2 window sa server
+# More details
+# A preview consumer is attached while cv2_show is on or /preview was requested in the last preview.idle_s seconds.
+# Only then does inference_stage ask the worker for an annotated image, and only for one of every
+# preview.sample_every processed frames of a session, the workers stay headless the rest of the time.
+def preview_attached():
+    return is_cv2_show or time.time() - preview_requested_at < preview_settings.get("idle_s", 10)
+
+
+# The /preview endpoint (MetricsServer, only with preview.enable): latest annotated frame as JPEG, of the user `?uuid=<uuid>` or of the
+# session that annotated last. The request itself attaches the preview, so the first one after a while finds
+# nothing (404) until the next sampled frame is processed. The JPEG is encoded per request, not per frame.
+def preview_jpeg(query):
+    global preview_requested_at
+    preview_requested_at = time.time()
+
+    if 'uuid' in query:
+        entry = registry.get(query['uuid'])
+        session = entry['session'] if entry is not None else None
+    else:
+        session = max(sessions.values(), key=lambda candidate: candidate.preview_at, default=None)
+
+    if session is None or session.preview is None:
+        return None
+
+    import cv2
+    encoded, jpeg = cv2.imencode('.jpg', session.preview)
+    return jpeg.tobytes() if encoded else None
+
 
 # This function handles incoming client connections.
 # It retrieves the client's address information from the writer and logs the connection.
@@ -436,45 +789,112 @@ async def cb(reader, writer):
 # This function initializes and starts the Unity streaming server.
 # It sets the server to listen on all available interfaces at port 5000.
 # It logs the server start time and port, then enters a loop to continuously serve incoming client connections.
+# The inference workers are started (and their runtimes loaded) before the first connection is accepted.
+# How long every phase took, from the first import of main.py until the port accepts connections, is logged
+# once as the startup report and kept in `startup_report` for /metrics.
 async def unity_stream():
+    global inference_pool, frame_decoder, server_ready
     host = '0.0.0.0'
     port = 10000 #5000
 
+    startup_report['imports'] = round(imports_s, 3)
+    started = time.perf_counter()
+
+    # side port first, docker sees "starting" (503) while the inference workers load
+    metrics_server = None
+    if metrics_server_settings.get("enable", False):
+        # /preview hands out camera frames of the users, it is only served when preview.enable turns it on
+        preview = preview_jpeg if preview_settings.get("enable", False) else None
+        metrics_server = MetricsServer(server_snapshot, server_healthy, metrics_server_settings.get("host", "127.0.0.1"), metrics_server_settings.get("port", 10001), preview)
+        await metrics_server.start()
+    startup_report['metrics_server'] = round(time.perf_counter() - started, 3)
+
+    started = time.perf_counter()
+    inference_pool = InferencePool()
+    workers = await inference_pool.start()
+    startup_report['inference_pool'] = round(time.perf_counter() - started, 3)
+    startup_report['workers'] = workers
+
+    frame_decoder = FrameDecoder()
+
+    started = time.perf_counter()
     server = await asyncio.start_server(cb, host, port)
+    server_ready = True
+    startup_report['listen'] = round(time.perf_counter() - started, 3)
+    startup_report['total'] = round(time.perf_counter() - imports_started, 3)
+
+    svc_log(f"Startup => {json.dumps(startup_report)}", "INFO", "Startup")
+
     current_time_gmt = datetime.now(timezone.utc)
 
     svc_msg = f'Server start at {current_time_gmt}, server port: {port}'
     svc_log(svc_msg)
 
-    async with server:
-        await server.serve_forever()
+    reporter = None
+    report_interval_s = metrics_settings.get("report_interval_s", 10)
+    if report_interval_s and report_interval_s > 0:
+        reporter = asyncio.create_task(metrics_reporter(report_interval_s))
+
+    reaper = asyncio.create_task(staled_user_reaper(default_settings.get("users_ttl_check_s", 1)))
+
+    watcher = None
+    if config_reload_settings.get("enable", False):
+        watcher = asyncio.create_task(config_watcher(config_reload_settings.get("interval_s", 2)))
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        server_ready = False
+        if reporter is not None:
+            reporter.cancel()
+        reaper.cancel()
+        if watcher is not None:
+            watcher.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        frame_decoder.shutdown()
+        inference_pool.shutdown()
 
 
 ## ------DEBUGGING SECTION---------------------DEBUGGING SECTION-----------------------DEBUGGING SECTION---------------------------- DEBUGGING SECTION ---------------------DEBUGGING SECTION------------------DEBUGGING SECTION----------------------------------------------------------------------------
+# The debug runners import cv2 and the organ/quiz code themselves, the server process does not need them at startup.
 def debug_feed():
+    import cv2
+    from BodyLandmarkPosition import calculate_position
+
+    mp_pose, mp_hands, mp_drawing = load_mediapipe()
+    use_hands = default_settings.get("quizz_mode", False)
+    session_graphs = get_graphs(with_hands=use_hands)
+    pose = session_graphs['pose']
+    hands = session_graphs['hands']
+
     cap = cv2.VideoCapture(0)
     while cap.isOpened():
         try:
             start_time = time.time()
+            settings = current_config().settings
 
             ret, frame = cap.read()
 
             adjustedFrame = frame
 
-            if default_settings["adjust_orientation"]:
+            if settings["adjust_orientation"]:
                 adjustedFrame = adjust_orientation(frame=frame);
             
             image = cv2.cvtColor(adjustedFrame, cv2.COLOR_BGR2RGB)
             image.flags.writeable = False
             
-            if default_settings["image_flip"]:
+            if settings["image_flip"]:
                 image = cv2.flip(image, 1);
             
             pose_results = pose.process(image)
             landmarks = pose_results.pose_landmarks
             
-            hands_results = hands.process(image)
-            hands_marks = hands_results.multi_hand_landmarks
+            hands_marks = None
+            if use_hands:
+                hands_results = hands.process(image)
+                hands_marks = hands_results.multi_hand_landmarks
 
             if landmarks or hands_marks:
                 image.flags.writeable = True
@@ -496,11 +916,11 @@ def debug_feed():
                         'image': image
                     }
                     
-                    debug_organ = default_settings["debug_organ"]
+                    debug_organ = settings["debug_organ"]
                     results =  calculate_position(debug_organ, args)
                     
                     if results is not None:
-                        if isinstance(results, str) and results == default_settings["err_distance"]:
+                        if isinstance(results, str) and results == settings["err_distance"]:
                             print("The person is not at the proper distance. Please move closer or farther to adjust to the correct distance.")
                         else:    
                             common_position, unity_position = results
@@ -519,18 +939,27 @@ def debug_feed():
 
 
 def debug_quizz():
+    import cv2
+    from Quizz import start_quiz_func
+
+    mp_pose, mp_hands, mp_drawing = load_mediapipe()
+    session_graphs = get_graphs()
+    pose = session_graphs['pose']
+    hands = session_graphs['hands']
+
     cap = cv2.VideoCapture(0)
     while cap.isOpened():
         ret, frame = cap.read()
+        settings = current_config().settings
 
         adjustedFrame = frame
 
-        if default_settings["adjust_orientation"]:
+        if settings["adjust_orientation"]:
             adjustedFrame = adjust_orientation(frame=frame);
         
         image = cv2.cvtColor(adjustedFrame, cv2.COLOR_BGR2RGB)
         
-        if default_settings["image_flip"]:
+        if settings["image_flip"]:
             image = cv2.flip(image, 1);
 
         image.flags.writeable = False
@@ -577,6 +1006,8 @@ def debug_quizz():
     cv2.destroyAllWindows()  
 
 def main():
+    init_log_folders(clean=True)
+
     log_config = configs["default"]
     svc_log(f"Default settings  =>  {log_config}")
 
@@ -0,0 +1,22 @@
+import os
+import sys
+import shutil
+import tempfile
+
+# the settings are read relative to the repo root (config.py), the modules are top level
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(root)
+sys.path.insert(0, root)
+
+import Logger
+
+# the tests log like the server does, into a folder of their own instead of the repo's logs/
+log_folder = tempfile.mkdtemp(prefix="body-track-logs-")
+Logger.folder_path = log_folder
+Logger.folder_path_calc_response_time = os.path.join(log_folder, "calc-response-time")
+Logger.folder_path_svc = os.path.join(log_folder, "svc")
+
+
+def pytest_sessionfinish(session, exitstatus):
+    Logger.stop_loggers()
+    shutil.rmtree(log_folder, ignore_errors=True)
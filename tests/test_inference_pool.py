@@ -0,0 +1,65 @@
+import asyncio
+from concurrent.futures import BrokenExecutor
+from concurrent.futures.thread import BrokenThreadPool
+
+import pytest
+
+import Inference
+from Inference import InferencePool
+
+
+class FakeSession:
+
+    def __init__(self, key):
+        self.key = key
+        self.worker = None
+
+
+# Executor of a worker that died, like a ProcessPoolExecutor after its process was killed
+class BrokenPool:
+
+    def submit(self, *args, **kwargs):
+        raise BrokenThreadPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # no mediapipe in these tests, the workers only answer
+    monkeypatch.setattr(Inference, "worker_ready", lambda config=None, warm=1: {'pid': 0, 'mediapipe_s': 0, 'warm_s': 0})
+    monkeypatch.setattr(Inference, "process_host_frame", lambda *args: ("results", None, {}, None, None))
+    pool = InferencePool(mode="thread", workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_dead_worker_is_restarted_and_its_sessions_move(pool):
+    async def scenario():
+        first = FakeSession(1)
+        assert pool.assign(first) == 0
+
+        pool.executors[0] = BrokenPool()
+        with pytest.raises(BrokenExecutor):
+            await pool.run(first, None, "heart")
+
+        assert pool.dead[0] and not pool.healthy()
+
+        # new and moved sessions go to the live worker while the dead one restarts
+        second = FakeSession(2)
+        assert pool.assign(second) == 1
+        assert await pool.run(first, None, "heart") == ("results", None, {}, None, None)
+        assert first.worker == 1
+        assert pool.pinned == [0, 2]
+
+        for _ in range(100):
+            if pool.healthy():
+                break
+            await asyncio.sleep(0.01)
+        assert pool.healthy() and pool.restarts == [1, 0]
+
+        third = FakeSession(3)
+        assert pool.assign(third) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,108 @@
+import copy
+
+import pytest
+
+from config import current_config
+from Offsets import CompiledOffsets, aspect_ratio_tolerance
+
+
+# The walk BodyLandmarkPosition did on the YAML dict every frame before the offsets were compiled
+def walked_aspect_ratio(settings, image_height, image_width):
+    aspect_ratio = image_height / image_width
+
+    for aspr in settings["aspect_ratio_list"]:
+        w, h = aspr.split("_by_")
+        if abs(aspect_ratio - (float(w) / float(h))) < aspect_ratio_tolerance:
+            return aspr
+
+    return None
+
+
+def walked_additional(calibration, axes, target, estimate_distance):
+    stored = []
+
+    for axis in axes:
+        if calibration[axis]:
+            if not calibration[axis]["enable"]:
+                stored.append(0)
+                continue
+
+            operator = calibration[axis]["operator"]
+            additional = (estimate_distance - calibration["minimum"]) * calibration[axis][target]
+
+            if operator == "subtraction":
+                stored.append(-additional)
+            if operator == "addition":
+                stored.append(additional)
+
+    return stored
+
+
+def compiled_additional(coefficients, minimum, estimate_distance, count):
+    return [(estimate_distance - minimum) * coefficient for coefficient in coefficients[:count]]
+
+
+def offsets_settings():
+    return copy.deepcopy(current_config().configs["offsets"]["settings"])
+
+
+# the shipped file plus an aspect ratio with addition and disabled axes, so both operators are covered
+def extended_settings():
+    settings = offsets_settings()
+    base_name = settings["aspect_ratio_list"][0]
+
+    extra = copy.deepcopy(settings["aspect_ratio"][base_name])
+    for organ, offsets in extra.items():
+        calibration = offsets["calibration"]
+        calibration["x_offset"] = { 'enable': True, 'operator': "addition", 'common': 1.5, 'unity': 0.25 }
+        calibration["z_offset"] = { 'enable': False, 'operator': "subtraction", 'common': 9, 'unity': 9 }
+
+    settings["aspect_ratio_list"] = list(settings["aspect_ratio_list"]) + ["4_by_3"]
+    settings["aspect_ratio"]["4_by_3"] = extra
+    return settings
+
+
+@pytest.mark.parametrize("settings", [offsets_settings(), extended_settings()], ids=["shipped", "extended"])
+def test_compiled_records_match_the_yaml_walk(settings):
+    compiled = CompiledOffsets(settings)
+
+    for aspect_ratio in settings["aspect_ratio_list"]:
+        for organ, offsets in settings["aspect_ratio"][aspect_ratio].items():
+            record = compiled.organ(aspect_ratio, organ)
+            calibration = offsets["calibration"]
+
+            assert tuple(record.common[:2]) == (offsets["common"]["x_offset"], offsets["common"]["y_offset"])
+            assert tuple(record.unity) == (offsets["unity"]["x_offset"], offsets["unity"]["y_offset"], offsets["unity"]["z_offset"])
+            assert (record.minimum, record.maximum) == (calibration["minimum"], calibration["maximum"])
+
+            for estimate_distance in [calibration["minimum"], 12.5, calibration["maximum"] + 3]:
+                assert compiled_additional(record.common_coefficients, record.minimum, estimate_distance, 2) == pytest.approx(walked_additional(calibration, ["x_offset", "y_offset"], "common", estimate_distance))
+                assert compiled_additional(record.unity_coefficients, record.minimum, estimate_distance, 3) == pytest.approx(walked_additional(calibration, ["x_offset", "y_offset", "z_offset"], "unity", estimate_distance))
+
+
+@pytest.mark.parametrize("resolution", [(1280, 720), (1920, 1080), (720, 1280), (640, 480), (612, 408), (1000, 1000)])
+def test_aspect_ratio_matches_the_yaml_walk(resolution):
+    settings = extended_settings()
+    compiled = CompiledOffsets(settings)
+
+    assert compiled.aspect_ratio(*resolution) == walked_aspect_ratio(settings, *resolution)
+    # the second frame of the same phone is a cached lookup with the same answer
+    assert compiled.aspect_ratio(*resolution) == walked_aspect_ratio(settings, *resolution)
+    assert resolution in compiled.resolutions
+
+
+def test_unknown_operator_fails_while_compiling():
+    settings = offsets_settings()
+    aspect_ratio = settings["aspect_ratio_list"][0]
+    organ = next(iter(settings["aspect_ratio"][aspect_ratio]))
+    settings["aspect_ratio"][aspect_ratio][organ]["calibration"]["y_offset"] = { 'enable': True, 'operator': "multiply", 'common': 1, 'unity': 1 }
+
+    with pytest.raises(ValueError):
+        CompiledOffsets(settings)
+
+
+def test_records_are_immutable():
+    compiled = CompiledOffsets(offsets_settings())
+
+    with pytest.raises(TypeError):
+        compiled.records[("16_by_9", "heart")] = None
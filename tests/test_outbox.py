@@ -0,0 +1,76 @@
+import asyncio
+
+from Session import Outbox
+
+
+def take_all(outbox):
+    items = []
+    while outbox:
+        items.append(outbox.take())
+    return items
+
+
+def test_keyed_message_replaces_the_unsent_one_in_place():
+    outbox = Outbox()
+
+    assert outbox.put("result 1", "result") is None
+    assert outbox.put("notice") is None
+    assert outbox.put("result 2", "result") == "coalesced"
+
+    assert take_all(outbox) == ["result 2", "notice"]
+
+
+def test_messages_without_key_keep_their_order():
+    outbox = Outbox()
+
+    for message in ["a", "b", "c"]:
+        outbox.put(message)
+
+    assert take_all(outbox) == ["a", "b", "c"]
+
+
+def test_oldest_message_is_dropped_above_the_limit():
+    outbox = Outbox(limit=2)
+
+    assert outbox.put("a") is None
+    assert outbox.put("b", "result") is None
+    assert outbox.put("c") == "dropped"
+
+    assert len(outbox) == 2
+    assert take_all(outbox) == ["b", "c"]
+
+
+def test_a_taken_key_is_not_coalesced_again():
+    outbox = Outbox()
+
+    outbox.put("result 1", "result")
+    assert outbox.take() == "result 1"
+    assert outbox.put("result 2", "result") is None
+
+
+def test_put_wakes_the_waiting_writer():
+    async def scenario():
+        outbox = Outbox()
+        waiting = asyncio.create_task(outbox.wait())
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        outbox.put("message")
+        await asyncio.wait_for(waiting, timeout=1)
+        assert outbox.take() == "message"
+
+    asyncio.run(scenario())
+
+
+def test_wait_returns_on_the_room_change():
+    async def scenario():
+        outbox = Outbox()
+        change = asyncio.get_running_loop().create_future()
+        waiting = asyncio.create_task(outbox.wait(change))
+        await asyncio.sleep(0)
+
+        change.set_result(None)
+        await asyncio.wait_for(waiting, timeout=1)
+        assert not outbox
+
+    asyncio.run(scenario())
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import struct
+
+import pytest
+
+import main
+from Protocol import (
+    MessageReader, ProtocolError, parse_organs, encode_unity_position, encode_unity_positions,
+    organ_ids, track_supported, unknown_organ_id, KIND_UNITY_POSITION, KIND_UNITY_POSITIONS,
+)
+from Session import ClientSession
+from test_room_broadcast import FakeWriter
+
+
+def point(x, y, z):
+    return { 'x': x, 'y': y, 'z': z }
+
+
+# What the Unity client reads from a KIND_UNITY_POSITIONS message, organ name => list of (x, y, z)
+def decode_positions(data):
+    kind, reserved, count, seq = struct.unpack_from("<BBHI", data, 0)
+    offset = 8
+    organs = {}
+
+    for _ in range(count):
+        organ_id, reserved, points = struct.unpack_from("<BBH", data, offset)
+        offset += 4
+        values = struct.unpack_from(f"<{points * 3}f", data, offset)
+        offset += points * 12
+        organs[track_supported[organ_id]] = [values[idx:idx + 3] for idx in range(0, len(values), 3)]
+
+    assert offset == len(data)
+    return kind, seq, organs
+
+
+def test_single_organ_layout():
+    data = encode_unity_position(point(0.5, -1.25, 3.0), "heart", seq=7)
+
+    assert len(data) == 8 + 3 * 4
+    assert struct.unpack("<BBHI3f", data) == (KIND_UNITY_POSITION, organ_ids["heart"], 1, 7, 0.5, -1.25, 3.0)
+
+
+def test_body_sends_every_point():
+    points = [point(idx, idx + 0.5, -idx) for idx in range(11)]
+    data = encode_unity_position(points, "body", seq=1)
+
+    header = struct.unpack_from("<BBHI", data)
+    assert header == (KIND_UNITY_POSITION, organ_ids["body"], 11, 1)
+    assert struct.unpack_from("<33f", data, 8)[-3:] == (10.0, 10.5, -10.0)
+
+
+def test_unknown_organ_and_seq_wrap():
+    data = encode_unity_position(point(0, 0, 0), "spleen", seq=2 ** 32 + 5)
+    kind, organ_id, count, seq = struct.unpack_from("<BBHI", data)
+
+    assert organ_id == unknown_organ_id
+    assert seq == 5
+
+
+def test_binary_never_starts_like_json():
+    assert encode_unity_position(point(0, 0, 0), "brain")[0] != ord("{")
+    assert encode_unity_positions({ 'brain': point(0, 0, 0) })[0] != ord("{")
+
+
+def test_several_organs_layout():
+    positions = {
+        'heart': point(1.0, 2.0, 3.0),
+        'body': [point(0.0, 0.5, 1.0), point(-1.0, -0.5, 2.0)],
+    }
+    kind, seq, organs = decode_positions(encode_unity_positions(positions, seq=42))
+
+    assert kind == KIND_UNITY_POSITIONS
+    assert seq == 42
+    assert organs == { 'heart': [(1.0, 2.0, 3.0)], 'body': [(0.0, 0.5, 1.0), (-1.0, -0.5, 2.0)] }
+
+
+@pytest.mark.parametrize("selection, organs", [
+    ("heart", ["heart"]),
+    (" Heart , LUNGS ", ["heart", "lungs"]),
+    ("heart,heart", ["heart"]),
+    (["liver", "brain"], ["liver", "brain"]),
+    ("all", list(track_supported)),
+    ("heart,spleen", None),
+    ("", None),
+    ([], None),
+    (None, None),
+])
+def test_parse_organs(selection, organs):
+    assert parse_organs(selection) == organs
+
+
+def length_prefixed(data):
+    return len(data).to_bytes(4, byteorder='little') + data
+
+
+def test_oversized_message_is_refused():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(length_prefixed(b'{"message": "PING", "uuid": "too-long"}'))
+        messages = MessageReader(reader, max_json=16)
+
+        with pytest.raises(ProtocolError):
+            await messages.read_json()
+
+    asyncio.run(scenario())
+
+
+def test_header_stamp_is_cleared_at_eof():
+    async def scenario():
+        reader = asyncio.StreamReader()
+        reader.feed_data(length_prefixed(b""))
+        reader.feed_eof()
+        messages = MessageReader(reader)
+
+        assert await messages.read_frame() == b""
+        assert messages.header_time is not None
+
+        with pytest.raises(asyncio.IncompleteReadError):
+            await messages.read_json()
+        # no length prefix in this read, nothing may be timed from the previous one
+        assert messages.header_time is None and messages.header_at is None
+
+    asyncio.run(scenario())
+
+
+# Run the reader stage of a guest connection on one PING (and its empty frame), return the session
+async def ping(uuid, encoding):
+    reader = asyncio.StreamReader()
+    reader.feed_data(length_prefixed(json.dumps({ 'uuid': uuid, 'role': "Guest", 'message': "PING", 'encoding': encoding, 'room': "encoding" }).encode()))
+    reader.feed_data(length_prefixed(b""))
+    reader.feed_eof()
+
+    session = ClientSession(reader, FakeWriter(3))
+    session.messages = MessageReader(reader)
+    await main.reader_stage(session)
+    return session
+
+
+def test_ping_negotiates_binary_results():
+    async def scenario():
+        session = await ping("binary-guest", "binary")
+        try:
+            assert session.encoding == "binary"
+
+            await main.send_unity_position("binary-guest", point(1.0, 2.0, 3.0), session, track_type="heart", seq=3)
+            data = session.outbox.take()['data']
+            assert data[4:] == encode_unity_position(point(1.0, 2.0, 3.0), "heart", 3)
+        finally:
+            main.registry.remove("binary-guest")
+
+    asyncio.run(scenario())
+
+
+def test_unknown_encoding_keeps_json():
+    async def scenario():
+        session = await ping("json-guest", "protobuf")
+        try:
+            assert session.encoding == "json"
+
+            await main.send_unity_position("json-guest", point(1.0, 2.0, 3.0), session, track_type="heart")
+            data = session.outbox.take()['data']
+            assert json.loads(data[4:]) == point(1.0, 2.0, 3.0)
+        finally:
+            main.registry.remove("json-guest")
+
+    asyncio.run(scenario())
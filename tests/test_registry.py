@@ -0,0 +1,106 @@
+import pytest
+
+import Registry
+from Registry import ClientRegistry, default_room
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(Registry.time, "time", clock)
+    return clock
+
+
+def add(registry, uuid, role="Guest", room=default_room):
+    return registry.add(uuid, role, ("127.0.0.1", 1), None, None, room)
+
+
+def test_expired_returns_the_inactive_users_oldest_first(clock):
+    registry = ClientRegistry()
+    add(registry, "a")
+    clock.now += 5
+    add(registry, "b")
+
+    assert registry.expired(30, now=clock.now + 20) == []
+    assert registry.expired(30, now=clock.now + 40) == ["a", "b"]
+    # they stay registered until removed, and are not reported twice
+    assert "a" in registry and "b" in registry
+    assert registry.expired(30, now=clock.now + 50) == []
+
+
+def test_touch_postpones_the_expiry(clock):
+    registry = ClientRegistry()
+    add(registry, "a")
+
+    clock.now += 20
+    registry.touch("a")
+
+    assert registry.expired(30, now=clock.now + 11) == []
+    assert registry.expired(30, now=clock.now + 31) == ["a"]
+
+
+def test_touch_does_not_grow_the_heap(clock):
+    registry = ClientRegistry()
+    add(registry, "a")
+
+    for _ in range(100):
+        clock.now += 1
+        registry.touch("a")
+
+    assert len(registry.expiry) == 1
+    assert registry.expired(30, now=clock.now + 10) == []
+    assert len(registry.expiry) == 1
+
+
+def test_removed_user_never_expires(clock):
+    registry = ClientRegistry()
+    add(registry, "a")
+    registry.remove("a")
+
+    assert registry.expired(30, now=clock.now + 100) == []
+    assert registry.expiry == []
+
+
+def test_reconnect_uses_the_new_entry(clock):
+    registry = ClientRegistry()
+    add(registry, "a")
+    registry.remove("a")
+
+    clock.now += 10
+    add(registry, "a")
+
+    # the leftover heap entry of the first connection is skipped
+    assert registry.expired(30, now=clock.now + 25) == []
+    assert registry.expired(30, now=clock.now + 31) == ["a"]
+
+
+def test_role_and_room_indexes_follow_the_changes(clock):
+    registry = ClientRegistry()
+    add(registry, "host", "Host", "r1")
+    add(registry, "guest", "Guest", "r1")
+    add(registry, "other-host", "Host", "r2")
+
+    assert registry.host("r1") == "host"
+    assert registry.members("Guest", "r1") == {"guest"}
+    assert registry.count("Host") == 2
+
+    registry.set_role("guest", "Host")
+    assert registry.host("r1") is None
+    assert registry.count("Host", "r1") == 2
+
+    registry.set_room("guest", "r2")
+    assert registry.host("r1") == "host"
+    assert registry.members("Host", "r2") == {"other-host", "guest"}
+
+    registry.remove("host")
+    assert registry.room("r1") is None
+    assert registry.role_counts() == { 'Host': 2 }
@@ -0,0 +1,72 @@
+import asyncio
+
+import main
+from Registry import default_room
+from Session import ClientSession
+
+
+# Writer that keeps what the server wrote instead of sending it
+class FakeWriter:
+
+    def __init__(self, port):
+        self.port = port
+        self.written = []
+        self.closing = False
+
+    def get_extra_info(self, name):
+        return ("127.0.0.1", self.port) if name == 'peername' else None
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        pass
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.closing = True
+
+    async def wait_closed(self):
+        pass
+
+
+async def broadcast_to_guest(room=None):
+    host_writer = FakeWriter(1)
+    guest_writer = FakeWriter(2)
+    host = ClientSession(None, host_writer)
+    guest = ClientSession(None, guest_writer)
+
+    # the guest's writer is started before its first PING, like in handle_client
+    writer_task = asyncio.create_task(main.outbox_stage(guest))
+    await asyncio.sleep(0)
+
+    room = room or default_room
+    await main.register_user("test-host", "Host", host.addr, host_writer, host, room)
+    await main.register_user("test-guest", "Guest", guest.addr, guest_writer, guest, room)
+    await asyncio.sleep(0)
+
+    message = b"position"
+    main.registry.room(room).publish(main.outbox_message(message, host, None, 'send_json_message', 'messages_sent'))
+
+    for _ in range(10):
+        if guest_writer.written:
+            break
+        await asyncio.sleep(0.01)
+
+    guest_writer.close()
+    writer_task.cancel()
+    await asyncio.gather(writer_task, return_exceptions=True)
+    main.registry.remove("test-host")
+    main.registry.remove("test-guest")
+
+    return guest_writer.written
+
+
+def test_default_room_guest_receives_host_broadcast():
+    assert asyncio.run(broadcast_to_guest()) == [b"position"]
+
+
+def test_named_room_guest_receives_host_broadcast():
+    assert asyncio.run(broadcast_to_guest("r1")) == [b"position"]